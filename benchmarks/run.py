@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+'''Benchmark harness of the dataset loader and of the cross-validation modules
+
+Synthetic datasets in the `load_csv` layout (index column, `--features` features, label
+column) are generated once, at several sizes and file counts, in `--data` (reused by later
+runs). The harness then times
+
+ - `DatasetLoader.load_csv` with both engines, on every dataset
+ - `KFoldCV.update` and `XGBKFoldCV.update` on small fixed grids, on the smallest dataset
+
+`--repeat` times each, and stores the results in `benchmarks/results/<commit>.json` (with
+the machine description). `--compare REF` compares the medians with the results stored for
+another commit (or a results file) and exits with code 1 if any benchmark is slower by more
+than `--threshold` (relative).
+
+    python benchmarks/run.py [--suite small|large] [--repeat 3] [--compare HEAD~1] [--threshold 0.1]
+'''
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+os.environ.setdefault('TUNA_PATH', str(ROOT))
+
+## (rows, files) of the generated datasets
+SUITES = {
+    'small': [(20_000, 1), (100_000, 10)],
+    'large': [(1_000_000, 20), (5_000_000, 100)],
+}
+
+ADABOOST_GRID = {
+    'estimator__max_depth': [2, 3], 'estimator__min_impurity_decrease': [0.0], 'estimator__min_samples_split': [10],
+    'estimator__min_samples_leaf': [5], 'estimator__ccp_alpha': [0.0], 'n_estimators': [10, 20], 'learning_rate': [0.5],
+    'algorithm': ['SAMME'],
+}
+XGB_GRID = {
+    'learning_rate': [0.1, 0.3], 'min_split_loss': [0], 'max_depth': [3, 4], 'min_child_weight': [1], 'max_delta_step': [0],
+    'colsample_bytree': [1], 'colsample_bylevel': [1], 'colsample_bynode': [1], 'n_estimators': [20],
+}
+
+
+def generate(directory: Path, n_rows: int, n_files: int, n_features: int, seed: int = 0) -> str:
+    '''Write (once) a synthetic two-class dataset split in `n_files` csv files, return its glob'''
+
+    dataset = directory / f'rows{n_rows}_files{n_files}_features{n_features}'
+    pattern = str(dataset / '*.txt')
+    if (dataset / '.complete').exists():
+        return pattern
+
+    dataset.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    weights = rng.normal(size=n_features)
+    offset = 0
+    for idx, rows in enumerate(np.array_split(np.arange(n_rows), n_files)):
+        features = rng.normal(size=(rows.size, n_features))
+        probability = 1 / (1 + np.exp(-(features @ weights) / np.sqrt(n_features)))
+        labels = (rng.random(rows.size) < probability).astype(float)
+        matrix = np.column_stack((np.arange(offset, offset + rows.size), features, labels))
+        np.savetxt(dataset / f'part{idx:04d}.txt', matrix, delimiter=',', fmt='%.6g')
+        offset += rows.size
+    (dataset / '.complete').touch()
+    return pattern
+
+
+def timeit(function, repeat: int) -> dict:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        ## The modules and the loader are verbose, keep the report readable
+        with contextlib.redirect_stdout(io.StringIO()):
+            function()
+        times.append(time.perf_counter() - start)
+    return {'times': times, 'median': float(np.median(times)), 'min': float(np.min(times))}
+
+
+def run_module(module_class, dataset: str, grid: dict, output: str, n_jobs: int) -> None:
+    from tuna.utils.helpers import ModuleConfiguration
+
+    configuration = ModuleConfiguration({
+        'module_name': module_class.__name__, 'training_dataset_path': dataset, 'output_path': output,
+        'output_name': module_class.__name__, 'kfolds': [3, 1], 'n_jobs': n_jobs, 'random_state': 0,
+        'profile_report': False, **grid
+    })
+    module_class()(configuration)
+
+
+def commit() -> tuple[str, bool]:
+    '''Current commit of the repository and whether the tree has uncommitted changes'''
+
+    try:
+        sha = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT,
+                                    capture_output=True, text=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown', True
+    return sha, dirty
+
+
+def machine() -> dict:
+    import sklearn
+    import xgboost
+
+    return {
+        'platform': platform.platform(), 'processor': platform.processor(), 'cpus': os.cpu_count(),
+        'python': platform.python_version(), 'numpy': np.__version__, 'sklearn': sklearn.__version__, 'xgboost': xgboost.__version__,
+    }
+
+
+def results_file(directory: Path, reference: str) -> Path:
+    '''Results of `reference`, either a results file or a git revision'''
+
+    if Path(reference).is_file():
+        return Path(reference)
+    sha = subprocess.run(['git', 'rev-parse', reference], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    return directory / f'{sha[:12]}.json'
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> bool:
+    '''Print the ratio of the medians, return `True` if any benchmark regressed beyond `threshold`'''
+
+    regressed = False
+    print(f'\nComparison with {baseline["commit"][:12]} (threshold +{threshold:.0%})')
+    for name, result in current['results'].items():
+        if name not in baseline['results']:
+            print(f'  {name:<45} new')
+            continue
+        ratio = result['median'] / baseline['results'][name]['median']
+        status = 'REGRESSION' if ratio > 1 + threshold else ('faster' if ratio < 1 - threshold else 'ok')
+        regressed |= status == 'REGRESSION'
+        print(f'  {name:<45} {baseline["results"][name]["median"]:9.3f} s -> {result["median"]:9.3f} s  x{ratio:5.2f}  {status}')
+    return regressed
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser('benchmarks')
+    parser.add_argument('--suite', choices=list(SUITES), default='small')
+    parser.add_argument('--features', type=int, default=13)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--n-jobs', type=int, default=1, help='n_jobs of the modules (default 1, the least noisy)')
+    parser.add_argument('--data', default=os.path.join(tempfile.gettempdir(), 'tuna_benchmarks'), help='Directory of the generated datasets')
+    parser.add_argument('--results', default=str(ROOT / 'benchmarks' / 'results'), help='Directory of the stored results')
+    parser.add_argument('--compare', default=None, metavar='REF', help='Git revision (or results file) to compare with')
+    parser.add_argument('--threshold', type=float, default=0.1, help='Relative slowdown counted as a regression (default 0.1)')
+    parser.add_argument('--no-save', action='store_true', help='Do not store the results')
+    args = parser.parse_args()
+
+    from tuna.modules.kfold_cv import KFoldCV
+    from tuna.modules.xgb_kfold_cv import XGBKFoldCV
+    from tuna.utils.loaders import DatasetLoader
+
+    datasets = [(rows, files, generate(Path(args.data), rows, files, args.features)) for rows, files in SUITES[args.suite]]
+
+    results = {}
+    for rows, files, dataset in datasets:
+        for engine in ('numpy', 'pandas'):
+            name = f'load_csv[{engine}] {rows} rows / {files} files'
+            results[name] = timeit(lambda: DatasetLoader.load_csv(dataset, engine=engine, random_state=0), args.repeat)
+            print(f'{name:<45} {results[name]["median"]:9.3f} s')
+
+    rows, files, dataset = datasets[0]
+    with tempfile.TemporaryDirectory() as output:
+        for module_class, grid in ((KFoldCV, ADABOOST_GRID), (XGBKFoldCV, XGB_GRID)):
+            name = f'{module_class.__name__}.update {rows} rows'
+            results[name] = timeit(lambda: run_module(module_class, dataset, grid, output, args.n_jobs), args.repeat)
+            print(f'{name:<45} {results[name]["median"]:9.3f} s')
+
+    sha, dirty = commit()
+    current = {
+        'commit': sha, 'dirty': dirty, 'date': time.strftime('%Y-%m-%dT%H:%M:%S'), 'suite': args.suite,
+        'repeat': args.repeat, 'n_jobs': args.n_jobs, 'machine': machine(), 'results': results,
+    }
+
+    results_directory = Path(args.results)
+    if not args.no_save:
+        results_directory.mkdir(parents=True, exist_ok=True)
+        path = results_directory / f'{sha[:12]}{"-dirty" if dirty else ""}.json'
+        with open(path, 'w') as f:
+            json.dump(current, f, indent=1)
+        print(f'\nResults stored in {path}')
+
+    if args.compare:
+        with open(results_file(results_directory, args.compare)) as f:
+            baseline = json.load(f)
+        if baseline.get('suite') != args.suite or baseline.get('machine', {}).get('cpus') != current['machine']['cpus']:
+            print('Warning: the baseline was run with a different suite or on a different machine')
+        return 1 if compare(current, baseline, args.threshold) else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
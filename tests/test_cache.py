@@ -0,0 +1,213 @@
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+
+from sklearn.model_selection import StratifiedKFold
+from sklearn.tree import DecisionTreeClassifier
+
+from tuna.utils.cache import DatasetCache, FitCache
+from tuna.utils.loaders import DatasetLoader
+from tuna.utils.search import FoldSearchCV
+
+
+def write_csv(path: Path, n_rows: int, seed: int) -> None:
+    '''Index, two features and the label, as the files of the repo'''
+
+    rng = np.random.default_rng(seed)
+    matrix = np.c_[np.arange(n_rows), rng.normal(size=(n_rows, 2)), rng.integers(0, 2, n_rows)]
+    np.savetxt(path, matrix, delimiter=',')
+
+
+def cache_bytes(cache: DatasetCache) -> int:
+    return sum(entry.stat().st_size for entry in cache.path.rglob('*') if entry.is_file())
+
+
+def test_csv_shards_are_evicted_under_the_size_cap(tmp_path):
+    for name in ('a', 'b'):
+        (tmp_path / name).mkdir()
+        for idx in range(3):
+            write_csv(tmp_path / name / f'{idx}.txt', 20, seed=ord(name) + idx)
+
+    ## About 1 kB, less than the shards of a single load
+    cache = DatasetCache(str(tmp_path / 'cache'), max_size_gb=1e-6)
+    for _ in range(3):
+        for name in ('a', 'b'):
+            DatasetLoader.load_csv(str(tmp_path / name / '*.txt'), cache=cache)
+
+    ## Only the entry and the shards of the last load are left
+    files = [str(tmp_path / 'b' / f'{idx}.txt') for idx in range(3)]
+    kept = {cache.entry(DatasetCache.key(files, [1, 2, 3], dtype='float64'))}
+    kept |= {cache.shard(DatasetCache.key([file], [1, 2, 3], dtype='float64')) for file in files}
+    assert set(cache.path.rglob('*.npy')) == kept
+    assert cache_bytes(cache) == sum(entry.stat().st_size for entry in kept)
+
+
+def test_csv_glob_is_reloaded_memory_mapped(tmp_path):
+    for idx in range(2):
+        write_csv(tmp_path / f'{idx}.txt', 30, seed=idx)
+    cache = DatasetCache(str(tmp_path / 'cache'))
+    path = str(tmp_path / '*.txt')
+
+    first = DatasetLoader.load_csv(path, cache=cache, shuffle=False)
+    ## An appended file is parsed alone, the new glob is assembled from the shards
+    write_csv(tmp_path / '2.txt', 30, seed=2)
+    second = DatasetLoader.load_csv(path, cache=cache, shuffle=False)
+    third = DatasetLoader.load_csv(path, cache=cache, shuffle=False)
+
+    expected = np.concatenate([np.loadtxt(tmp_path / f'{idx}.txt', delimiter=',') for idx in range(3)])
+    np.testing.assert_array_equal(second.features, expected[:, 1:-1])
+    np.testing.assert_array_equal(third.features, second.features)
+    np.testing.assert_array_equal(first.features, second.features[:60])
+
+    matrix = cache.get(DatasetCache.key(sorted(str(file) for file in tmp_path.glob('*.txt')), [1, 2, 3], dtype='float64'))
+    assert isinstance(matrix, np.memmap) and not matrix.flags.writeable
+    assert len(list((cache.path / 'shards').glob('*.npy'))) == 3
+
+
+def test_key_changes_with_the_files_and_the_columns(tmp_path):
+    for idx in range(2):
+        write_csv(tmp_path / f'{idx}.txt', 10, seed=idx)
+    files = [str(tmp_path / f'{idx}.txt') for idx in range(2)]
+    key = DatasetCache.key(files, [1, 2, 3], dtype='float64')
+
+    assert DatasetCache.key(files[::-1], [1, 2, 3], dtype='float64') == key
+    assert DatasetCache.key(files, [1, 2], dtype='float64') != key
+    assert DatasetCache.key(files, [1, 2, 3], dtype='float32') != key
+    assert DatasetCache.key(files[:1], [1, 2, 3], dtype='float64') != key
+
+    ## Same size, new modification time
+    stat = os.stat(files[0])
+    os.utime(files[0], ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    assert DatasetCache.key(files, [1, 2, 3], dtype='float64') != key
+
+
+def test_modified_file_is_not_read_from_the_cache(tmp_path):
+    for idx in range(2):
+        write_csv(tmp_path / f'{idx}.txt', 20, seed=idx)
+    cache = DatasetCache(str(tmp_path / 'cache'))
+    path = str(tmp_path / '*.txt')
+
+    DatasetLoader.load_csv(path, cache=cache, shuffle=False)
+    write_csv(tmp_path / '1.txt', 25, seed=10)
+    loader = DatasetLoader.load_csv(path, cache=cache, shuffle=False)
+
+    expected = np.concatenate([np.loadtxt(tmp_path / f'{idx}.txt', delimiter=',') for idx in range(2)])
+    np.testing.assert_array_equal(loader.features, expected[:, 1:-1])
+    np.testing.assert_array_equal(loader.labels, expected[:, -1])
+
+
+def test_least_recently_used_entry_is_evicted(tmp_path):
+    array = np.arange(1000, dtype=np.float64)
+    cache = DatasetCache(str(tmp_path))
+    size = cache.put('probe', array).stat().st_size
+    cache.entry('probe').unlink()
+
+    ## Room for two entries
+    cache = DatasetCache(str(tmp_path), max_size_gb=2.5 * size / 1024**3)
+    cache.put('a', array)
+    cache.put('b', array + 1)
+    for age, key in ((200, 'a'), (100, 'b')):
+        os.utime(cache.entry(key), (time.time() - age, time.time() - age))
+
+    ## `a` is the oldest stored, but the most recently read
+    np.testing.assert_array_equal(cache.get('a'), array)
+    cache.put('c', array + 2)
+
+    assert cache.get('b') is None
+    np.testing.assert_array_equal(cache.get('a'), array)
+    np.testing.assert_array_equal(cache.get('c'), array + 2)
+
+
+def test_unreadable_entry_is_a_miss(tmp_path):
+    cache = DatasetCache(str(tmp_path))
+    cache.entry('broken').write_bytes(b'not a npy file')
+    assert cache.get('broken') is None
+    assert not cache.entry('broken').exists()
+
+
+def test_failed_file_is_skipped_until_it_changes(tmp_path, monkeypatch):
+    from tuna.utils import loaders
+
+    parsed = []
+    parse_file = loaders._parse_file
+
+    def counting_parse(file, *args, **kwargs):
+        parsed.append(Path(file).name)
+        return parse_file(file, *args, **kwargs)
+
+    monkeypatch.setattr(loaders, '_parse_file', counting_parse)
+    for idx in range(2):
+        write_csv(tmp_path / f'{idx}.txt', 20, seed=idx)
+    (tmp_path / '2.txt').write_text('garbage\n')
+    cache = DatasetCache(str(tmp_path / 'cache'))
+    path = str(tmp_path / '*.txt')
+
+    first = DatasetLoader.load_csv(path, cache=cache, shuffle=False)
+    assert sorted(parsed) == ['0.txt', '1.txt', '2.txt']
+    assert len(first.labels) == 40
+    markers = list((cache.path / 'shards').glob('*.failed'))
+    assert len(markers) == 1 and str(tmp_path / '2.txt') in markers[0].read_text()
+
+    ## With a file appended, neither the shards nor the failed file are parsed again
+    parsed.clear()
+    write_csv(tmp_path / '3.txt', 20, seed=3)
+    second = DatasetLoader.load_csv(path, cache=cache, shuffle=False)
+    assert parsed == ['3.txt']
+    assert len(second.labels) == 60
+
+    ## Fixed, the file is parsed and loaded
+    parsed.clear()
+    write_csv(tmp_path / '2.txt', 20, seed=2)
+    third = DatasetLoader.load_csv(path, cache=cache, shuffle=False)
+    assert parsed == ['2.txt']
+    expected = np.concatenate([np.loadtxt(tmp_path / f'{idx}.txt', delimiter=',') for idx in range(4)])
+    np.testing.assert_array_equal(third.features, expected[:, 1:-1])
+
+
+def test_fit_cache_keeps_the_most_recently_used_results(tmp_path):
+    cache = FitCache(str(tmp_path), max_entries=2)
+    for idx, key in enumerate('abc'):
+        cache.put(key, (np.nan if key == 'a' else idx, 1., 2.), commit=True)
+        time.sleep(0.01)
+
+    found = cache.get_many(['a', 'd'])
+    assert list(found) == ['a'] and np.isnan(found['a'][0]) and found['a'][1:] == (1., 2.)
+    cache.close()
+
+    cache = FitCache(str(tmp_path), max_entries=2)
+    assert set(cache.get_many(['a', 'b', 'c'])) == {'a', 'c'}
+    cache.close()
+
+
+FITS = []
+
+
+class CountingTree(DecisionTreeClassifier):
+    def fit(self, X, y, **kwargs):
+        FITS.append(self.get_params())
+        return super().fit(X, y, **kwargs)
+
+
+def test_fits_are_shared_across_searches(tmp_path):
+    rng = np.random.default_rng(0)
+    features = rng.normal(size=(200, 3))
+    labels = (features[:, 0] + rng.normal(scale=0.5, size=200) > 0).astype(int)
+
+    def __search(param_grid, **parameters):
+        FITS.clear()
+        return FoldSearchCV(CountingTree(**parameters), param_grid, StratifiedKFold(3, shuffle=True, random_state=0), scoring='roc_auc',
+                            n_jobs=1, fit_cache=FitCache(str(tmp_path))).fit(features, labels).cv_results_
+
+    first = __search({'max_depth': [1, 2]}, random_state=0)
+    assert len(FITS) == 6
+
+    ## Only the new candidate is fitted, the results of the others are the cached ones
+    second = __search({'max_depth': [1, 2, 3]}, random_state=0)
+    assert [fit['max_depth'] for fit in FITS] == [3] * 3
+    np.testing.assert_array_equal(second['mean_test_score'][:2], first['mean_test_score'])
+
+    ## Any other parameter of the estimator is part of the key
+    __search({'max_depth': [1, 2]}, random_state=1)
+    assert len(FITS) == 6
@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+
+from sklearn.model_selection import StratifiedKFold
+from sklearn.tree import DecisionTreeClassifier
+
+from tuna.utils.search import FoldSearchCV
+
+PARAM_GRID = {'max_depth': [1, 2, 3], 'min_samples_leaf': [1, 10]}
+
+## Number of fits, the one numbered `INTERRUPT` raises (as a killed run)
+FITS = []
+INTERRUPT = [None]
+
+
+class InterruptedTree(DecisionTreeClassifier):
+    def fit(self, X, y, **kwargs):
+        FITS.append(self.get_params())
+        if len(FITS) == INTERRUPT[0]:
+            raise KeyboardInterrupt
+        return super().fit(X, y, **kwargs)
+
+
+def dataset(n_rows: int = 200, seed: int = 0) -> tuple[np.ndarray, np.ndarray]:
+    rng = np.random.default_rng(seed)
+    features = rng.normal(size=(n_rows, 3))
+    labels = (features[:, 0] + rng.normal(scale=0.5, size=n_rows) > 0).astype(int)
+    return features, labels
+
+
+def search(checkpoint_path=None, param_grid=PARAM_GRID) -> FoldSearchCV:
+    return FoldSearchCV(InterruptedTree(random_state=0), param_grid, StratifiedKFold(3, shuffle=True, random_state=0),
+                        scoring='roc_auc', n_jobs=1, checkpoint_path=checkpoint_path, checkpoint_name='test')
+
+
+@pytest.fixture(autouse=True)
+def reset_fits():
+    FITS.clear()
+    INTERRUPT[0] = None
+    yield
+    FITS.clear()
+    INTERRUPT[0] = None
+
+
+def test_interrupted_search_resumes_from_the_checkpoint(tmp_path):
+    features, labels = dataset()
+    reference = search().fit(features, labels).cv_results_
+    FITS.clear()
+
+    INTERRUPT[0] = 8
+    with pytest.raises(KeyboardInterrupt):
+        search(str(tmp_path)).fit(features, labels)
+    (checkpoint,) = tmp_path.glob('test_*.jsonl')
+    ## The fingerprint and the 7 completed fits
+    assert len(checkpoint.read_text().splitlines()) == 8
+
+    ## A line cut by the kill is ignored
+    with open(checkpoint, 'a') as f:
+        f.write('{"candidate": "{\\"max_de')
+
+    FITS.clear()
+    INTERRUPT[0] = None
+    resumed = search(str(tmp_path)).fit(features, labels).cv_results_
+    assert len(FITS) == 18 - 7
+    np.testing.assert_array_equal(resumed['mean_test_score'], reference['mean_test_score'])
+    np.testing.assert_array_equal(resumed['rank_test_score'], reference['rank_test_score'])
+
+    ## Nothing left to compute
+    FITS.clear()
+    search(str(tmp_path)).fit(features, labels)
+    assert FITS == []
+
+
+def test_another_search_does_not_reuse_the_checkpoint(tmp_path):
+    features, labels = dataset()
+    search(str(tmp_path)).fit(features, labels)
+
+    FITS.clear()
+    search(str(tmp_path), {**PARAM_GRID, 'criterion': ['entropy']}).fit(features, labels)
+    assert len(FITS) == 18
+    assert len(list(tmp_path.glob('test_*.jsonl'))) == 2
+
+    ## Another dataset
+    FITS.clear()
+    search(str(tmp_path)).fit(*dataset(seed=1))
+    assert len(FITS) == 18
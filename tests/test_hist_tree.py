@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from sklearn.ensemble import AdaBoostClassifier
+from sklearn.tree import DecisionTreeClassifier
+
+from tuna.utils.hist_tree import HistDecisionTreeClassifier
+
+PARAMETERS = [
+    {'max_depth': 3},
+    {'max_depth': 5, 'min_samples_leaf': 20},
+    {'max_depth': 4, 'criterion': 'entropy'},
+    {'max_depth': None, 'min_samples_split': 50},
+    {'max_depth': 6, 'min_impurity_decrease': 1e-3},
+    {'max_depth': 8, 'ccp_alpha': 2e-3},
+]
+
+
+def binned_dataset(n_rows: int = 3000, seed: int = 0) -> tuple[np.ndarray, np.ndarray]:
+    '''Bin indices (as `feature_dtype: uint8`) of five features, and a non linear label'''
+
+    rng = np.random.default_rng(seed)
+    raw = rng.normal(size=(n_rows, 5))
+    labels = (raw[:, 0] + 0.5 * raw[:, 1] ** 2 + rng.normal(scale=0.7, size=n_rows) > 0.5).astype(int)
+    return np.clip(np.floor((raw + 3) * 6), 0, 35).astype(np.uint8), labels
+
+
+def same_partition(first: np.ndarray, second: np.ndarray) -> bool:
+    '''Whether the two leaf assignments group the rows the same way'''
+
+    pairs = np.unique(np.c_[first, second], axis=0)
+    return np.unique(pairs[:, 0]).size == np.unique(pairs[:, 1]).size == len(pairs)
+
+
+@pytest.mark.parametrize('parameters', PARAMETERS)
+def test_same_tree_as_scikit_learn(parameters):
+    features, labels = binned_dataset()
+    reference = DecisionTreeClassifier(random_state=0, **parameters).fit(features, labels)
+    tree = HistDecisionTreeClassifier(**parameters).fit(features, labels)
+
+    np.testing.assert_allclose(tree.predict_proba(features), reference.predict_proba(features), rtol=0, atol=1e-15)
+    assert same_partition(tree.apply(features), reference.apply(features))
+    assert tree.get_depth() == reference.get_depth()
+
+
+@pytest.mark.parametrize('parameters', PARAMETERS[:3])
+def test_same_weighted_tree_as_scikit_learn(parameters):
+    features, labels = binned_dataset()
+    weight = np.random.default_rng(1).uniform(0.5, 2., size=labels.size)
+    reference = DecisionTreeClassifier(random_state=0, **parameters).fit(features, labels, sample_weight=weight)
+    tree = HistDecisionTreeClassifier(**parameters).fit(features, labels, sample_weight=weight)
+
+    ## The weights of a node are summed in another order
+    np.testing.assert_allclose(tree.predict_proba(features), reference.predict_proba(features), rtol=0, atol=1e-13)
+    assert same_partition(tree.apply(features), reference.apply(features))
+
+
+def test_same_adaboost_predictions():
+    features, labels = binned_dataset()
+    reference = AdaBoostClassifier(DecisionTreeClassifier(max_depth=3, random_state=0), n_estimators=20,
+                                   algorithm='SAMME', random_state=0).fit(features, labels)
+    boosted = AdaBoostClassifier(HistDecisionTreeClassifier(max_depth=3), n_estimators=20,
+                                 algorithm='SAMME', random_state=0).fit(features, labels)
+
+    np.testing.assert_array_equal(boosted.predict(features), reference.predict(features))
+    np.testing.assert_allclose(boosted.decision_function(features), reference.decision_function(features), rtol=0, atol=1e-12)
+
+
+def test_raw_and_binned_inputs_are_not_mixed():
+    features, labels = binned_dataset()
+    tree = HistDecisionTreeClassifier(max_depth=2).fit(features.astype(np.float64), labels)
+    with pytest.raises(ValueError):
+        tree.predict(features)
+    with pytest.raises(ValueError):
+        HistDecisionTreeClassifier(max_depth=2).fit(features, labels).predict(features.astype(np.float64))
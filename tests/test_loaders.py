@@ -0,0 +1,96 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from tuna.utils.cache import DatasetCache
+from tuna.utils.loaders import DatasetLoader
+
+
+def write_csv(path: Path, n_rows: int, seed: int, n_features: int = 4) -> np.ndarray:
+    '''Index, `n_features` features and the label, as the files of the repo'''
+
+    rng = np.random.default_rng(seed)
+    matrix = np.c_[np.arange(n_rows), rng.normal(size=(n_rows, n_features)), rng.integers(0, 2, n_rows)]
+    np.savetxt(path, matrix, delimiter=',')
+    return matrix
+
+
+@pytest.mark.parametrize('engine', ['numpy', 'pandas'])
+@pytest.mark.parametrize('cached', [False, True])
+def test_malformed_files_sorting_first_do_not_set_the_columns(tmp_path, engine, cached):
+    (tmp_path / 'data').mkdir()
+    matrices = [write_csv(tmp_path / 'data' / f'{idx}.txt', 50, seed=idx) for idx in range(3)]
+    (tmp_path / 'data' / '0_bad.txt').write_text('garbage\n1,2\n')
+    (tmp_path / 'data' / '0_short.txt').write_text('1,2\n3,4\n')
+
+    cache = DatasetCache(str(tmp_path / 'cache')) if cached else None
+    loader = DatasetLoader.load_csv(str(tmp_path / 'data' / '*.txt'), engine=engine, cache=cache, shuffle=False)
+
+    expected = np.concatenate(matrices)
+    assert loader.features.shape == (150, 4)
+    np.testing.assert_allclose(loader.features, expected[:, 1:-1], rtol=1e-12)
+    np.testing.assert_array_equal(loader.labels, expected[:, -1])
+    if cached:
+        assert len(list((cache.path / 'shards').glob('*.failed'))) == 2
+
+
+def imbalanced_matrix(populations: tuple[int, ...] = (300, 120, 45), seed: int = 0) -> np.ndarray:
+    '''Three features (the first one the row number) and the label, classes in blocks'''
+
+    rng = np.random.default_rng(seed)
+    labels = np.repeat(np.arange(len(populations)), populations)
+    return np.c_[np.arange(labels.size), rng.normal(size=(labels.size, 2)), labels]
+
+
+@pytest.mark.parametrize('shuffle', [False, True])
+def test_undersampling_and_split_are_index_arrays(shuffle):
+    matrix = imbalanced_matrix()
+    loader = DatasetLoader._from_matrix(matrix, equalize_populations='undersample', split=0.8, shuffle=shuffle, random_state=1)
+
+    ## The matrix is neither copied in another order nor reduced
+    assert loader.features.shape == (matrix.shape[0], 3)
+    np.testing.assert_array_equal(loader.features[:, 0], matrix[:, 0])
+
+    train, test = loader.train_index, loader.test_index
+    assert not np.intersect1d(train, test).size
+    np.testing.assert_array_equal(np.bincount(loader.labels[train]), [36, 36, 36])
+    np.testing.assert_array_equal(np.bincount(loader.labels[test]), [9, 9, 9])
+    assert loader.sample_weight is None
+
+    ## The same seed selects the same rows
+    again = DatasetLoader._from_matrix(matrix, equalize_populations='undersample', split=0.8, shuffle=shuffle, random_state=1)
+    np.testing.assert_array_equal(again.train_index, train)
+    np.testing.assert_array_equal(again.test_index, test)
+
+
+@pytest.mark.parametrize('shuffle', [False, True])
+def test_weight_equalization_balances_the_training_classes(shuffle):
+    matrix = imbalanced_matrix()
+    loader = DatasetLoader._from_matrix(matrix, equalize_populations='weight', split=0.8, shuffle=shuffle, random_state=2)
+
+    train, test = loader.train_index, loader.test_index
+    assert np.union1d(train, test).size == matrix.shape[0]
+    np.testing.assert_array_equal(np.bincount(loader.labels[train]), [240, 96, 36])
+
+    ## Indexed by the rows of the matrix: a single weight per class, the same total per class
+    weight = loader.sample_weight
+    assert weight.shape == (matrix.shape[0],)
+    for label in range(3):
+        assert np.unique(weight[loader.labels == label]).size == 1
+    totals = np.bincount(loader.labels[train], weights=weight[train])
+    np.testing.assert_allclose(totals, train.size / 3)
+
+
+def test_folds_are_indices_of_the_training_rows():
+    from sklearn.model_selection import StratifiedKFold
+
+    matrix = imbalanced_matrix()
+    loader = DatasetLoader._from_matrix(matrix, equalize_populations='undersample', split=0.8, random_state=3)
+    folds = loader.folds(StratifiedKFold(3))
+
+    assert len(folds) == 3
+    np.testing.assert_array_equal(np.sort(np.concatenate([test for _, test in folds])), np.sort(loader.train_index))
+    for train, test in folds:
+        assert np.isin(train, loader.train_index).all() and not np.intersect1d(train, test).size
+        np.testing.assert_array_equal(np.bincount(loader.labels[test]), [12, 12, 12])
@@ -0,0 +1,124 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from sklearn.model_selection import ParameterGrid, StratifiedKFold
+from sklearn.tree import DecisionTreeClassifier
+
+from tuna.utils.results import ResultsWriter, open_results, write_results
+from tuna.utils.search import FoldSearchCV, assemble_cv_results
+
+
+def dataset(n_rows: int = 300, seed: int = 0) -> tuple[np.ndarray, np.ndarray]:
+    rng = np.random.default_rng(seed)
+    features = rng.normal(size=(n_rows, 4))
+    labels = (features[:, 0] + rng.normal(scale=0.5, size=n_rows) > 0).astype(int)
+    return features, labels
+
+
+PARAM_GRID = {'max_depth': [1, 2, 3, None], 'min_samples_leaf': [1, 5, 20], 'criterion': ['gini', 'entropy']}
+
+
+@pytest.mark.parametrize('pruning_percentile', [None, 50.])
+def test_search_writes_the_npz_results_while_running(tmp_path, pruning_percentile):
+    features, labels = dataset()
+    writer = ResultsWriter(tmp_path, 'search', 'npz', batch_rows=5)
+    search = FoldSearchCV(
+        DecisionTreeClassifier(random_state=0), PARAM_GRID, StratifiedKFold(4, shuffle=True, random_state=0), scoring='roc_auc',
+        n_jobs=1, pruning_percentile=pruning_percentile, results_writer=writer
+    ).fit(features, labels)
+
+    ## The staged batches are dropped once the results are written
+    assert [path.name for path in tmp_path.iterdir()] == [writer.path.name]
+
+    write_results(search.cv_results_, tmp_path / 'reference', 'search', 'npz')
+    written, reference = open_results(writer.path), open_results(tmp_path / 'reference' / writer.path.name)
+    assert written.columns == reference.columns
+    best = search.cv_results_['params'][int(np.argmin(search.cv_results_['rank_test_score']))]
+    assert written.best_parameters() == reference.best_parameters() == best
+
+    ## Same rows, in the order the candidates completed
+    columns = ['param_max_depth', 'param_min_samples_leaf', 'param_criterion']
+    frame = pd.concat(written.batches()).sort_values(columns, na_position='first', kind='stable').reset_index(drop=True)
+    expected = pd.concat(reference.batches()).sort_values(columns, na_position='first', kind='stable').reset_index(drop=True)
+    pd.testing.assert_frame_equal(frame, expected)
+
+
+class FailingWriter(ResultsWriter):
+    def write(self, cv_results, indices):
+        if self._parts:
+            raise RuntimeError('Interrupted')
+        super().write(cv_results, indices)
+
+
+def test_failed_search_leaves_no_results(tmp_path):
+    features, labels = dataset()
+    writer = FailingWriter(tmp_path, 'search', 'npz', batch_rows=1)
+    search = FoldSearchCV(DecisionTreeClassifier(random_state=0), PARAM_GRID, StratifiedKFold(3), n_jobs=1, results_writer=writer)
+    with pytest.raises(RuntimeError):
+        search.fit(features, labels)
+    assert list(tmp_path.iterdir()) == []
+
+
+def synthetic_results(seed: int = 0) -> dict:
+    '''`cv_results_` of candidates with parameters of every kind, some missing, a unique best'''
+
+    candidates = list(ParameterGrid([
+        {'n_estimators': [10, 50, 100], 'learning_rate': [0.1, 1.], 'criterion': ['gini', 'entropy'], 'max_depth': [3, None]},
+        {'n_estimators': [10], 'subsample': [0.5, 1.], 'shuffle': [True, False]},
+    ]))
+    scores = np.random.default_rng(seed).uniform(0.5, 0.8, size=(len(candidates), 3))
+    scores[7] = 0.9
+    return assemble_cv_results(candidates, scores, np.ones_like(scores), np.ones_like(scores))
+
+
+@pytest.mark.parametrize('results_format', ['csv', 'npz', 'parquet'])
+def test_reader_queries(tmp_path, results_format):
+    if results_format == 'parquet':
+        pytest.importorskip('pyarrow')
+    cv_results = synthetic_results()
+    results = open_results(write_results(cv_results, tmp_path, 'search', results_format, batch_rows=4))
+
+    assert sorted(results.parameters) == ['criterion', 'learning_rate', 'max_depth', 'n_estimators', 'shuffle', 'subsample']
+    assert results.best_parameters() == cv_results['params'][7]
+
+    ## A batch at a time, only the requested columns
+    batches = list(results.batches(['mean_test_score', 'param_n_estimators']))
+    assert all(sorted(batch.columns) == ['mean_test_score', 'param_n_estimators'] for batch in batches)
+    if results_format != 'csv':
+        assert [len(batch) for batch in batches] == [4] * 7
+
+    scores = np.asarray(cv_results['mean_test_score'])
+    top = results.top_k(5)
+    np.testing.assert_array_equal(top['mean_test_score'], np.sort(scores)[::-1][:5])
+    np.testing.assert_array_equal(results.top_k(3, ascending=True)['mean_test_score'], np.sort(scores)[:3])
+    assert top['rank_test_score'].tolist() == [1, 2, 3, 4, 5]
+
+    expected = pd.DataFrame({'n_estimators': [candidate['n_estimators'] for candidate in cv_results['params']], 'score': scores})
+    expected = expected.groupby('n_estimators')['score'].agg(['count', 'mean', 'std', 'min', 'max'])
+    marginals = results.marginals('n_estimators')
+    np.testing.assert_array_equal(marginals.index.astype(int), expected.index)
+    np.testing.assert_array_equal(marginals['count'], expected['count'])
+    for column in ('mean', 'min', 'max'):
+        np.testing.assert_allclose(marginals[column], expected[column])
+    ## Population standard deviation
+    np.testing.assert_allclose(marginals['std'], expected['std'] * np.sqrt((expected['count'] - 1) / expected['count']))
+
+
+@pytest.mark.parametrize('results_format', ['npz', 'parquet'])
+def test_columnar_parameters_are_typed(tmp_path, results_format):
+    if results_format == 'parquet':
+        pytest.importorskip('pyarrow')
+    results = open_results(write_results(synthetic_results(), tmp_path, 'search', results_format, batch_rows=4))
+
+    assert results.schema['parameters'] == {
+        'criterion': 'json', 'learning_rate': 'float', 'max_depth': 'json', 'n_estimators': 'int', 'shuffle': 'bool', 'subsample': 'float'
+    }
+    frame = pd.concat(results.batches())
+    assert frame['param_n_estimators'].dtype == np.int64
+    ## Missing where the candidate does not have the parameter
+    assert frame['param_criterion'].isna().sum() == 4 and frame['param_subsample'].isna().sum() == 24
+    assert set(frame['param_max_depth'].dropna()) == {3} and frame['param_max_depth'].isna().sum() == 16
+    ## The candidates without the parameter are a group too
+    counts = results.marginals('criterion')['count']
+    assert counts['entropy'] == counts['gini'] == 12 and counts[counts.index.isna()].tolist() == [4]
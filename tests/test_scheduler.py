@@ -0,0 +1,100 @@
+import importlib
+import textwrap
+import threading
+
+import pytest
+
+from tuna.utils.helpers import Configuration
+
+## A module recording when each subroutine runs, with the cores it was granted
+RECORDER = '''
+import threading
+import time
+
+from tuna.modules.meta import Module
+
+EVENTS = []
+
+
+class Recorder(Module):
+    def update(self):
+        name = self.configuration['output_name']
+        EVENTS.append(('start', name, time.monotonic(), self.configuration.cpu_budget))
+        time.sleep(self.configuration['sleep'] or 0.)
+        if self.configuration['fail']:
+            raise RuntimeError(name)
+        EVENTS.append(('end', name, time.monotonic(), threading.current_thread().name))
+'''
+
+
+@pytest.fixture
+def events(tmp_path, monkeypatch):
+    (tmp_path / 'scheduler_modules').mkdir()
+    (tmp_path / 'scheduler_modules' / '__init__.py').write_text('')
+    (tmp_path / 'scheduler_modules' / 'recorder.py').write_text(textwrap.dedent(RECORDER))
+    monkeypatch.syspath_prepend(str(tmp_path))
+    module = importlib.import_module('scheduler_modules.recorder')
+    module.EVENTS.clear()
+    yield module.EVENTS
+    module.EVENTS.clear()
+
+
+def run(subroutines: dict[str, dict], cpu_budget: int = 2) -> None:
+    configuration = {
+        name: {'module_name': 'Recorder', 'module_import_path': 'recorder', 'output_name': name, **settings}
+        for name, settings in subroutines.items()
+    }
+    Configuration().load({'name': 'test', 'modules_path': 'scheduler_modules', 'cpu_budget': cpu_budget, **configuration}).run()
+
+
+def intervals(events) -> dict[str, tuple[float, float]]:
+    starts = {name: time for kind, name, time, _ in events if kind == 'start'}
+    return {name: (starts[name], time) for kind, name, time, _ in events if kind == 'end'}
+
+
+def test_dependencies_run_first(events):
+    run({
+        'c': {'depends_on': ['a', 'b'], 'n_jobs': 1},
+        'b': {'depends_on': 'a', 'n_jobs': 1, 'sleep': 0.05},
+        'a': {'n_jobs': 1, 'sleep': 0.05},
+    })
+    times = intervals(events)
+    assert times['a'][1] <= times['b'][0]
+    assert max(times['a'][1], times['b'][1]) <= times['c'][0]
+
+
+def test_independent_subroutines_share_the_budget(events):
+    run({
+        'a': {'n_jobs': 1, 'sleep': 0.3},
+        'b': {'n_jobs': 1, 'sleep': 0.3},
+        'large': {'n_jobs': 8, 'sleep': 0.1},
+    })
+    times = intervals(events)
+    ## The first two in parallel, then the one asking for more than the budget, alone and capped
+    assert times['b'][0] < times['a'][1] and times['a'][0] < times['b'][1]
+    assert times['large'][0] >= max(times['a'][1], times['b'][1])
+    assert {name: budget for kind, name, _, budget in events if kind == 'start'} == {'a': 1, 'b': 1, 'large': 2}
+    assert all(thread != threading.current_thread().name for kind, _, _, thread in events if kind == 'end')
+
+
+def test_dependents_of_a_failed_subroutine_are_skipped(events):
+    with pytest.raises(SystemExit) as exit_info:
+        run({
+            'broken': {'n_jobs': 1, 'fail': True},
+            'dependent': {'depends_on': 'broken', 'n_jobs': 1},
+            'transitive': {'depends_on': 'dependent', 'n_jobs': 1},
+            'independent': {'n_jobs': 1},
+        })
+    assert exit_info.value.code == 2
+    assert {name for kind, name, _, _ in events if kind == 'start'} == {'broken', 'independent'}
+    assert set(intervals(events)) == {'independent'}
+
+
+@pytest.mark.parametrize('subroutines', [
+    {'a': {'depends_on': 'b'}, 'b': {'depends_on': 'a'}},
+    {'a': {'depends_on': 'missing'}},
+])
+def test_invalid_dependencies_run_nothing(events, subroutines):
+    with pytest.raises(SystemExit):
+        run(subroutines)
+    assert events == []
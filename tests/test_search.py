@@ -0,0 +1,85 @@
+import numpy as np
+
+from sklearn.dummy import DummyClassifier
+from sklearn.experimental import enable_halving_search_cv  # noqa: F401
+from sklearn.model_selection import GridSearchCV, HalvingGridSearchCV, StratifiedKFold
+from sklearn.tree import DecisionTreeClassifier
+
+from tuna.utils.search import FoldSamplesHalvingSearchCV, assemble_cv_results, prune_candidates
+
+
+def run_pruning(scores: np.ndarray, percentile: float, min_folds: int = 1) -> np.ndarray:
+    '''Fold after fold pruning, as `FoldSearchCV` schedules it, return the pruned mask'''
+
+    results = np.full(scores.shape, np.nan)
+    pruned = np.zeros(scores.shape[0], dtype=bool)
+    for fold in range(scores.shape[1]):
+        results[~pruned, fold] = scores[~pruned, fold]
+        pruned |= prune_candidates(results, pruned, fold + 1, percentile, min_folds)
+    return pruned
+
+
+def test_candidate_tied_with_the_best_is_never_pruned():
+    rng = np.random.default_rng(0)
+    scores = rng.normal(0.8, 0.02, size=(2000, 15))
+    scores[0] = rng.normal(0.9, 0.005, size=15)
+    scores[1] = scores[0]
+
+    for percentile in (50, 90, 100):
+        pruned = run_pruning(scores, percentile)
+        assert not pruned[0]
+        assert not pruned[1]
+
+    ## Same expected score, different fold noise
+    scores[1] = rng.normal(0.9, 0.005, size=15)
+    for percentile in (50, 90):
+        pruned = run_pruning(scores, percentile)
+        assert not pruned[0]
+        assert not pruned[1]
+
+
+def test_pruning_does_not_compound_over_the_folds():
+    rng = np.random.default_rng(1)
+    scores = rng.normal(0.8, 0.01, size=(4000, 1)) + rng.normal(0, 0.01, size=(4000, 15))
+
+    pruned = run_pruning(scores, 50)
+    ## Repeated halving of the survivors would leave a handful of candidates
+    assert (~pruned).sum() > 0.25 * len(pruned)
+
+
+def test_tied_scores_share_the_rank_as_in_grid_search():
+    rng = np.random.default_rng(2)
+    X, y = rng.normal(size=(60, 2)), rng.integers(0, 2, 60)
+    ## `constant` is ignored by the `prior` strategy, the three candidates tie
+    grid = {'strategy': ['prior', 'stratified'], 'constant': [0, 1, 2], 'random_state': [0]}
+    search = GridSearchCV(DummyClassifier(), grid, cv=3).fit(X, y)
+
+    scores = np.column_stack([search.cv_results_[f'split{fold}_test_score'] for fold in range(3)])
+    results = assemble_cv_results(search.cv_results_['params'], scores, np.zeros(scores.shape), np.zeros(scores.shape))
+    np.testing.assert_array_equal(results['rank_test_score'], search.cv_results_['rank_test_score'])
+
+
+def test_nan_and_pruned_candidates_are_ranked_last():
+    scores = np.array([[0.5, 0.7], [0.9, 0.9], [0.5, 0.7], [np.nan, np.nan], [0.95, np.nan], [0.9, 0.9]])
+    pruned = np.array([False, False, False, False, True, False])
+
+    results = assemble_cv_results([{'c': c} for c in range(6)], scores, np.zeros(scores.shape), np.zeros(scores.shape))
+    np.testing.assert_array_equal(results['rank_test_score'], [4, 2, 4, 6, 1, 2])
+
+    results = assemble_cv_results([{'c': c} for c in range(6)], scores, np.zeros(scores.shape), np.zeros(scores.shape), pruned)
+    np.testing.assert_array_equal(results['rank_test_score'], [3, 1, 3, 5, 6, 1])
+
+
+def test_halving_budgets_are_samples_of_a_training_fold():
+    rng = np.random.default_rng(3)
+    X, y = rng.normal(size=(1200, 3)), rng.integers(0, 2, 1200)
+    ## The folds cover only the training half of the rows, as `DatasetLoader.folds`
+    train_index = np.arange(600)
+    cv = [(train_index[train], train_index[test]) for train, test in StratifiedKFold(3).split(X[:600], y[:600])]
+
+    search = HalvingGridSearchCV(DecisionTreeClassifier(random_state=0), {'max_depth': [1, 2, 3, 4, 5, 6, 7, 8, 9]}, cv=cv,
+                                 factor=3, min_resources=40, max_resources=400, refit=False)
+    results = FoldSamplesHalvingSearchCV(search).fit(X, y).cv_results_
+
+    ## 400 training rows per fold: 40, 120 and 360 of them, not of the 1200 rows of X
+    np.testing.assert_array_equal(np.unique(results['n_resources']), [40, 120, 360])
@@ -0,0 +1,60 @@
+'''Startup time budget of the `tuna` cli
+
+`import tuna.cli`, `tuna -v`, `tuna -v -c CONFIGURATION` and `tuna --validate -c
+CONFIGURATION` run in a fresh interpreter (under `python -X importtime` for the cli), and
+must neither import any of the heavy packages nor exceed the cumulative import time budget.
+'''
+
+import os
+import re
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+CONFIGURATION = str(ROOT / 'configurations' / 'cross_validation_base.json')
+FORBIDDEN = ('sklearn', 'xgboost', 'pandas', 'uproot')
+## Seconds of cumulative imports
+BUDGET = 1.0
+
+IMPORTTIME = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s+)(\S+)$')
+
+
+def run(*arguments: str) -> subprocess.CompletedProcess:
+    environment = {**os.environ, 'TUNA_PATH': os.environ.get('TUNA_PATH', str(ROOT)), 'PYTHONPATH': str(ROOT)}
+    return subprocess.run([sys.executable, *arguments], capture_output=True, text=True, env=environment, cwd=ROOT)
+
+
+def measure(arguments: list[str]) -> tuple[float, set[str]]:
+    '''Run the cli with `arguments`, return the total import time (s) and the imported top-level packages'''
+
+    process = run('-X', 'importtime', '-c', 'import sys; sys.argv = ["tuna"] + sys.argv[1:]; from tuna.cli import main; main()', *arguments)
+    ## An invalid configuration (exit code 2 of --validate) is still a valid measurement of the startup
+    assert process.returncode == 0 or (process.returncode == 2 and '--validate' in arguments), process.stdout + process.stderr
+
+    total, packages = 0, set()
+    for line in process.stderr.splitlines():
+        match = IMPORTTIME.match(line)
+        if match is None:
+            continue
+        _, cumulative, indent, name = match.groups()
+        packages.add(name.split('.')[0])
+        ## Only the outermost imports, their cumulative time includes the nested ones
+        if len(indent) == 1:
+            total += int(cumulative)
+    return total / 1e6, packages
+
+
+def test_importing_the_cli_loads_no_heavy_package():
+    process = run('-c', 'import sys, tuna.cli; print(" ".join(sorted({name.split(".")[0] for name in sys.modules})))')
+    assert process.returncode == 0, process.stderr
+    assert not set(FORBIDDEN) & set(process.stdout.split())
+
+
+@pytest.mark.parametrize('arguments', [['-b', '-v'], ['-b', '-v', '-c', CONFIGURATION], ['-b', '--validate', '-c', CONFIGURATION]])
+def test_cli_startup_budget(arguments):
+    seconds, packages = measure(arguments)
+    assert not set(FORBIDDEN) & packages
+    assert seconds <= BUDGET, f'{seconds:.3f} s of imports'
@@ -0,0 +1,84 @@
+import threading
+import time
+
+import numpy as np
+
+from sklearn.model_selection import StratifiedKFold
+from sklearn.tree import DecisionTreeClassifier
+
+from tuna.utils.search import FoldSearchCV
+from tuna.utils.work_queue import MAX_ATTEMPTS, WorkQueue
+
+FINGERPRINT = {'search': 'test'}
+TASKS = [(group, fold) for fold in range(2) for group in range(3)]
+
+
+def test_tasks_are_leased_once(tmp_path):
+    coordinator, worker = (WorkQueue(str(tmp_path), 'test', FINGERPRINT) for _ in range(2))
+    assert coordinator.path == worker.path
+    coordinator.create()
+    coordinator.submit(TASKS)
+    coordinator.submit(TASKS[:2])
+
+    first, second = coordinator.lease(4), worker.lease(4)
+    ## Fold after fold, every task to a single process
+    assert first == [(0, 0), (1, 0), (2, 0), (0, 1)]
+    assert second == [(1, 1), (2, 1)]
+    assert worker.lease(4) == []
+    assert coordinator.counts([0, 1]) == {'leased': 6}
+
+
+def test_results_of_the_completed_tasks(tmp_path):
+    queue = WorkQueue(str(tmp_path), 'test', FINGERPRINT)
+    queue.create()
+    queue.submit(TASKS)
+    (task,) = queue.lease(1)
+    queue.complete(task, [(0.5, 1., 2.), (np.nan, 3., 0.)])
+
+    assert queue.counts([0]) == {'done': 1, 'pending': 2}
+    ((_, output), (_, missing)) = queue.results([task, (1, 0)], [3, 1])
+    assert output[0] == (0.5, 1., 2.)
+    assert np.isnan(output[1][0]) and output[1][1:] == (3., 0.)
+    ## Not reported, scored nan
+    assert np.isnan(output[2]).all() and np.isnan(missing).all()
+
+    ## A restarted coordinator keeps the done tasks only
+    queue.lease(1)
+    queue.create()
+    assert queue.counts([0, 1]) == {'done': 1}
+
+
+def test_expired_leases_are_taken_again_then_failed(tmp_path):
+    lost = WorkQueue(str(tmp_path), 'test', FINGERPRINT, lease_seconds=0.05)
+    lost.create()
+    lost.submit(TASKS[:1])
+
+    for _ in range(MAX_ATTEMPTS):
+        assert WorkQueue(str(tmp_path), 'test', FINGERPRINT, lease_seconds=0.05).lease(1) == TASKS[:1]
+        time.sleep(0.1)
+    assert lost.lease(1) == []
+    assert lost.counts([0]) == {'failed': 1}
+
+
+def test_search_through_the_queue_with_a_worker(tmp_path):
+    rng = np.random.default_rng(0)
+    features = rng.normal(size=(200, 3))
+    labels = (features[:, 0] + rng.normal(scale=0.5, size=200) > 0).astype(int)
+
+    def __search(**parameters) -> FoldSearchCV:
+        return FoldSearchCV(DecisionTreeClassifier(random_state=0), {'max_depth': [1, 2, 3], 'min_samples_leaf': [1, 10]},
+                            StratifiedKFold(3, shuffle=True, random_state=0), scoring='roc_auc', n_jobs=1, checkpoint_name='test',
+                            **parameters)
+
+    reference = __search().fit(features, labels).cv_results_
+
+    queued = {'queue_path': str(tmp_path), 'queue_lease_seconds': 30., 'queue_poll_seconds': 0.05}
+    worker = __search(worker=True, **queued)
+    thread = threading.Thread(target=worker.fit, args=(features, labels))
+    thread.start()
+    coordinator = __search(**queued).fit(features, labels)
+    thread.join(timeout=60)
+
+    assert not thread.is_alive() and worker.cv_results_ is None
+    np.testing.assert_array_equal(coordinator.cv_results_['mean_test_score'], reference['mean_test_score'])
+    np.testing.assert_array_equal(coordinator.cv_results_['rank_test_score'], reference['rank_test_score'])
@@ -25,6 +25,15 @@ def main():
     cliapp.add_argument('-V', '--verbose', action='store',
                         required=False, nargs='?', const='2', default='0',
                         choices=['0', '1', '2'], help='Verbosity level 0: ERRORS, 1: WARNINGS, 2: INFO. Default to 0: ERRORS')
+    cliapp.add_argument('--profile', action='store', nargs='?', const='.', default=None, metavar='DIRECTORY',
+                        help='Run every subroutine under cProfile, dumping the stats to DIRECTORY (default the current one)')
+    cliapp.add_argument('--plan', action='store_true', default=False,
+                        help='Only estimate candidates, fits, wall time and memory of the configuration passed with -c, without running it')
+    cliapp.add_argument('--worker', action='store_true', default=False,
+                        help='Only work on the queue of the subroutines with search_backend queue of the configuration passed with -c, '
+                             'while the same configuration runs without --worker (the coordinator)')
+    cliapp.add_argument('--validate', action='store_true', default=False,
+                        help='Only check the configuration passed with -c (modules, required keys and values), without running it')
 
     args = cliapp.parse_args()
 
@@ -42,6 +51,17 @@ def main():
     if args.configuration:
         configuration = config(args.configuration)
             
+        if configuration and args.validate:
+            sys.exit(0 if configuration.validate() else 2)
+
+        if configuration and args.plan:
+            configuration.plan()
+            return
+
+        if configuration and args.worker:
+            configuration.work(profile=args.profile)
+            return
+
         if configuration:
-            configuration.run(args.version)
+            configuration.run(args.version, profile=args.profile)
 
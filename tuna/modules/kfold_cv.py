@@ -3,17 +3,33 @@
 This module perform the k-fold cross validation using the sample passed trough the 
 module configuration file. '''
 
+import sys
 from os import path
-from pathlib import Path
-
-import pandas as pd
-from sklearn.ensemble import AdaBoostClassifier
-from sklearn.model_selection import GridSearchCV, RepeatedStratifiedKFold
-from sklearn.tree import DecisionTreeClassifier
 
 from tuna.utils.helpers import ModuleConfiguration, create_logger
 from tuna.modules import Module
-from tuna.utils.loaders import DatasetLoader
+from tuna.utils import profiling
+from tuna.utils.loaders import EQUALIZATION_MODES, FEATURE_DTYPES, LOADER_ENGINES, DatasetLoader
+from tuna.utils.resources import search_layout, thread_limits
+from tuna.utils.results import RESULTS_FORMATS, results_format_available, write_results
+from tuna.utils.search import SEARCH_STRATEGIES, build_search, with_resource
+from tuna.utils.shared import SharedDataset
+from tuna.utils.work_queue import SEARCH_BACKENDS
+
+WEAK_LEARNERS = ('tree', 'hist')
+
+
+def binned_weak_learner(configuration: ModuleConfiguration) -> str:
+    '''The `weak_learner` of the configuration. The histogram trees (`hist`) train on the
+    quantile bins of the loader, computed once per dataset: `feature_dtype` is set to `uint8`
+    unless already binned'''
+
+    weak_learner = configuration.get('weak_learner')
+    if weak_learner == 'hist' and configuration.get('feature_dtype') not in ('uint8', 'uint16'):
+        create_logger(__name__).info('The histogram trees train on binned features, loading them as uint8')
+        configuration.configuration['feature_dtype'] = 'uint8'
+    return weak_learner
+
 
 class KFoldCV(Module):
     '''This module perform the k-fold cross validation using the sample passed trough the 
@@ -23,69 +39,144 @@ class KFoldCV(Module):
     __mail__ = 'mattia.sotgia@ge.infn.it'
     __version__ = 'v01_01_02'
     __date__ = 'jan 22nd, 2025'
+    __base_configuration__ = '$TUNA_PATH/configurations/base/kfold_cv.json'
+    __required_keys__ = (
+        'training_dataset_path', 'output_path', 'estimator__max_depth', 'estimator__min_impurity_decrease',
+        'estimator__min_samples_split', 'estimator__min_samples_leaf', 'estimator__ccp_alpha', 'n_estimators',
+        'learning_rate',
+    )
+    __integer_parameters__ = ('estimator__max_depth', 'estimator__min_samples_split', 'estimator__min_samples_leaf', 'n_estimators')
+    __choices__ = {
+        'dataset_format': ('auto', 'csv', 'root'),
+        'loader_engine': LOADER_ENGINES,
+        'feature_dtype': FEATURE_DTYPES,
+        'equalize_classes': (False, True, *EQUALIZATION_MODES),
+        'search_strategy': SEARCH_STRATEGIES,
+        'search_backend': SEARCH_BACKENDS,
+        'results_format': RESULTS_FORMATS,
+        'weak_learner': WEAK_LEARNERS,
+    }
+
+    def validate(self, configuration: ModuleConfiguration | None = None) -> bool:
+        configuration = configuration or self.configuration
+        valid = super().validate(configuration)
+        ## A results format that cannot be written would only fail once the search is over
+        return results_format_available(configuration['results_format']) and valid
 
     def update(self):
         
+        ## The scientific stack is only imported here, not when the module is inspected or validated
+        with profiling.phase('imports'):
+            from sklearn.model_selection import RepeatedStratifiedKFold
+
         # 1. Initialize all ecessry steps
-        self.configuration.default(path.expandvars('$TUNA_PATH/configurations/base/kfold_cv.json'))
+        self.configuration.default(path.expandvars(self.__base_configuration__))
         __config: ModuleConfiguration = self.configuration
         
-        training_dataset_path: str = __config.get('training_dataset_path', required=True)
-
         output_path = __config.get('output_path', required=True)
         output_name = __config.get('output_name')
+        if not results_format_available(__config.get('results_format')):
+            sys.exit(2)
+        weak_learner = binned_weak_learner(__config)
 
         # 2. Load all the data for training/testing and so on...
-        dataset_string = path.join(training_dataset_path)
-        loader = DatasetLoader.load_csv(
-            dataset_string,
-            equalize_populations=__config.get('equalize_classes'),
-            split=__config.get('training_split'),
-            shuffle=__config.get('shuffle_dataset')
-        )
+        with profiling.phase('dataset_load'):
+            loader = DatasetLoader.from_configuration(__config)
 
         signals = loader.features
         labels = loader.labels 
 
         # 3. Define the parameter grids
 
-        parameters_grid = {
-            'estimator__max_depth'             : __config.get('estimator__max_depth', required=True),
-            'estimator__min_impurity_decrease' : __config.get('estimator__min_impurity_decrease', required=True),
-            'estimator__min_samples_split'     : __config.get('estimator__min_samples_split', required=True),
-            'estimator__min_samples_leaf'      : __config.get('estimator__min_samples_leaf', required=True),
-            'estimator__ccp_alpha'             : __config.get('estimator__ccp_alpha', required=True),
-            ## Only hardcoded parameter. JSON limitation
-            'estimator__class_weight'          : [None], # __config.get('estimator__class_weight'), 
-            'estimator__criterion'             : __config.get('estimator__criterion'),
-            'n_estimators'                          : __config.get('n_estimators', required=True),
-            'learning_rate'                         : __config.get('learning_rate', required=True),
-            'algorithm'                             : __config.get('algorithm')
-        }
+        parameters_grid = self.parameters_grid()
 
         # 4. Define the CV k-folding
 
-        estimator = AdaBoostClassifier(DecisionTreeClassifier())
+        estimator = self.estimator(weak_learner)
 
         kfolds: list = __config.get('kfolds')
         n_splits, n_repeats = kfolds
-        cv = RepeatedStratifiedKFold(n_splits=n_splits, n_repeats=n_repeats)
+        cv = loader.folds(RepeatedStratifiedKFold(n_splits=n_splits, n_repeats=n_repeats, random_state=__config.get('random_state')))
 
         scoring = __config.get('scoring')
-        n_jobs = __config.get('n_jobs', True)
-
-        grid_search = GridSearchCV(estimator=estimator, param_grid=parameters_grid, cv=cv, scoring=scoring, n_jobs=n_jobs, verbose=5)
-        grid_search.fit(signals, labels)
-        cv_results_grid = grid_search.cv_results_
+        ## The scikit-learn trees are single threaded, all the cores go to the workers
+        n_jobs, n_threads = search_layout(__config, loader.train_index.size, signals.shape[1], signals.dtype.itemsize, threaded=False)
+
+        ## The workers attach to one read-only copy of the dataset instead of receiving their own
+        with SharedDataset(__config.get('shared_dataset_path'), enabled=__config.get('shared_dataset')) as shared:
+            with profiling.phase('share_dataset'):
+                signals = shared.array('features', signals)
+                labels = shared.array('labels', labels)
+                sample_weight = shared.array('sample_weight', loader.sample_weight)
+                cv = shared.folds(cv)
+
+            grid_search = build_search(estimator, parameters_grid, cv, scoring, n_jobs, __config,
+                                       integer_parameters=self.__integer_parameters__)
+            with profiling.phase('search', search=type(grid_search).__name__), thread_limits(n_threads):
+                if sample_weight is not None:
+                    grid_search.fit(signals, labels, sample_weight=sample_weight)
+                else:
+                    grid_search.fit(signals, labels)
+
+        ## A worker only serves the queue, the coordinator writes the results
+        if __config.worker:
+            return
+
+        cv_results_grid = with_resource(grid_search.cv_results_, __config)
+        if profiling.current() is not None:
+            profiling.current().add_candidates(cv_results_grid)
 
         # Still TODO: 
         #  - and maybe the ability to add some post-processing
         
-        results_df = pd.DataFrame(cv_results_grid)
-        results_df.to_csv(Path(output_path, f'{output_name}.csv'))
+        with profiling.phase('result_write', format=__config.get('results_format')):
+            ## Unless the search already wrote them while running
+            if getattr(grid_search, 'results_writer', None) is None:
+                write_results(cv_results_grid, output_path, output_name, __config.get('results_format'), __config.get('results_batch_rows'))
 
         # print('The found best results are ')
         # print(grid_search.best_params_)
         # print('\n')
         # print(results_df)
  
+    def parameters_grid(self) -> dict[str, list]:
+        '''The parameter grid of the search, from the module configuration'''
+
+        return {
+            'estimator__max_depth'             : self.configuration.get('estimator__max_depth', required=True),
+            'estimator__min_impurity_decrease' : self.configuration.get('estimator__min_impurity_decrease', required=True),
+            'estimator__min_samples_split'     : self.configuration.get('estimator__min_samples_split', required=True),
+            'estimator__min_samples_leaf'      : self.configuration.get('estimator__min_samples_leaf', required=True),
+            'estimator__ccp_alpha'             : self.configuration.get('estimator__ccp_alpha', required=True),
+            ## Only hardcoded parameter. JSON limitation
+            'estimator__class_weight'          : [None], # self.configuration.get('estimator__class_weight'), 
+            'estimator__criterion'             : self.configuration.get('estimator__criterion'),
+            'n_estimators'                          : self.configuration.get('n_estimators', required=True),
+            'learning_rate'                         : self.configuration.get('learning_rate', required=True),
+            'algorithm'                             : self.configuration.get('algorithm')
+        }
+
+    def estimator(self, weak_learner: str = 'tree'):
+        '''The estimator tuned by the search, boosting `weak_learner` trees (see `WEAK_LEARNERS`)'''
+
+        from sklearn.ensemble import AdaBoostClassifier
+
+        if weak_learner == 'hist':
+            from tuna.utils.hist_tree import HistDecisionTreeClassifier
+
+            return AdaBoostClassifier(HistDecisionTreeClassifier())
+
+        from sklearn.tree import DecisionTreeClassifier
+
+        return AdaBoostClassifier(DecisionTreeClassifier())
+
+    def plan(self, configuration: ModuleConfiguration | None = None) -> dict:
+        if configuration is not None:
+            self.configuration = configuration
+        self.configuration.default(path.expandvars(self.__base_configuration__))
+
+        from tuna.utils.planner import plan_cross_validation
+
+        weak_learner = binned_weak_learner(self.configuration)
+        return plan_cross_validation(self.configuration, self.estimator(weak_learner), self.parameters_grid(), engine='joblib',
+                                     threaded=False)
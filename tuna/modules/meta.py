@@ -1,5 +1,7 @@
 # from __future__ import annotations
 
+from os import path
+from pathlib import Path
 from typing import Any
 
 from tuna.utils.helpers import create_logger
@@ -14,14 +16,64 @@ class Module:
     __version__ = 'None'
     __date__ = 'never'
 
+    ## Base configuration (`$TUNA_PATH` is expanded), keys without default and keys with a fixed set of values
+    __base_configuration__: str | None = None
+    __required_keys__: tuple[str, ...] = ()
+    __choices__: dict[str, tuple] = {}
+
     def __init__(self):
         self.configuration: ModuleConfiguration | None = None
 
+    def validate(self, configuration: ModuleConfiguration | None = None) -> bool:
+        '''Check the module configuration without running the module: the base configuration
+        is readable, the required keys are set and the keys with a fixed set of values are
+        valid. Unknown keys (e.g. typos) are reported as warnings. This must stay cheap, i.e.
+        never import the dependencies only needed by `update()`.
+
+        Return
+        ------
+        `bool`: `True` if the configuration can run
+        '''
+
+        configuration = configuration or self.configuration
+        name = f'{self.__class__.__module__}.{self.__class__.__name__}'
+        valid = True
+
+        if self.__base_configuration__:
+            configuration.default(path.expandvars(self.__base_configuration__))
+            if not configuration.__default__:
+                create_logger(__name__).error('%s: base configuration %s not readable', name, self.__base_configuration__)
+                valid = False
+            else:
+                for key in configuration.configuration:
+                    if key not in configuration.base_configuration:
+                        create_logger(__name__).warning('%s: unknown key %s will be ignored', name, key)
+
+        for key in self.__required_keys__:
+            if key not in configuration.configuration:
+                create_logger(__name__).error('%s: missing required key %s', name, key)
+                valid = False
+
+        for key, choices in self.__choices__.items():
+            if configuration[key] not in choices:
+                create_logger(__name__).error('%s: %s is %r, choose one of %s', name, key, configuration[key], choices)
+                valid = False
+
+        return valid
+
     def update(self) -> None:
         '''Main computation inside the module is done here. This is called by the TUNA exec. 
         This has to be implemented each time in the updated module.
         '''
 
+    def plan(self, configuration: ModuleConfiguration | None = None) -> dict[str, Any] | None:
+        '''Estimate the cost of `update()` without running it (`tuna --plan`), printing a short
+        report. Modules without a planner return `None`.
+        '''
+
+        create_logger(__name__).warning('No planner for %s.%s', self.__class__.__module__, self.__class__.__name__)
+        return None
+
     def __call__(self, configuration: ModuleConfiguration | None = None) -> Any:
         if self.configuration is None:
             if configuration is not None:
@@ -31,8 +83,16 @@ class Module:
                     'No configuration was passed when calling the module'
                 )
         
-        ## Call module main
-        self.update()
+        from tuna.utils.profiling import Profiler
+
+        ## Call module main, timing its phases (see `tuna.utils.profiling`)
+        profiler = getattr(self.configuration, 'profiler', None) or Profiler(self.__class__.__name__)
+        with profiler.activate(), profiler.phase('update', module=f'{self.__class__.__module__}.{self.__class__.__name__}'):
+            self.update()
+
+        ## The workers of a queue leave the outputs to the coordinator
+        if self.configuration['profile_report'] and self.configuration['output_path'] and not self.configuration.worker:
+            profiler.write(Path(self.configuration['output_path'], f'{self.configuration["output_name"]}_profile.json'))
 
     def __str__(self) -> str:
         ## Mainly storing version informations about the current module and/or important versioning stuff
@@ -0,0 +1,134 @@
+'''score_bdt.ScoreBDT
+
+This module applies a model trained by `TrainBDT` to large event files and writes the
+scores in binary format. '''
+
+import glob
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from os import path
+from pathlib import Path
+
+import numpy as np
+from tqdm import tqdm
+
+from tuna.utils.helpers import ModuleConfiguration, create_logger
+from tuna.modules import Module
+from tuna.utils import profiling
+from tuna.utils.loaders import _digitize, iter_chunks
+from tuna.utils.resources import resolve_n_jobs
+
+
+class ScoreBDT(Module):
+    '''This module applies a model trained by `TrainBDT` to large event files and writes the
+    scores in binary format.
+
+    The files matching `input_dataset_path` (csv files in the training layout, the label
+    column being ignored if present, or ROOT files with the `root_branches` features) are
+    read in chunks of `chunk_rows` events, converted to the feature storage of the training
+    and scored a chunk at a time, `n_jobs` files in parallel. The scores (the probability of
+    the last class, `float32`, in the order of the events in the file) of each input file are
+    written to `{output_path}/{output_name}/{file name}.npy`, listed in
+    `{output_name}_manifest.json`. '''
+
+    __author__ = 'M Sotgia'
+    __mail__ = 'mattia.sotgia@ge.infn.it'
+    __version__ = 'v01_00_00'
+    __date__ = 'oct 18th, 2026'
+    __base_configuration__ = '$TUNA_PATH/configurations/base/score_bdt.json'
+    __required_keys__ = ('model_path', 'input_dataset_path', 'output_path')
+    __choices__ = {
+        'dataset_format': ('auto', 'csv', 'root'),
+    }
+
+    def update(self):
+
+        ## The scientific stack is only imported here, not when the module is inspected or validated
+        with profiling.phase('imports'):
+            import joblib
+
+        self.configuration.default(path.expandvars(self.__base_configuration__))
+        __config: ModuleConfiguration = self.configuration
+
+        output_path = __config.get('output_path', required=True)
+        output_name = __config.get('output_name')
+        dataset_string = path.expandvars(__config.get('input_dataset_path', required=True))
+        chunk_rows = __config.get('chunk_rows')
+
+        with profiling.phase('model_load'):
+            model = joblib.load(path.expandvars(__config.get('model_path', required=True)))
+
+        files = sorted(glob.glob(dataset_string))
+        if not files:
+            create_logger(__name__).error('Empty list? Check import...')
+            sys.exit(2)
+
+        names = [Path(f).stem for f in files]
+        if len(set(names)) != len(names):
+            create_logger(__name__).error('The input files must have distinct names, the scores are written by file name')
+            sys.exit(2)
+
+        dataset_format = __config.get('dataset_format')
+        if dataset_format == 'auto':
+            dataset_format = 'root' if dataset_string.endswith('.root') else 'csv'
+        if dataset_format == 'root':
+            reader = dict(tree=__config.get('root_tree', required=True), branches=__config.get('root_branches', required=True)[:model['n_features']])
+        else:
+            ## The first column is the index, a label column after the features is ignored
+            reader = dict(usecols=list(range(1, 1 + model['n_features'])))
+
+        available = resolve_n_jobs(__config.get('n_jobs'), __config.cpu_budget)
+        n_workers = max(1, min(len(files), available))
+        score = self.scorer(model, max(1, available // n_workers))
+
+        scores_path = Path(output_path, output_name)
+        scores_path.mkdir(parents=True, exist_ok=True)
+
+        def __score_file(idx: int) -> int:
+            parts = [score(matrix) for _, _, matrix in iter_chunks([files[idx]], chunk_rows, **reader)]
+            scores = np.concatenate(parts) if parts else np.empty(0, dtype=np.float32)
+            np.save(scores_path / f'{names[idx]}.npy', scores)
+            return scores.size
+
+        print(f'Scoring {len(files)} files with {n_workers} workers, {chunk_rows} events at a time')
+        manifest, start = [], time.perf_counter()
+        with profiling.phase('score', files=len(files)):
+            with ThreadPoolExecutor(max_workers=n_workers) as executor:
+                futures = {executor.submit(__score_file, idx): idx for idx in range(len(files))}
+                for future in tqdm(as_completed(futures), total=len(files)):
+                    idx = futures[future]
+                    try:
+                        manifest.append({'input': files[idx], 'scores': str(scores_path / f'{names[idx]}.npy'), 'events': future.result()})
+                    except Exception as e:
+                        create_logger(__name__).error('Having some problems with a file...\n%s\n%s', files[idx], e)
+
+        elapsed = time.perf_counter() - start
+        n_events = sum(entry['events'] for entry in manifest)
+        print(f'Scored {n_events} events from {len(manifest)} files in {elapsed:.1f} s ({n_events / max(elapsed, 1e-9):.0f} events/s)')
+
+        with open(Path(output_path, f'{output_name}_manifest.json'), 'w') as f:
+            json.dump({'model_path': __config.get('model_path'), 'files': sorted(manifest, key=lambda entry: entry['input'])}, f, indent=1)
+
+        if len(manifest) != len(files):
+            create_logger(__name__).error('%d of %d files could not be scored', len(files) - len(manifest), len(files))
+            sys.exit(2)
+
+    @staticmethod
+    def scorer(model: dict, nthread: int):
+        '''Vectorized scoring function of a chunk of raw features, for a model written by `TrainBDT`'''
+
+        bin_edges, dtype = model['bin_edges'], np.dtype(model['feature_dtype'])
+
+        def __features(matrix: np.ndarray) -> np.ndarray:
+            return _digitize(matrix, bin_edges, dtype) if bin_edges is not None else matrix.astype(dtype, copy=False)
+
+        if model['estimator'] == 'xgboost':
+            ## Thread safe, no DMatrix built for every chunk
+            booster = model['model'].get_booster()
+            booster.set_param({'nthread': nthread})
+            return lambda matrix: booster.inplace_predict(__features(matrix)).astype(np.float32, copy=False)
+
+        estimator = model['model']
+        return lambda matrix: estimator.predict_proba(__features(matrix))[:, -1].astype(np.float32)
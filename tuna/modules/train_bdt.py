@@ -0,0 +1,142 @@
+'''train_bdt.TrainBDT
+
+This module refits the best configuration found by a cross validation module on the
+whole training sample and serializes the trained model. '''
+
+import math
+import sys
+from os import path
+from pathlib import Path
+from typing import Any
+
+from tuna.utils.helpers import ModuleConfiguration, create_logger
+from tuna.modules import Module
+from tuna.modules.kfold_cv import WEAK_LEARNERS, binned_weak_learner
+from tuna.utils import profiling
+from tuna.utils.loaders import EQUALIZATION_MODES, FEATURE_DTYPES, LOADER_ENGINES, DatasetLoader
+from tuna.utils.resources import resolve_n_jobs
+from tuna.utils.results import open_results
+
+ESTIMATORS = ('adaboost', 'xgboost')
+
+
+def read_best_parameters(cv_results_path: str) -> dict[str, Any]:
+    '''Parameters of the best ranked candidate of the results written by the cross validation
+    modules, in any `results_format` (the pruned candidates are ranked last)
+
+    With early stopping (`mean_best_iteration`, native XGBoost engine) `n_estimators` is the
+    mean number of rounds kept on the folds rather than the maximum of the grid.
+    '''
+
+    results = open_results(cv_results_path)
+    parameters = results.best_parameters()
+    if 'mean_best_iteration' in results.columns:
+        best = results.top_k(1, by='rank_test_score', columns=['mean_best_iteration'], ascending=True)
+        best_iteration = float(best['mean_best_iteration'].iloc[0])
+        if math.isfinite(best_iteration):
+            parameters['n_estimators'] = max(1, round(best_iteration))
+    return parameters
+
+
+class TrainBDT(Module):
+    '''This module refits the best configuration found by a cross validation module on the
+    whole training sample and serializes the trained model.
+
+    The parameters are the best ranked ones of `cv_results_path` (the results written by
+    `KFoldCV` or `XGBKFoldCV`, e.g. of a subroutine listed in `depends_on`), updated with
+    `parameters`. The model is written with `joblib` to `{output_name}.pkl`, together with
+    everything `ScoreBDT` needs to apply it (the feature storage, the quantile bins). When
+    `training_split` holds some events out, the model is scored on them. '''
+
+    __author__ = 'M Sotgia'
+    __mail__ = 'mattia.sotgia@ge.infn.it'
+    __version__ = 'v01_00_00'
+    __date__ = 'oct 18th, 2026'
+    __base_configuration__ = '$TUNA_PATH/configurations/base/train_bdt.json'
+    __required_keys__ = ('training_dataset_path', 'output_path')
+    __choices__ = {
+        'dataset_format': ('auto', 'csv', 'root'),
+        'loader_engine': LOADER_ENGINES,
+        'feature_dtype': FEATURE_DTYPES,
+        'equalize_classes': (False, True, *EQUALIZATION_MODES),
+        'estimator': ESTIMATORS,
+        'weak_learner': WEAK_LEARNERS,
+    }
+
+    def update(self):
+
+        ## The scientific stack is only imported here, not when the module is inspected or validated
+        with profiling.phase('imports'):
+            import joblib
+            from sklearn.metrics import get_scorer
+
+        self.configuration.default(path.expandvars(self.__base_configuration__))
+        __config: ModuleConfiguration = self.configuration
+
+        output_path = __config.get('output_path', required=True)
+        output_name = __config.get('output_name')
+        if __config.get('estimator') == 'adaboost':
+            binned_weak_learner(__config)
+
+        parameters = self.parameters()
+        estimator = self.estimator().set_params(**parameters)
+        print(f'Training {__config.get("estimator")} with {parameters}')
+
+        with profiling.phase('dataset_load'):
+            loader = DatasetLoader.from_configuration(__config)
+
+        train, test = loader.train_index, loader.test_index
+        with profiling.phase('fit', rows=train.size):
+            if loader.sample_weight is not None:
+                estimator.fit(loader.features[train], loader.labels[train], sample_weight=loader.sample_weight[train])
+            else:
+                estimator.fit(loader.features[train], loader.labels[train])
+
+        hold_out_score = None
+        if test.size:
+            scoring = __config.get('scoring')
+            with profiling.phase('hold_out_score', rows=test.size):
+                hold_out_score = float(get_scorer(scoring)(estimator, loader.features[test], loader.labels[test]))
+            print(f'Hold-out {scoring}: {hold_out_score:.4f} on {test.size} events')
+
+        model = {
+            'model': estimator,
+            'estimator': __config.get('estimator'),
+            'parameters': parameters,
+            'n_features': loader.features.shape[1],
+            'feature_dtype': str(loader.features.dtype),
+            'bin_edges': loader.bin_edges,
+            'classes': estimator.classes_,
+            'hold_out_score': hold_out_score,
+            'training_dataset_path': __config.get('training_dataset_path'),
+            'module_version': self.__version__,
+        }
+        with profiling.phase('model_write'):
+            model_path = Path(output_path, f'{output_name}.pkl')
+            joblib.dump(model, model_path)
+        print(f'Model written to {model_path}')
+
+    def parameters(self) -> dict[str, Any]:
+        '''The parameters of the refit, from `cv_results_path` and `parameters`'''
+
+        cv_results_path = self.configuration.get('cv_results_path')
+        overrides = self.configuration.get('parameters') or {}
+        if not cv_results_path and not overrides:
+            create_logger(__name__).error('Nothing to train, set cv_results_path and/or parameters')
+            sys.exit(2)
+
+        parameters = read_best_parameters(path.expandvars(cv_results_path)) if cv_results_path else {}
+        return {**parameters, **overrides}
+
+    def estimator(self):
+        '''The estimator of the cross validation module the parameters come from'''
+
+        if self.configuration.get('estimator') == 'xgboost':
+            from tuna.modules.xgb_kfold_cv import XGBKFoldCV
+
+            estimator = XGBKFoldCV().estimator()
+            return estimator.set_params(verbosity=1, n_jobs=resolve_n_jobs(self.configuration.get('n_jobs'), self.configuration.cpu_budget))
+
+        from tuna.modules.kfold_cv import KFoldCV
+
+        return KFoldCV().estimator(self.configuration.get('weak_learner'))
@@ -3,18 +3,18 @@
 This module perform the k-fold cross validation using the sample passed trough the 
 module configuration file. '''
 
+import sys
 from os import path
-from pathlib import Path
-
-import pandas as pd
-from sklearn.model_selection import GridSearchCV, RepeatedStratifiedKFold
-
-import xgboost as xgb
-from xgboost import XGBClassifier
 
 from tuna.utils.helpers import ModuleConfiguration, create_logger
 from tuna.modules import Module
-from tuna.utils.loaders import DatasetLoader
+from tuna.utils import profiling
+from tuna.utils.loaders import EQUALIZATION_MODES, FEATURE_DTYPES, LOADER_ENGINES, DatasetLoader
+from tuna.utils.resources import resolve_n_jobs, search_layout, thread_limits
+from tuna.utils.results import RESULTS_FORMATS, results_format_available, write_results
+from tuna.utils.search import SEARCH_STRATEGIES, build_search, with_resource
+from tuna.utils.shared import SharedDataset
+from tuna.utils.work_queue import SEARCH_BACKENDS
 
 class XGBKFoldCV(Module):
     '''This module perform the k-fold cross validation using the sample passed trough the 
@@ -24,63 +24,184 @@ class XGBKFoldCV(Module):
     __mail__ = 'mattia.sotgia@ge.infn.it'
     __version__ = 'v01_00_00'
     __date__ = 'mar 7th, 2025'
+    __base_configuration__ = '$TUNA_PATH/configurations/base/xgb_kfold_cv.json'
+    __required_keys__ = (
+        'training_dataset_path', 'output_path', 'learning_rate', 'min_split_loss', 'max_depth',
+        'min_child_weight', 'max_delta_step', 'colsample_bytree', 'colsample_bylevel', 'colsample_bynode',
+    )
+    __integer_parameters__ = ('max_depth', 'n_estimators')
+    __choices__ = {
+        'dataset_format': ('auto', 'csv', 'root'),
+        'loader_engine': LOADER_ENGINES,
+        'feature_dtype': FEATURE_DTYPES,
+        'equalize_classes': (False, True, *EQUALIZATION_MODES),
+        'search_strategy': SEARCH_STRATEGIES,
+        'search_backend': SEARCH_BACKENDS,
+        'results_format': RESULTS_FORMATS,
+        'xgb_engine': ('sklearn', 'native'),
+        'streaming': (False, True),
+    }
+
+    def validate(self, configuration: ModuleConfiguration | None = None) -> bool:
+        configuration = configuration or self.configuration
+        valid = super().validate(configuration)
+        ## A results format that cannot be written would only fail once the search is over
+        return results_format_available(configuration['results_format']) and valid
 
     def update(self):
-        
+
         # 1. Initialize all ecessry steps
-        self.configuration.default(path.expandvars('$TUNA_PATH/configurations/base/xgb_kfold_cv.json'))
+        self.configuration.default(path.expandvars(self.__base_configuration__))
         __config: ModuleConfiguration = self.configuration
         
-        training_dataset_path: str = __config.get('training_dataset_path', required=True)
-
         output_path = __config.get('output_path', required=True)
         output_name = __config.get('output_name')
+        if not results_format_available(__config.get('results_format')):
+            sys.exit(2)
+
+        if __config.get('search_backend') == 'queue' and (__config.get('streaming') or __config.get('xgb_engine') == 'native'):
+            create_logger(__name__).error('The queue search_backend only runs the sklearn xgb_engine, without streaming')
+            sys.exit(2)
+
+        if __config.get('streaming'):
+            ## Out of core: the dataset is read in chunks at every pass, never loaded as a whole
+            grid_search = self.streaming_search()
+        else:
+            grid_search = self.in_memory_search()
+
+        ## A worker only serves the queue, the coordinator writes the results
+        if __config.worker:
+            return
+
+        cv_results_grid = with_resource(grid_search.cv_results_, __config)
+        if profiling.current() is not None:
+            profiling.current().add_candidates(cv_results_grid)
+        
+        with profiling.phase('result_write', format=__config.get('results_format')):
+            ## Unless the search already wrote them while running
+            if getattr(grid_search, 'results_writer', None) is None:
+                write_results(cv_results_grid, output_path, output_name, __config.get('results_format'), __config.get('results_batch_rows'))
+
+        # print('The found best results are ')
+        # print(grid_search.best_params_)
+        # print('\n')
+        # print(results_df)
+
+    def in_memory_search(self):
+        '''Load the dataset and run the search on it, return the fitted search'''
+
+        with profiling.phase('imports'):
+            from sklearn.model_selection import RepeatedStratifiedKFold
+
+            from tuna.utils.xgb_native import NativeXGBSearchCV
+
+        __config: ModuleConfiguration = self.configuration
 
         # 2. Load all the data for training/testing and so on...
-        dataset_string = path.join(training_dataset_path)
-        loader = DatasetLoader.load_csv(
-            dataset_string,
-            equalize_populations=__config.get('equalize_classes'),
-            split=__config.get('training_split'),
-            shuffle=__config.get('shuffle_dataset')
-        )
+        with profiling.phase('dataset_load'):
+            loader = DatasetLoader.from_configuration(__config)
 
         signals = loader.features
         labels = loader.labels
 
         # 3. Define the parameter grids
 
-        parameters_grid = {
-            'learning_rate'     : __config.get('learning_rate', required=True),
-            'min_split_loss'    : __config.get('min_split_loss', required=True),
-            'max_depth'         : __config.get('max_depth', required=True),
-            'min_child_weight'  : __config.get('min_child_weight', required=True),
-            'max_delta_step'    : __config.get('max_delta_step', required=True),
-            'colsample_bytree'  : __config.get('colsample_bytree', required=True),
-            'colsample_bylevel' : __config.get('colsample_bylevel', required=True),
-            'colsample_bynode'  : __config.get('colsample_bynode', required=True)
-        }
+        parameters_grid = self.parameters_grid()
 
         # 4. Define the CV k-folding
 
-        estimator = XGBClassifier(objective='binary:logistic', verbosity=3, n_jobs=1)
+        estimator = self.estimator()
 
         kfolds: list = __config.get('kfolds')
         n_splits, n_repeats = kfolds
-        cv = RepeatedStratifiedKFold(n_splits=n_splits, n_repeats=n_repeats)
+        cv = loader.folds(RepeatedStratifiedKFold(n_splits=n_splits, n_repeats=n_repeats, random_state=__config.get('random_state')))
 
         scoring = __config.get('scoring')
-        n_jobs = __config.get('n_jobs', True)
 
-        grid_search = GridSearchCV(estimator=estimator, param_grid=parameters_grid, cv=cv, scoring=scoring, n_jobs=n_jobs, verbose=5)
-        grid_search.fit(signals, labels)
-        cv_results_grid = grid_search.cv_results_
-        
-        results_df = pd.DataFrame(cv_results_grid)
-        results_df.to_csv(Path(output_path, f'{output_name}.csv'))
+        ## The workers attach to one read-only copy of the dataset instead of receiving their own
+        with SharedDataset(__config.get('shared_dataset_path'), enabled=__config.get('shared_dataset')) as shared:
+            with profiling.phase('share_dataset'):
+                signals = shared.array('features', signals)
+                labels = shared.array('labels', labels)
+                sample_weight = shared.array('sample_weight', loader.sample_weight)
+                cv = shared.folds(cv)
+
+            if __config.get('xgb_engine') == 'native':
+                ## The native engine splits the cores between its models itself (`thread_layout`)
+                n_threads = None
+                grid_search = NativeXGBSearchCV(
+                    parameters_grid, cv, scoring=scoring, n_jobs=resolve_n_jobs(__config.get('n_jobs'), __config.cpu_budget),
+                    early_stopping_rounds=__config.get('early_stopping_rounds'),
+                    validation_fraction=__config.get('early_stopping_fraction'), nthread=__config.get('xgb_nthread'),
+                    max_bin=__config.get('xgb_max_bin'), random_state=__config.get('random_state'),
+                    pruning_percentile=__config.get('pruning_percentile'), pruning_min_folds=__config.get('pruning_min_folds')
+                )
+            else:
+                n_jobs, n_threads = search_layout(__config, loader.train_index.size, signals.shape[1], signals.dtype.itemsize)
+                estimator.set_params(n_jobs=n_threads)
+                grid_search = build_search(estimator, parameters_grid, cv, scoring, n_jobs, __config,
+                                           integer_parameters=self.__integer_parameters__)
+            with profiling.phase('search', search=type(grid_search).__name__), thread_limits(n_threads):
+                if sample_weight is not None:
+                    grid_search.fit(signals, labels, sample_weight=sample_weight)
+                else:
+                    grid_search.fit(signals, labels)
+        return grid_search
+
+    def streaming_search(self):
+        '''Run the grid search of the native engine on the dataset streamed from the files
+        (`tuna.utils.streaming`), return the fitted search'''
+
+        with profiling.phase('imports'):
+            from tuna.utils.streaming import StreamingDataset, StreamingXGBSearchCV
 
-        # print('The found best results are ')
-        # print(grid_search.best_params_)
-        # print('\n')
-        # print(results_df)
+        __config: ModuleConfiguration = self.configuration
+
+        if __config.get('search_strategy') != 'grid' or __config.get('staged_parameter'):
+            create_logger(__name__).error('The streaming mode only supports the grid search strategy (no staged_parameter)')
+            sys.exit(2)
+
+        n_splits, n_repeats = __config.get('kfolds')
+        grid_search = StreamingXGBSearchCV(
+            self.parameters_grid(), n_splits=n_splits, n_repeats=n_repeats, cache_path=__config.get('stream_cache_path'),
+            scoring=__config.get('scoring'), n_jobs=resolve_n_jobs(__config.get('n_jobs'), __config.cpu_budget),
+            early_stopping_rounds=__config.get('early_stopping_rounds'),
+            validation_fraction=__config.get('early_stopping_fraction'), nthread=__config.get('xgb_nthread'),
+            max_bin=__config.get('xgb_max_bin'), random_state=__config.get('random_state'),
+            pruning_percentile=__config.get('pruning_percentile'), pruning_min_folds=__config.get('pruning_min_folds')
+        )
+        with profiling.phase('search', search=type(grid_search).__name__):
+            grid_search.fit(StreamingDataset.from_configuration(__config))
+        return grid_search
  
+    def parameters_grid(self) -> dict[str, list]:
+        '''The parameter grid of the search, from the module configuration'''
+
+        return {
+            'learning_rate'     : self.configuration.get('learning_rate', required=True),
+            'min_split_loss'    : self.configuration.get('min_split_loss', required=True),
+            'max_depth'         : self.configuration.get('max_depth', required=True),
+            'min_child_weight'  : self.configuration.get('min_child_weight', required=True),
+            'max_delta_step'    : self.configuration.get('max_delta_step', required=True),
+            'colsample_bytree'  : self.configuration.get('colsample_bytree', required=True),
+            'colsample_bylevel' : self.configuration.get('colsample_bylevel', required=True),
+            'colsample_bynode'  : self.configuration.get('colsample_bynode', required=True),
+            'n_estimators'      : self.configuration.get('n_estimators')
+        }
+
+    def estimator(self):
+        '''The estimator tuned by the search'''
+
+        from xgboost import XGBClassifier
+
+        return XGBClassifier(objective='binary:logistic', verbosity=3, n_jobs=1)
+
+    def plan(self, configuration: ModuleConfiguration | None = None) -> dict:
+        if configuration is not None:
+            self.configuration = configuration
+        self.configuration.default(path.expandvars(self.__base_configuration__))
+
+        from tuna.utils.planner import plan_cross_validation
+
+        return plan_cross_validation(self.configuration, self.estimator(), self.parameters_grid(), engine='streaming' if self.configuration.get('streaming') else
+                                     'threads' if self.configuration.get('xgb_engine') == 'native' else 'joblib')
@@ -0,0 +1,296 @@
+'''On-disk caches: parsed datasets and fit results
+
+The parsed matrices are stored as `.npy` files named after a key built from the list of
+input files (with their sizes and modification times) and the selected columns, so that
+any change to the inputs invalidates the entry. Entries are reopened
+memory-mapped, hence concurrent jobs on the same node share the same pages. The cache is
+bounded in size, the least recently used entries are evicted first.
+
+The csv files are also cached one by one, as shards in the `shards` subdirectory keyed on
+the path, size and modification time of their file: when files are added to a glob only the
+new ones are parsed, and the entry of the new glob is assembled from the shards, on disk. A
+file which fails to parse gets a `.failed` marker instead, and is skipped (not parsed
+again) until it changes. The markers are evicted with the entries and shards.
+
+The scores of the single (candidate, fold) fits are memoized by `FitCache`, keyed on the
+content of everything they depend on.
+'''
+
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Collection
+
+import numpy as np
+
+from tuna.utils.helpers import create_logger
+
+
+def array_fingerprint(*arrays: np.ndarray | None) -> str:
+    '''Content hash of numpy arrays (shape, dtype and data), `None` entries included'''
+
+    digest = hashlib.blake2b(digest_size=16)
+    for array in arrays:
+        if array is None:
+            digest.update(b'None')
+            continue
+        array = np.atleast_1d(np.asarray(array))
+        digest.update(f'{array.shape}{array.dtype.str}'.encode())
+        ## Hash by blocks of rows (~64 MB) to bound the temporary copies of non-contiguous views
+        step = max(1, (1 << 26) // max(1, array[:1].nbytes))
+        for start in range(0, array.shape[0], step):
+            digest.update(array[start:start + step].tobytes())
+    return digest.hexdigest()
+
+
+class DatasetCache:
+    '''Size-bounded LRU cache of `.npy` matrices
+
+    Parameters
+    ----------
+    `path`: `str`
+        Directory holding the cache entries (created if missing)
+    `max_size_gb`: `float` or `None`
+        Maximum size of the cache, `None` for no limit
+    '''
+
+    suffix = '.npy'
+
+    def __init__(self, path: str, max_size_gb: float | None = None):
+        self.path = Path(os.path.expandvars(path)).expanduser()
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = None if max_size_gb is None else int(max_size_gb * 1024**3)
+
+    @staticmethod
+    def key(files: list[str], columns: list[int] | range, **extra) -> str:
+        '''Build the cache key from the file list (path, size, mtime) and the column selection'''
+
+        description = {
+            'files': [(str(Path(f).resolve()), os.stat(f).st_size, os.stat(f).st_mtime_ns) for f in sorted(files)],
+            'columns': list(columns),
+            **extra
+        }
+        return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+    def entry(self, key: str) -> Path:
+        return self.path / f'{key}{self.suffix}'
+
+    def get(self, key: str) -> np.ndarray | None:
+        '''Return the memory-mapped (read-only) entry, or `None` on a miss'''
+
+        entry = self.entry(key)
+        if not entry.exists():
+            return None
+        try:
+            array = np.load(entry, mmap_mode='r')
+        except Exception as e:
+            create_logger(__name__).warning('Dropping unreadable cache entry %s\n%s', entry, e)
+            entry.unlink(missing_ok=True)
+            return None
+
+        ## Refresh the entry for the LRU policy (atime is unreliable on noatime mounts)
+        os.utime(entry)
+        create_logger(__name__).info('Dataset loaded from cache %s', entry)
+        return array
+
+    def put(self, key: str, array: np.ndarray) -> Path:
+        '''Store `array` under `key` (atomically) and apply the eviction policy'''
+
+        entry = self.entry(key)
+        with tempfile.NamedTemporaryFile(dir=self.path, suffix='.tmp', delete=False) as f:
+            np.save(f, array)
+        os.replace(f.name, entry)
+        self.evict(keep={entry})
+        return entry
+
+    def shard(self, key: str) -> Path:
+        return self.path / 'shards' / f'{key}{self.suffix}'
+
+    def put_shard(self, key: str, array: np.ndarray) -> None:
+        '''Store the parsed content of a single file (atomically). No eviction: the caller
+        evicts once all the shards of a load are written, keeping them (see `evict`)'''
+
+        entry = self.shard(key)
+        entry.parent.mkdir(exist_ok=True)
+        ## Row-major, `assemble` copies the raw bytes into the rows of the matrix
+        with tempfile.NamedTemporaryFile(dir=entry.parent, suffix='.tmp', delete=False) as f:
+            np.save(f, np.ascontiguousarray(array))
+        os.replace(f.name, entry)
+
+    def put_failure(self, key: str, message: str) -> None:
+        '''Record that the file of `key` could not be parsed'''
+
+        entry = self.shard(key).with_suffix('.failed')
+        entry.parent.mkdir(exist_ok=True)
+        entry.write_text(message)
+
+    def failure(self, key: str) -> str | None:
+        '''The recorded parse error of the file of `key`, `None` if there is none'''
+
+        entry = self.shard(key).with_suffix('.failed')
+        try:
+            message = entry.read_text()
+        except FileNotFoundError:
+            return None
+        ## Still in use, refresh the marker for the LRU policy
+        os.utime(entry)
+        return message
+
+    def assemble(self, key: str, shards: list[str], n_workers: int | None = None) -> np.ndarray:
+        '''Assemble the `shards`, in order, into the entry `key` and return it memory-mapped
+        (read-only), as `get` does
+
+        The `.npy` headers give the rows of every shard, so that each one is read straight
+        into its slice of the entry (`n_workers` threads), without a copy in the process.
+        '''
+
+        def __header(shard: str) -> tuple[tuple[int, ...], np.dtype, int]:
+            entry = self.shard(shard)
+            with open(entry, 'rb') as f:
+                version = np.lib.format.read_magic(f)
+                read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0
+                shape, fortran_order, dtype = read_header(f)
+                offset = f.tell()
+            if fortran_order and len(shape) > 1 and shape[0] > 1:
+                raise ValueError(f'Column-major cache shard {entry}')
+            ## Refresh the entry for the LRU policy, as `get`
+            os.utime(entry)
+            return shape, dtype, offset
+
+        n_workers = n_workers or os.cpu_count() or 1
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            headers = list(executor.map(__header, shards))
+
+        rows = np.array([shape[0] for shape, _, _ in headers], dtype=np.int64)
+        offsets = np.concatenate(([0], np.cumsum(rows)))
+        shape, dtype, _ = headers[0]
+
+        ## Written aside and renamed, as `put`
+        with tempfile.NamedTemporaryFile(dir=self.path, suffix='.tmp', delete=False) as f:
+            temporary = Path(f.name)
+        output = np.lib.format.open_memmap(temporary, mode='w+', dtype=dtype, shape=(int(offsets[-1]), *shape[1:]))
+
+        def __read(idx: int) -> None:
+            target = output[offsets[idx]:offsets[idx + 1]].reshape(-1).view(np.uint8)
+            with open(self.shard(shards[idx]), 'rb') as f:
+                f.seek(headers[idx][2])
+                if f.readinto(target) != target.size:
+                    raise ValueError(f'Truncated cache shard {self.shard(shards[idx])}')
+
+        try:
+            with ThreadPoolExecutor(max_workers=n_workers) as executor:
+                list(executor.map(__read, range(len(shards))))
+            output.flush()
+        except BaseException:
+            temporary.unlink(missing_ok=True)
+            raise
+        finally:
+            del output
+
+        entry = self.entry(key)
+        os.replace(temporary, entry)
+        return np.load(entry, mmap_mode='r')
+
+    def evict(self, keep: Collection[Path] = ()) -> None:
+        '''Remove the least recently used entries (shards and `.failed` markers too) until the
+        cache fits in `max_bytes`, never the ones in `keep` (those of the current load)'''
+
+        if self.max_bytes is None:
+            return
+
+        entries = sorted([*self.path.rglob(f'*{self.suffix}'), *self.path.rglob('*.failed')], key=lambda e: e.stat().st_mtime)
+        total = sum(e.stat().st_size for e in entries)
+
+        for entry in entries:
+            if total <= self.max_bytes:
+                break
+            if entry in keep:
+                continue
+            total -= entry.stat().st_size
+            entry.unlink(missing_ok=True)
+            create_logger(__name__).info('Evicted cache entry %s', entry)
+
+
+class FitCache:
+    '''Content-addressed cache of the (candidate, fold) scores, shared across configurations and runs
+
+    The key of a result hashes the dataset fingerprint, the estimator class with its full set
+    of parameters, the scoring and the fold indices (which already encode the splitter, its
+    seed and the fold number). Entries live in a SQLite database, only accessed by the main
+    process; once more than `max_entries` are stored the least recently used are evicted.
+
+    Parameters
+    ----------
+    `path`: `str`
+        Directory of the cache database (created if missing)
+    `max_entries`: `int` or `None`
+        Maximum number of stored results, `None` for no limit
+    '''
+
+    filename = 'fit_cache.sqlite'
+
+    def __init__(self, path: str, max_entries: int | None = None):
+        directory = Path(os.path.expandvars(path)).expanduser()
+        directory.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.connection = sqlite3.connect(directory / self.filename, timeout=60)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS fits (key TEXT PRIMARY KEY, score REAL, fit_time REAL, score_time REAL, last_used REAL)'
+        )
+        self.connection.execute('CREATE INDEX IF NOT EXISTS fits_last_used ON fits (last_used)')
+        self.connection.commit()
+
+    @staticmethod
+    def key(dataset: str, estimator_name: str, parameters: dict, scoring, fold: str) -> str:
+        description = {
+            'dataset': dataset, 'estimator': estimator_name, 'parameters': sorted(parameters.items()),
+            'scoring': scoring, 'fold': fold
+        }
+        return hashlib.sha256(json.dumps(description, sort_keys=True, default=repr).encode()).hexdigest()
+
+    def get_many(self, keys: list[str], batch_size: int = 500) -> dict[str, tuple[float, float, float]]:
+        '''Look up `keys`, returning the found `(score, fit_time, score_time)` (and refreshing them)'''
+
+        found = {}
+        for start in range(0, len(keys), batch_size):
+            batch = keys[start:start + batch_size]
+            rows = self.connection.execute(
+                f'SELECT key, score, fit_time, score_time FROM fits WHERE key IN ({",".join("?" * len(batch))})', batch
+            ).fetchall()
+            ## SQLite stores nan (failed fits) as NULL
+            found.update({
+                key: (np.nan if score is None else score, fit_time, score_time) for key, score, fit_time, score_time in rows
+            })
+
+        if found:
+            now = time.time()
+            self.connection.executemany('UPDATE fits SET last_used = ? WHERE key = ?', [(now, key) for key in found])
+            self.connection.commit()
+        return found
+
+    def put(self, key: str, result: tuple[float, float, float], commit: bool = False) -> None:
+        score, fit_time, score_time = (float(value) for value in result)
+        self.connection.execute(
+            'INSERT OR REPLACE INTO fits VALUES (?, ?, ?, ?, ?)', (key, score, fit_time, score_time, time.time())
+        )
+        if commit:
+            self.connection.commit()
+
+    def evict(self) -> None:
+        '''Drop the least recently used results beyond `max_entries`'''
+
+        if self.max_entries is not None:
+            self.connection.execute(
+                'DELETE FROM fits WHERE key IN (SELECT key FROM fits ORDER BY last_used DESC LIMIT -1 OFFSET ?)',
+                (self.max_entries,)
+            )
+        self.connection.commit()
+
+    def close(self) -> None:
+        self.evict()
+        self.connection.close()
@@ -0,0 +1,105 @@
+'''Append-only store of the (candidate, fold) results, to resume interrupted searches
+
+Every finished (candidate, fold) evaluation is appended as one JSON line to a file named
+after the output and a fingerprint of the search (estimator, parameter grid, scoring, dataset
+and fold indices). A restarted run with the same configuration finds the same file, skips
+what is already there and only computes the missing evaluations; a different configuration
+gets a different file, so results are never mixed.
+'''
+
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any
+
+from tuna.utils.helpers import create_logger
+
+
+def candidate_key(parameters: dict[str, Any]) -> str:
+    '''Canonical (order independent) representation of a candidate'''
+    return json.dumps(parameters, sort_keys=True, default=repr)
+
+
+class ResultStore:
+    '''JSON lines store of `(score, fit_time, score_time)` per (candidate, fold)
+
+    Parameters
+    ----------
+    `path`: `str`
+        Directory of the checkpoint files
+    `name`: `str`
+        Prefix of the file name (usually the `output_name`)
+    `fingerprint`: `dict`
+        Description of the search, its hash identifies the file
+    `sync_interval`: `float`
+        Seconds between two `fsync` of the file (every line is flushed anyway)
+    '''
+
+    def __init__(self, path: str, name: str, fingerprint: dict[str, Any], sync_interval: float = 5.):
+        digest = hashlib.sha256(json.dumps(fingerprint, sort_keys=True, default=repr).encode()).hexdigest()[:16]
+        directory = Path(os.path.expandvars(path)).expanduser()
+        directory.mkdir(parents=True, exist_ok=True)
+
+        self.path = directory / f'{name}_{digest}.jsonl'
+        self.sync_interval = sync_interval
+        self.results: dict[tuple[str, int], tuple[float, float, float]] = {}
+
+        if self.path.exists():
+            self._read()
+            create_logger(__name__).warning(
+                'Resuming from %s, %d (candidate, fold) results already available', self.path, len(self.results)
+            )
+
+        self._file = open(self.path, 'a')
+        if self._file.tell() and not self._ends_with_newline():
+            self._file.write('\n')
+        if not self.results and self._file.tell() == 0:
+            self._file.write(json.dumps({'fingerprint': fingerprint}, sort_keys=True, default=repr) + '\n')
+            self._file.flush()
+        self._last_sync = time.monotonic()
+
+    def _ends_with_newline(self) -> bool:
+        with open(self.path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b'\n'
+
+    def _read(self) -> None:
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    ## Truncated last line of a killed run
+                    continue
+                if 'candidate' in record:
+                    self.results[(record['candidate'], record['fold'])] = (
+                        record['score'], record['fit_time'], record['score_time']
+                    )
+
+    def __contains__(self, item: tuple[str, int]) -> bool:
+        return item in self.results
+
+    def get(self, key: str, fold: int) -> tuple[float, float, float] | None:
+        return self.results.get((key, fold))
+
+    def add(self, key: str, fold: int, result: tuple[float, float, float]) -> None:
+        '''Record one result and append it to the file'''
+
+        score, fit_time, score_time = (float(value) for value in result)
+        self.results[(key, fold)] = (score, fit_time, score_time)
+        self._file.write(json.dumps({
+            'candidate': key, 'fold': fold, 'score': score, 'fit_time': fit_time, 'score_time': score_time
+        }) + '\n')
+        self._file.flush()
+
+        if time.monotonic() - self._last_sync > self.sync_interval:
+            os.fsync(self._file.fileno())
+            self._last_sync = time.monotonic()
+
+    def close(self) -> None:
+        if not self._file.closed:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
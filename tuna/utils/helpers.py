@@ -6,6 +6,9 @@
 import logging
 import importlib
 import json
+import os
+import threading
+import time
 
 from io import TextIOWrapper
 import sys
@@ -38,9 +41,19 @@ class ModuleConfiguration:
         self.module_import_path: str | None =  module_configuration.pop(
             'module_import_path', self.module_name
         )
+        depends_on = module_configuration.pop('depends_on', [])
+        self.depends_on: list[str] = [depends_on] if isinstance(depends_on, str) else list(depends_on)
         self.configuration = module_configuration
         self.base_configuration = {}
         self.__default__ = False
+        ## Shared `tuna.utils.loaders.DatasetRegistry`, set by `Configuration.run`
+        self.datasets = None
+        ## `tuna.utils.profiling.Profiler` of the subroutine, set by `Configuration.run`
+        self.profiler = None
+        ## Only serving the work queue of the search (`tuna --worker`), set by `Configuration.work`
+        self.worker = False
+        ## Cores granted by the scheduler (`n_jobs` capped at the global budget), set by `Configuration.run`
+        self.cpu_budget: int | None = None
 
         if subroutine_name and not self.module_name:
             create_logger(__name__).error(
@@ -121,7 +134,10 @@ class Configuration:
         self.subroutines: list[str] = []
         self.name = 'unknown'
         self.path = 'tuna.modules'
+        self.cpu_budget: int | None = None
         self.initial_configuration: dict[str, Any] = {}
+        ## Wall and CPU seconds spent in `load`, reported as the `config_load` phase
+        self.load_time: tuple[float, float] = (0., 0.)
 
     def __str__(self) -> str:
         return f"{__name__}.Configuration(name='{self.name}' subroutines={self.subroutines})"
@@ -139,6 +155,8 @@ class Configuration:
         `Configuration`: `self`
         '''
 
+        start = time.perf_counter(), time.process_time()
+
         if isinstance(configuration, str):
             try:
                 with open(configuration) as f:
@@ -168,13 +186,70 @@ class Configuration:
 
         self.name = tmp.pop('name', self.name)
         self.path = tmp.pop('modules_path', self.path)
+        self.cpu_budget = tmp.pop('cpu_budget', self.cpu_budget)
 
         self.subroutines = list(tmp.keys())
+        self.load_time = (time.perf_counter() - start[0], time.process_time() - start[1])
 
         return self
 
-    def run(self, version=False) -> None:
+    def _build(self, subroutine: str, module_conf: ModuleConfiguration):
+        '''Import and instantiate the module of a subroutine, `None` if it cannot be found'''
+
+        ## Run the actual modules inside the configuration files
+        #  1. Import the module path
+        if not module_conf.module_name:
+            create_logger(__name__).warning(
+                'Stopped execution of subroutine %s, no module_name was provided', 
+                subroutine
+            )
+            return None
+
+        if isinstance(module_conf.module_name, str):
+            try:
+                module_path_imported = importlib.import_module(
+                    f'{self.path}.{module_conf.module_import_path}'
+                )
+            except ModuleNotFoundError:
+                create_logger(__name__).warning(
+                    'Whilist module_name was provided, no module found in %s, under the name %s. Skipping configuration...', 
+                    f'{self.path}.{module_conf.module_import_path}', module_conf.module_name
+                )
+                return None
+            except Exception as e:
+                create_logger(__name__).error(e)
+                return None
+            if not hasattr(module_path_imported, module_conf.module_name):
+                create_logger(__name__).warning(
+                    'Whilist module_name was provided, no <tuna.modules.Module> found in %s, under the name %s.\nSkipping configuration...', 
+                    f'{self.path}.{module_conf.module_import_path}', module_conf.module_name
+                )
+                return None
+
+            return getattr(module_path_imported, module_conf.module_name)()
+        return None
+
+    def _cpu_request(self, module_conf: ModuleConfiguration, budget: int) -> int:
+        '''Cores claimed by a subroutine: its `n_jobs` (all the budget if `auto`, unset or negative), capped at `budget`'''
+
+        n_jobs = module_conf.configuration.get('n_jobs')
+        if not isinstance(n_jobs, int) or n_jobs < 0:
+            return budget
+        return max(1, min(n_jobs, budget))
+
+    def run(self, version=False, profile: str | None = None) -> None:
         '''Run the current configuration. 
+
+        The subroutines run as soon as the ones listed in their `depends_on` key are done,
+        concurrently (in threads) as long as the sum of their `n_jobs` fits in the global
+        `cpu_budget` (by default the cores available). A subroutine asking for more than the
+        budget gets its `n_jobs` capped, and runs alone. The dependents of a failed subroutine
+        are skipped. Subroutines reading the same `training_dataset_path` share the loaded
+        dataset (`tuna.utils.loaders.DatasetRegistry`).
+
+        Every subroutine records its phases in a `tuna.utils.profiling.Profiler`. With
+        `profile` (a directory) each subroutine also runs under `cProfile`, whose stats are
+        dumped to `{profile}/{name}_{subroutine}.prof`.
         '''
 
         create_logger(__name__).info('Running %s', self)
@@ -182,53 +257,234 @@ class Configuration:
         print(f'Found {len(self.subroutines)} subroutines in configuration named {self.name}')
         print('Running...    ><(((º>  \n')
 
-        for idx, subroutine in enumerate(self.subroutines):
+        configurations = {
+            subroutine: ModuleConfiguration(self.initial_configuration.get(subroutine, {}), subroutine)
+            for subroutine in self.subroutines
+        }
 
-            print(f'[** {idx+1}] Running subroutine `{subroutine}`')
+        if version:
+            for idx, subroutine in enumerate(self.subroutines):
+                print(f'[** {idx+1}] Running subroutine `{subroutine}`')
+                module = self._build(subroutine, configurations[subroutine])
+                if module is not None:
+                    print(module)
+            return
+
+        order = self._schedule_order(configurations)
+
+        from tuna.utils.loaders import DatasetRegistry
+        from tuna.utils.profiling import Profiler
+        from tuna.utils.resources import available_cpus
+
+        budget = max(1, self.cpu_budget or available_cpus())
+        registry = DatasetRegistry()
+        for subroutine in order:
+            configurations[subroutine].datasets = registry
+            configurations[subroutine].profiler = Profiler(subroutine)
+            configurations[subroutine].profiler.add('config_load', *self.load_time)
+            if 'training_dataset_path' in configurations[subroutine].configuration:
+                registry.expect(configurations[subroutine].configuration['training_dataset_path'])
+
+        status: dict[str, str] = {}
+        running: dict[str, tuple[threading.Thread, int]] = {}
+        completed: list[str] = []
+        errors: dict[str, BaseException] = {}
+        finished = threading.Condition()
+
+        def __run(subroutine: str, module) -> None:
+            try:
+                if profile is None:
+                    module(configurations[subroutine])
+                else:
+                    self._profile(subroutine, module, configurations[subroutine], profile)
+            except BaseException as e:
+                errors[subroutine] = e
+            finally:
+                if 'training_dataset_path' in configurations[subroutine].configuration:
+                    registry.release(configurations[subroutine].configuration['training_dataset_path'])
+                with finished:
+                    completed.append(subroutine)
+                    finished.notify_all()
+
+        with finished:
+            while True:
+                while completed:
+                    subroutine = completed.pop()
+                    running.pop(subroutine)[0].join()
+                    status[subroutine] = 'failed' if subroutine in errors else 'done'
+                    if subroutine in errors and not isinstance(errors[subroutine], SystemExit):
+                        create_logger(__name__).error('Subroutine %s failed', subroutine, exc_info=errors[subroutine])
+
+                for subroutine in order:
+                    if subroutine in status:
+                        continue
+                    module_conf = configurations[subroutine]
+                    if any(status.get(dependency) in ('failed', 'skipped') for dependency in module_conf.depends_on):
+                        create_logger(__name__).warning('Skipping subroutine %s, a dependency did not complete', subroutine)
+                        status[subroutine] = 'skipped'
+                        continue
+                    if not all(status.get(dependency) == 'done' for dependency in module_conf.depends_on):
+                        continue
+
+                    ## Nothing oversubscribes the budget, but a lone subroutine always runs
+                    request = self._cpu_request(module_conf, budget)
+                    if running and sum(cpus for _, cpus in running.values()) + request > budget:
+                        continue
+
+                    print(f'[** {order.index(subroutine)+1}] Running subroutine `{subroutine}` ({request}/{budget} cpus)')
+                    print(module_conf)
+                    module = self._build(subroutine, module_conf)
+                    if module is None:
+                        status[subroutine] = 'skipped'
+                        continue
+                    module_conf.cpu_budget = request
+
+                    status[subroutine] = 'running'
+                    running[subroutine] = (threading.Thread(target=__run, args=(subroutine, module), name=subroutine, daemon=True), request)
+                    running[subroutine][0].start()
+
+                ## With nothing running every subroutine has been either run or skipped (topological order)
+                if not running:
+                    break
+                finished.wait()
+
+        if errors:
+            create_logger(__name__).error('Subroutines %s did not complete', sorted(errors))
+            sys.exit(2)
+
+    def work(self, profile: str | None = None) -> None:
+        '''Run as a worker (`tuna --worker`) of the subroutines whose `search_backend` is `queue`:
+        one after the other, load their dataset and run the tasks of their work queue (see
+        `tuna.utils.work_queue`) until the coordinator, i.e. the same configuration run without
+        `--worker`, is done. Nothing else runs and no output is written. Each subroutine gets
+        `n_jobs` cores, capped as in `run`.
+        '''
 
-            module_conf = ModuleConfiguration(
-                self.initial_configuration.get(subroutine, {}), subroutine
-            )
+        configurations = {
+            subroutine: ModuleConfiguration(self.initial_configuration.get(subroutine, {}), subroutine)
+            for subroutine in self.subroutines
+        }
+        queued = [
+            subroutine for subroutine in self._schedule_order(configurations)
+            if configurations[subroutine].configuration.get('search_backend') == 'queue'
+        ]
+        if not queued:
+            create_logger(__name__).error('No subroutine with search_backend queue in %s, nothing to work on', self.name)
+            sys.exit(2)
+
+        from tuna.utils.loaders import DatasetRegistry
+        from tuna.utils.profiling import Profiler
+        from tuna.utils.resources import available_cpus
+
+        budget = max(1, self.cpu_budget or available_cpus())
+        registry = DatasetRegistry()
+        for subroutine in queued:
+            module_conf = configurations[subroutine]
+            module = self._build(subroutine, module_conf)
+            if module is None:
+                continue
+            module_conf.worker = True
+            module_conf.datasets = registry
+            module_conf.profiler = Profiler(subroutine)
+            module_conf.cpu_budget = self._cpu_request(module_conf, budget)
 
-            if not version:
-                print(module_conf)
+            print(f'[** worker] Working for subroutine `{subroutine}` ({module_conf.cpu_budget}/{budget} cpus)')
+            if profile is None:
+                module(module_conf)
+            else:
+                self._profile(subroutine, module, module_conf, profile)
 
-            ## Run the actual modules inside the configuration files
-            #  1. Import the module path
-            if not module_conf.module_name:
-                create_logger(__name__).warning(
-                    'Stopped execution of subroutine %s, no module_name was provided', 
-                    subroutine
-                )
+    def _profile(self, subroutine: str, module, module_conf: ModuleConfiguration, directory: str) -> None:
+        '''Run a subroutine under `cProfile` (one profiler per thread), dump and summarize the stats'''
+
+        import cProfile
+        import io
+        import pstats
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.runcall(module, module_conf)
+        finally:
+            path = os.path.join(os.path.expandvars(directory), f'{self.name}_{subroutine}.prof')
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            profiler.dump_stats(path)
+            summary = io.StringIO()
+            pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(15)
+            print(f'cProfile stats of subroutine `{subroutine}` dumped to {path}\n{summary.getvalue()}')
+
+    def validate(self) -> bool:
+        '''Check every subroutine (module found, `Module.validate`) and the `depends_on` graph
+        without running anything. Only the module files are imported, which do not import the
+        scientific stack at top level.
+
+        Return
+        ------
+        `bool`: `True` if the whole configuration can run
+        '''
+
+        configurations = {
+            subroutine: ModuleConfiguration(dict(self.initial_configuration.get(subroutine, {})), subroutine)
+            for subroutine in self.subroutines
+        }
+        self._schedule_order(configurations)
+
+        valid = True
+        for subroutine, module_conf in configurations.items():
+            module = self._build(subroutine, module_conf)
+            if module is None or not module.validate(module_conf):
+                create_logger(__name__).error('Subroutine %s is not valid', subroutine)
+                valid = False
+            else:
+                print(f'Subroutine `{subroutine}` ({module_conf.module_name}): OK')
+        return valid
+
+    def plan(self) -> dict[str, Any]:
+        '''Print the cost estimate of every subroutine (`Module.plan`) without running them
+
+        Return
+        ------
+        `dict`: the estimate of each subroutine (`None` for the modules without a planner)
+        '''
+
+        configurations = {
+            subroutine: ModuleConfiguration(dict(self.initial_configuration.get(subroutine, {})), subroutine)
+            for subroutine in self.subroutines
+        }
+
+        plans = {}
+        for subroutine in self._schedule_order(configurations):
+            module = self._build(subroutine, configurations[subroutine])
+            if module is None:
                 continue
-            
-            if isinstance(module_conf.module_name, str):
-                try:
-                    module_path_imported = importlib.import_module(
-                        f'{self.path}.{module_conf.module_import_path}'
-                    )
-                except ModuleNotFoundError:
-                    create_logger(__name__).warning(
-                        'Whilist module_name was provided, no module found in %s, under the name %s. Skipping configuration...', 
-                        f'{self.path}.{module_conf.module_import_path}', module_conf.module_name
-                    )
-                    continue
-                except Exception as e:
-                    create_logger(__name__).error(e)
-                    continue
-                if not hasattr(module_path_imported, module_conf.module_name):
-                    create_logger(__name__).warning(
-                        'Whilist module_name was provided, no <tuna.modules.Module> found in %s, under the name %s.\nSkipping configuration...', 
-                        f'{self.path}.{module_conf.module_import_path}', module_conf.module_name
+            print(f'Plan of subroutine `{subroutine}` ({configurations[subroutine].module_name})')
+            try:
+                plans[subroutine] = module.plan(configurations[subroutine])
+            except Exception as e:
+                create_logger(__name__).error('Cannot plan subroutine %s: %s', subroutine, e)
+                plans[subroutine] = None
+        return plans
+
+    def _schedule_order(self, configurations: dict[str, ModuleConfiguration]) -> list[str]:
+        '''Check the `depends_on` keys (known subroutines, no cycles) and return a topological order'''
+
+        for subroutine, module_conf in configurations.items():
+            for dependency in module_conf.depends_on:
+                if dependency not in configurations:
+                    create_logger(__name__).error(
+                        'Subroutine %s depends on %s, which is not in the configuration', subroutine, dependency
                     )
-                    continue
-                
-                module = getattr(module_path_imported, module_conf.module_name)()
-                if version:
-                    print(module)
-                else:
-                    module(module_conf)
+                    sys.exit(2)
 
+        order: list[str] = []
+        pending = list(configurations)
+        while pending:
+            ready = [name for name in pending if all(dependency in order for dependency in configurations[name].depends_on)]
+            if not ready:
+                create_logger(__name__).error('Circular depends_on between the subroutines %s', pending)
+                sys.exit(2)
+            order += ready
+            pending = [name for name in pending if name not in ready]
+        return order
 
 
 
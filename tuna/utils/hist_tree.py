@@ -0,0 +1,286 @@
+'''Histogram decision trees, a fast weak learner for AdaBoost (`weak_learner: hist` in `KFoldCV`)
+
+`HistDecisionTreeClassifier` takes the parameters of the scikit-learn `DecisionTreeClassifier`
+tuned by the grids (`max_depth`, `min_samples_split`, `min_samples_leaf`,
+`min_impurity_decrease`, `ccp_alpha`, `criterion`) with the same meaning, but only looks for
+splits at the boundaries of binned features: the weighted class histograms of all the nodes
+of a level are accumulated with one `np.bincount` per feature, and every bin boundary is a
+candidate threshold. There is no sort, the cost of a level is linear in the rows, which pays
+off with the shallow trees (`max_depth` 3 to 5) boosted by AdaBoost.
+
+The features are expected as bin indices (`feature_dtype: uint8`, the quantile bins are then
+computed once per dataset by the loader). Other inputs are binned at the first fit on them,
+into up to `max_bins` quantiles per feature, and the binned matrix is reused by all the
+trees boosted on the same (fold) matrix, for as long as that matrix lives.
+'''
+
+import threading
+import weakref
+from typing import Any, Callable
+
+import numpy as np
+from sklearn.base import BaseEstimator, ClassifierMixin
+
+from tuna.utils.loaders import _digitize, _quantile_bins
+
+CRITERIA = ('gini', 'entropy', 'log_loss')
+
+## The tolerance of scikit-learn on the impurity improvements
+_EPSILON = 10 * np.finfo(np.float64).eps
+
+_binned: dict[tuple, tuple[weakref.ref, Any]] = {}
+_binned_lock = threading.Lock()
+
+
+def _cached(X: np.ndarray, key: tuple, compute: Callable[[], Any]) -> Any:
+    '''`compute()` once per live matrix `X` (and `key`), the entry is dropped when `X` is freed'''
+
+    cache_key = (id(X), *key)
+    with _binned_lock:
+        entry = _binned.get(cache_key)
+        if entry is not None and entry[0]() is X:
+            return entry[1]
+
+    value = compute()
+    try:
+        reference = weakref.ref(X, lambda _, cache_key=cache_key: _binned.pop(cache_key, None))
+    except TypeError:
+        return value
+    with _binned_lock:
+        _binned[cache_key] = (reference, value)
+    return value
+
+
+def _weighted_impurity(class_weights: np.ndarray, criterion: str) -> np.ndarray:
+    '''Impurity times the node weight, from the class weights on axis 1'''
+
+    total = class_weights.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if criterion == 'gini':
+            impurity = total - np.where(total > 0, (class_weights ** 2).sum(axis=1) / total, 0.)
+        else:
+            fractions = class_weights / np.where(total > 0, total, 1.)[:, None]
+            impurity = -(class_weights * np.where(fractions > 0, np.log2(fractions), 0.)).sum(axis=1)
+    return impurity
+
+
+class HistDecisionTreeClassifier(ClassifierMixin, BaseEstimator):
+    '''Decision tree classifier splitting on binned features.
+
+    Parameters
+    ----------
+    `criterion`, `max_depth`, `min_samples_split`, `min_samples_leaf`, `min_impurity_decrease`, `ccp_alpha`
+        As in `sklearn.tree.DecisionTreeClassifier`
+    `class_weight`
+        Only `None` (AdaBoost weights the samples itself)
+    `max_bins`: `int`
+        Quantile bins per feature when the input is not already binned (at most 65536)
+    `random_state`
+        Unused, the trees are deterministic (kept for AdaBoost, which sets it)
+    '''
+
+    def __init__(self, criterion: str = 'gini', max_depth: int | None = None, min_samples_split: int | float = 2,
+                 min_samples_leaf: int | float = 1, min_impurity_decrease: float = 0., ccp_alpha: float = 0.,
+                 class_weight=None, max_bins: int = 256, random_state=None):
+        self.criterion = criterion
+        self.max_depth = max_depth
+        self.min_samples_split = min_samples_split
+        self.min_samples_leaf = min_samples_leaf
+        self.min_impurity_decrease = min_impurity_decrease
+        self.ccp_alpha = ccp_alpha
+        self.class_weight = class_weight
+        self.max_bins = max_bins
+        self.random_state = random_state
+
+    def _bins(self, X: np.ndarray, fit: bool = False) -> np.ndarray:
+        '''Bin indices of `X`: unchanged if already integer, binned otherwise (cached per matrix)'''
+
+        X = np.asarray(X)
+        if np.issubdtype(X.dtype, np.integer):
+            if fit:
+                self.bin_edges_ = None
+                ## Column-major copy, each feature is gathered once per level
+                return _cached(X, ('columns',), lambda: np.asfortranarray(X))
+            if self.bin_edges_ is not None:
+                raise ValueError('The tree was trained on raw features, got bin indices')
+            return X
+
+        if fit:
+            dtype = np.uint8 if self.max_bins <= 256 else np.uint16
+            self.bin_edges_, binned = _cached(X, ('quantiles', self.max_bins), lambda: self._quantize(X, dtype))
+            return binned
+        if self.bin_edges_ is None:
+            raise ValueError('The tree was trained on bin indices, got raw features')
+        edges = self.bin_edges_
+        return _cached(X, ('digitize', id(edges)), lambda: _digitize(X, edges, np.uint16 if self.max_bins > 256 else np.uint8))
+
+    def _quantize(self, X: np.ndarray, dtype) -> tuple[list[np.ndarray], np.ndarray]:
+        edges = _quantile_bins(X, np.arange(X.shape[0]), self.max_bins, np.random.default_rng(0))
+        return edges, np.asfortranarray(_digitize(X, edges, dtype))
+
+    def fit(self, X, y, sample_weight: np.ndarray | None = None) -> 'HistDecisionTreeClassifier':
+        if self.criterion not in CRITERIA:
+            raise ValueError(f'Unknown criterion {self.criterion}, choose one of {CRITERIA}')
+        if self.class_weight is not None:
+            raise ValueError('class_weight is not supported by the histogram trees, use sample_weight')
+
+        binned = self._bins(X, fit=True)
+        n_samples, self.n_features_in_ = binned.shape
+        n_bins = int(binned.max()) + 1 if binned.size else 1
+        self.classes_, y_index = np.unique(np.asarray(y), return_inverse=True)
+        self.n_classes_ = n_classes = self.classes_.size
+        weight = np.ones(n_samples) if sample_weight is None else np.asarray(sample_weight, dtype=np.float64)
+        total_weight = weight.sum()
+
+        min_samples_leaf = self.min_samples_leaf if isinstance(self.min_samples_leaf, (int, np.integer)) \
+            else int(np.ceil(self.min_samples_leaf * n_samples))
+        min_samples_split = self.min_samples_split if isinstance(self.min_samples_split, (int, np.integer)) \
+            else max(2, int(np.ceil(self.min_samples_split * n_samples)))
+        min_samples_split = max(min_samples_split, 2 * min_samples_leaf)
+
+        ## The tree, grown level by level. `value` holds the weighted class populations of each node
+        feature, threshold, left, right, value, count = [], [], [], [], [], []
+
+        def __node(class_weights: np.ndarray, n: int) -> int:
+            feature.append(-1), threshold.append(-1), left.append(-1), right.append(-1)
+            value.append(class_weights), count.append(n)
+            return len(value) - 1
+
+        __node(np.bincount(y_index, weights=weight, minlength=n_classes), n_samples)
+        node_of_row = np.zeros(n_samples, dtype=np.intp)
+        rows = np.arange(n_samples)
+        frontier, depth = [0], 0
+
+        while frontier and (self.max_depth is None or depth < self.max_depth):
+            node_weights = np.array([value[node] for node in frontier])
+            node_counts = np.array([count[node] for node in frontier])
+            parent = _weighted_impurity(node_weights, self.criterion)
+            splittable = (node_counts >= min_samples_split) & (parent > _EPSILON * np.maximum(node_weights.sum(axis=1), 1))
+            if not splittable.any():
+                break
+            frontier = [node for node, keep in zip(frontier, splittable) if keep]
+            node_weights, node_counts, parent = node_weights[splittable], node_counts[splittable], parent[splittable]
+            n_nodes = len(frontier)
+
+            ## The rows of the nodes split at this level, and their slot among these nodes
+            slot_of_node = np.full(len(value), -1, dtype=np.intp)
+            slot_of_node[frontier] = np.arange(n_nodes)
+            slots = slot_of_node[node_of_row[rows]]
+            rows, slots = rows[slots >= 0], slots[slots >= 0]
+            row_weight = weight[rows]
+            class_offset = (slots * n_classes + y_index[rows]) * n_bins
+            count_offset = slots * n_bins
+
+            best_gain = np.full(n_nodes, -np.inf)
+            best_feature = np.zeros(n_nodes, dtype=np.intp)
+            best_bin = np.zeros(n_nodes, dtype=np.intp)
+            best_left = np.zeros((n_nodes, n_classes))
+            best_left_count = np.zeros(n_nodes, dtype=np.int64)
+            for j in range(self.n_features_in_):
+                column = binned[:, j][rows]
+                histogram = np.bincount(class_offset + column, weights=row_weight, minlength=n_nodes * n_classes * n_bins)
+                populations = np.bincount(count_offset + column, minlength=n_nodes * n_bins)
+                ## Split after bin b: the rows with bin <= b go left
+                left_weights = np.cumsum(histogram.reshape(n_nodes, n_classes, n_bins), axis=2)[:, :, :-1]
+                left_counts = np.cumsum(populations.reshape(n_nodes, n_bins), axis=1)[:, :-1]
+                right_weights = node_weights[:, :, None] - left_weights
+                gain = (parent[:, None]
+                        - _weighted_impurity(left_weights, self.criterion)
+                        - _weighted_impurity(right_weights, self.criterion))
+                gain[(left_counts < min_samples_leaf) | (node_counts[:, None] - left_counts < min_samples_leaf)] = -np.inf
+
+                split = np.argmax(gain, axis=1)
+                split_gain = gain[np.arange(n_nodes), split]
+                better = split_gain > best_gain
+                best_gain[better], best_feature[better], best_bin[better] = split_gain[better], j, split[better]
+                best_left[better] = left_weights[better, :, split[better]]
+                best_left_count[better] = left_counts[better, split[better]]
+
+            ## Same stopping rule as scikit-learn: the weighted impurity decrease over the whole sample
+            accepted = np.isfinite(best_gain) & (best_gain / total_weight + _EPSILON >= self.min_impurity_decrease)
+            if not accepted.any():
+                break
+
+            children = np.full((n_nodes, 2), -1, dtype=np.intp)
+            for slot in np.flatnonzero(accepted):
+                node = frontier[slot]
+                feature[node], threshold[node] = int(best_feature[slot]), int(best_bin[slot])
+                left[node] = __node(best_left[slot], int(best_left_count[slot]))
+                right[node] = __node(node_weights[slot] - best_left[slot], int(node_counts[slot] - best_left_count[slot]))
+                children[slot] = left[node], right[node]
+
+            moved = accepted[slots]
+            rows, slots = rows[moved], slots[moved]
+            goes_left = binned[rows, best_feature[slots]] <= best_bin[slots]
+            node_of_row[rows] = np.where(goes_left, children[slots, 0], children[slots, 1])
+            frontier = [int(child) for pair in children[accepted] for child in pair]
+            depth += 1
+
+        self.feature_ = np.array(feature, dtype=np.intp)
+        self.threshold_ = np.array(threshold, dtype=np.intp)
+        self.children_left_ = np.array(left, dtype=np.intp)
+        self.children_right_ = np.array(right, dtype=np.intp)
+        self.value_ = np.array(value)
+        self.n_node_samples_ = np.array(count)
+        if self.ccp_alpha > 0:
+            self._prune(total_weight)
+
+        totals = self.value_.sum(axis=1, keepdims=True)
+        self.proba_ = np.where(totals > 0, self.value_ / np.where(totals > 0, totals, 1.), 1. / n_classes)
+        return self
+
+    def _prune(self, total_weight: float) -> None:
+        '''Minimal cost-complexity pruning (weakest link first) up to `ccp_alpha`, as scikit-learn'''
+
+        risk = _weighted_impurity(self.value_, self.criterion) / total_weight
+        left, right = self.children_left_, self.children_right_
+        while True:
+            subtree_risk, leaves = risk.copy(), np.ones(left.size)
+            ## Children always come after their parent
+            for node in range(left.size - 1, -1, -1):
+                if left[node] != -1:
+                    subtree_risk[node] = subtree_risk[left[node]] + subtree_risk[right[node]]
+                    leaves[node] = leaves[left[node]] + leaves[right[node]]
+            internal = self._reachable() & (left != -1)
+            if not internal.any():
+                return
+            alpha = np.where(internal, (risk - subtree_risk) / np.maximum(leaves - 1, 1), np.inf)
+            weakest = int(np.argmin(alpha))
+            if alpha[weakest] > self.ccp_alpha:
+                return
+            left[weakest] = right[weakest] = self.feature_[weakest] = self.threshold_[weakest] = -1
+
+    def _reachable(self) -> np.ndarray:
+        reachable = np.zeros(self.children_left_.size, dtype=bool)
+        reachable[0] = True
+        for node in range(self.children_left_.size):
+            if reachable[node] and self.children_left_[node] != -1:
+                reachable[self.children_left_[node]] = reachable[self.children_right_[node]] = True
+        return reachable
+
+    def apply(self, X) -> np.ndarray:
+        '''Leaf reached by every row'''
+
+        binned = self._bins(X)
+        node = np.zeros(binned.shape[0], dtype=np.intp)
+        active = np.arange(binned.shape[0])
+        while active.size:
+            current = node[active]
+            internal = self.children_left_[current] != -1
+            active, current = active[internal], current[internal]
+            goes_left = binned[active, self.feature_[current]] <= self.threshold_[current]
+            node[active] = np.where(goes_left, self.children_left_[current], self.children_right_[current])
+        return node
+
+    def predict_proba(self, X) -> np.ndarray:
+        return self.proba_[self.apply(X)]
+
+    def predict(self, X) -> np.ndarray:
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+    def get_depth(self) -> int:
+        depth = np.zeros(self.children_left_.size, dtype=np.intp)
+        for node in range(self.children_left_.size):
+            if self.children_left_[node] != -1:
+                depth[self.children_left_[node]] = depth[self.children_right_[node]] = depth[node] + 1
+        return int(depth[self._reachable()].max())
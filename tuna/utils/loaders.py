@@ -1,74 +1,649 @@
 
 import glob
+import json
+import os
 import sys
+import threading
+import warnings
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Iterator
 
 import numpy as np
+from tuna.utils import profiling
+from tuna.utils.cache import DatasetCache
 from tuna.utils.helpers import create_logger
 
 from tqdm import tqdm
 
+LOADER_ENGINES = ('numpy', 'pandas')
+EQUALIZATION_MODES = ('undersample', 'weight')
+## float32 is what the tree models work with, the unsigned types hold quantile bin indices
+FEATURE_DTYPES = ('float64', 'float32', 'uint16', 'uint8')
+
+
+def _count_rows(file_path: str, block_size: int = 1 << 20) -> int:
+    '''Count the rows of a text file by scanning the raw bytes for newlines (no parsing)'''
+
+    rows = 0
+    last = b'\n'
+    with open(file_path, 'rb') as f:
+        while block := f.read(block_size):
+            rows += block.count(b'\n')
+            last = block[-1:]
+    if last != b'\n':
+        rows += 1
+    return rows
+
+
+def _parse_csv(file_path: str, usecols: list[int], dtype=np.float64) -> np.ndarray:
+    '''Parse one comma-separated file with the pandas C engine, keeping only `usecols`'''
+
+    import pandas as pd
+
+    return pd.read_csv(
+        file_path, header=None, usecols=usecols, dtype=dtype,
+        engine='c', comment='#', skip_blank_lines=True
+    ).to_numpy()
+
+
+def _row_width(file_path: str) -> int | None:
+    '''Number of fields of the first row of a comma-separated file (`None` if it has no rows)'''
+
+    with open(file_path) as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                return len(line.split(','))
+    return None
+
+
+def _csv_width(files: list[str], max_rows: int = 8) -> int | None:
+    '''Number of columns of the comma-separated `files`, from the first one whose first
+    `max_rows` rows parse, so that a malformed or empty file sorting first does not decide
+    it (`None` if none parses)'''
+
+    for file in files:
+        try:
+            with warnings.catch_warnings():
+                ## An empty file is only warned about by `np.loadtxt`
+                warnings.simplefilter('ignore', UserWarning)
+                rows = np.loadtxt(file, delimiter=',', ndmin=2, max_rows=max_rows)
+        except (OSError, ValueError) as e:
+            create_logger(__name__).warning('Not counting the columns on %s\n%s', file, e)
+            continue
+        if rows.size:
+            return rows.shape[1]
+    return None
+
+
+def _parse_file(file_path: str, usecols: list[int], dtype=np.float64, engine: str = 'numpy') -> np.ndarray:
+    '''Parse one comma-separated file with the parser of `engine`. A file whose rows do not
+    have `usecols[-1] + 1` columns (the ones of the dataset, see `_csv_width`) is rejected
+    with a `ValueError`, as both parsers would otherwise select the wrong columns of a wider
+    one'''
+
+    width = _row_width(file_path)
+    if width is not None and width != usecols[-1] + 1:
+        raise ValueError(f'{width} columns, the dataset has {usecols[-1] + 1}')
+    if engine == 'pandas':
+        return _parse_csv(file_path, usecols, dtype)
+    return np.loadtxt(file_path, delimiter=',', usecols=usecols, ndmin=2, dtype=dtype)
+
+
+def _rank_within_class(labels: np.ndarray, rng: np.random.Generator) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    '''Random rank of every row among the rows of the same class (vectorized, no data copy)
+
+    Return
+    ------
+    `rank`, the rank of each row inside its class, `class_index`, the index of the class of
+    each row (into the sorted unique labels) and `counts`, the population of each class
+    '''
+
+    classes, class_index, counts = np.unique(labels, return_inverse=True, return_counts=True)
+    permutation = rng.permutation(labels.size)
+    order = permutation[np.argsort(class_index[permutation], kind='stable')]
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+    rank = np.empty(labels.size, dtype=np.int64)
+    rank[order] = np.arange(labels.size) - np.repeat(starts, counts)
+    return rank, class_index, counts
+
+
+def _compact_labels(labels: np.ndarray) -> np.ndarray:
+    '''Labels as the smallest signed integer type holding them (unchanged if they are not integral)'''
+
+    if labels.size == 0 or not np.all(np.floor(labels) == labels):
+        return labels
+    for dtype in (np.int8, np.int16, np.int32):
+        if np.iinfo(dtype).min <= labels.min() and labels.max() <= np.iinfo(dtype).max:
+            return labels.astype(dtype)
+    return labels.astype(np.int64)
+
+
+def _quantile_bins(features: np.ndarray, rows: np.ndarray, n_bins: int, rng: np.random.Generator,
+                   max_sample: int = 1_000_000) -> list[np.ndarray]:
+    '''Bin edges of every feature, from the quantiles of (a sample of) `rows`.
+
+    A feature with at most `n_bins` distinct values gets one bin per value (lossless),
+    otherwise the edges are its `n_bins`-quantiles, as the histogram tree methods do.
+    '''
+
+    if rows.size > max_sample:
+        rows = np.sort(rng.choice(rows, max_sample, replace=False))
+
+    edges = []
+    for j in range(features.shape[1]):
+        column = features[rows, j]
+        values = np.unique(column)
+        if values.size <= n_bins:
+            edges.append(values[1:])
+        else:
+            edges.append(np.unique(np.quantile(column, np.linspace(0, 1, n_bins + 1)[1:-1])))
+    return edges
+
+
+def _digitize(features: np.ndarray, edges: list[np.ndarray], dtype) -> np.ndarray:
+    '''Bin index of every value, one column at a time (no full size temporary)'''
+
+    output = np.empty(features.shape, dtype=dtype)
+    for j, column_edges in enumerate(edges):
+        output[:, j] = np.searchsorted(column_edges, features[:, j], side='right')
+    return output
+
+
+def _load_parallel(files: list[str], usecols: list[int], n_workers: int | None = None, dtype=np.float64) -> np.ndarray:
+    '''Parse `files` concurrently into a single preallocated array.
+
+    The row count of each file is obtained with a cheap byte scan, so that every worker
+    writes its rows straight into its own slice of the output. Files that fail to parse
+    (or that hold fewer rows than counted, e.g. blank lines) leave a gap which is
+    compacted away at the end, only if needed.
+    '''
+
+    n_workers = n_workers or os.cpu_count() or 1
+
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        counts = list(executor.map(_count_rows, files))
+
+    offsets = np.concatenate(([0], np.cumsum(counts)))
+    output = np.empty((offsets[-1], len(usecols)), dtype=dtype)
+    filled = np.zeros(len(files), dtype=np.int64)
+
+    def __fill(idx: int) -> None:
+        __array = _parse_file(files[idx], usecols, dtype, 'pandas')
+        if __array.shape[0] > counts[idx]:
+            raise ValueError(f'found {__array.shape[0]} rows, expected at most {counts[idx]}')
+        output[offsets[idx]:offsets[idx] + __array.shape[0]] = __array
+        filled[idx] = __array.shape[0]
+
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        futures = {executor.submit(__fill, idx): idx for idx in range(len(files))}
+        for future in tqdm(as_completed(futures), total=len(files)):
+            try:
+                future.result()
+            except Exception as e:
+                create_logger(__name__).error('Having some problems with a file...\n%s\n%s', files[futures[future]], e)
+
+    if np.any(filled != counts):
+        keep = np.zeros(output.shape[0], dtype=bool)
+        for idx, n_rows in enumerate(filled):
+            keep[offsets[idx]:offsets[idx] + n_rows] = True
+        output = output[keep]
+
+    return output
+
+
+def _load_sharded(files: list[str], usecols: list[int], cache: DatasetCache, key: str, engine: str = 'numpy',
+                  n_workers: int | None = None, dtype=np.float64) -> np.ndarray:
+    '''Parse only the files without a shard in `cache`, then assemble the shards into the
+    entry `key` of the whole list of files, returned memory-mapped.
+
+    The files are parsed concurrently (`n_workers` threads) with the pandas engine, one at a
+    time with numpy. A file whose content cannot be parsed (`ValueError`, which includes the
+    pandas `ParserError` and `UnicodeDecodeError`) is recorded in the cache and skipped by the
+    later calls, until its size or modification time changes. Any other error, e.g. an
+    unreadable file or a full cache disk, is raised and nothing is recorded. Once the entry
+    is written the cache is evicted down to its size, sparing the entry, shards and markers
+    of this load.
+    '''
+
+    keys = [DatasetCache.key([file], usecols, dtype=np.dtype(dtype).name) for file in files]
+    failed = {idx for idx, key in enumerate(keys) if cache.failure(key) is not None}
+    missing = [idx for idx, key in enumerate(keys) if idx not in failed and not cache.shard(key).exists()]
+
+    if failed:
+        create_logger(__name__).warning('Skipping %d files which failed to parse before, see the .failed files in %s',
+                                        len(failed), cache.shard(keys[0]).parent)
+    if missing:
+        print(f'Parsing {len(missing)} new or modified files ({len(files) - len(missing) - len(failed)} cached)')
+
+        def __parse(idx: int) -> str | None:
+            '''Parse and store the shard of a file, return the parse error if any'''
+
+            try:
+                array = _parse_file(files[idx], usecols, dtype, engine)
+            except ValueError as e:
+                return f'{type(e).__name__}: {e}'
+            cache.put_shard(keys[idx], array)
+            return None
+
+        with ThreadPoolExecutor(max_workers=(n_workers or os.cpu_count() or 1) if engine == 'pandas' else 1) as executor:
+            futures = {executor.submit(__parse, idx): idx for idx in missing}
+            for future in tqdm(as_completed(futures), total=len(missing)):
+                error = future.result()
+                if error is not None:
+                    idx = futures[future]
+                    create_logger(__name__).error('Having some problems with a file...\n%s\n%s', files[idx], error)
+                    cache.put_failure(keys[idx], f'{files[idx]}\n{error}\n')
+                    failed.add(idx)
+
+    parsed = [shard for idx, shard in enumerate(keys) if idx not in failed]
+    if not parsed:
+        create_logger(__name__).error('None of the %d files could be parsed', len(files))
+        sys.exit(2)
+    matrix = cache.assemble(key, parsed, n_workers)
+    cache.evict(keep={cache.entry(key)} | {cache.shard(shard) for shard in keys} | {cache.shard(shard).with_suffix('.failed') for shard in keys})
+    return matrix
+
+
+def iter_chunks(files: list[str], chunk_rows: int, usecols: list[int] | None = None, tree: str | None = None,
+                branches: list[str] | None = None, dtype=np.float32) -> Iterator[tuple[int, int, np.ndarray]]:
+    '''Read the files in chunks of at most `chunk_rows` rows.
+
+    Comma-separated files are parsed with the pandas C engine (columns `usecols`), ROOT files
+    with `uproot` (the `branches` of `tree`). Nothing is kept between chunks, the memory is
+    bounded by `chunk_rows`.
+
+    Yield
+    -----
+    `(file_index, first_row, matrix)`, the `dtype` matrix holding the rows of the file
+    `files[file_index]` starting at `first_row`
+    '''
+
+    for file_index, file in enumerate(files):
+        first_row = 0
+        if tree is not None:
+            import uproot
+
+            with uproot.open(file) as root_file:
+                for arrays in root_file[tree].iterate(branches, step_size=chunk_rows, library='np'):
+                    matrix = np.column_stack([arrays[branch] for branch in branches]).astype(dtype)
+                    yield file_index, first_row, matrix
+                    first_row += matrix.shape[0]
+        else:
+            import pandas as pd
+
+            with pd.read_csv(file, header=None, usecols=usecols, dtype=dtype, engine='c', comment='#',
+                             skip_blank_lines=True, chunksize=chunk_rows) as reader:
+                for frame in reader:
+                    matrix = frame.to_numpy()
+                    yield file_index, first_row, matrix
+                    first_row += matrix.shape[0]
+
+
+class DatasetRegistry:
+    '''Datasets loaded during one `Configuration.run`, shared by the subroutines reading the same data
+
+    The entries are keyed on the dataset path and on every setting shaping the loaded dataset,
+    concurrent requests for the same entry wait for a single load. `expect` declares how many
+    subroutines read a path, the entries of a path are dropped once they all `release` it.
+    '''
+
+    def __init__(self):
+        self.datasets: dict[tuple[str, str], 'DatasetLoader'] = {}
+        self.users: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._key_locks: dict[tuple[str, str], threading.Lock] = {}
+
+    def expect(self, path: str) -> None:
+        with self._lock:
+            self.users[path] = self.users.get(path, 0) + 1
+
+    def release(self, path: str) -> None:
+        with self._lock:
+            self.users[path] = self.users.get(path, 1) - 1
+            if self.users[path] <= 0:
+                for key in [key for key in self.datasets if key[0] == path]:
+                    del self.datasets[key]
+
+    def get(self, path: str, settings: dict, load) -> 'DatasetLoader':
+        '''Return the dataset for (`path`, `settings`), calling `load()` only for the first request'''
+
+        key = (path, json.dumps(settings, sort_keys=True, default=repr))
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            if key not in self.datasets:
+                self.datasets[key] = load()
+            else:
+                create_logger(__name__).info('Reusing the dataset %s already loaded by another subroutine', path)
+            return self.datasets[key]
+
+
 class DatasetLoader:
 
     def __init__(self,
                  training_features: np.ndarray,
                  training_labels: np.ndarray,
                  shuffle = True,
-                 split = 0.8, 
+                 split = 0.8,
+                 train_index: np.ndarray | None = None,
+                 test_index: np.ndarray | None = None,
+                 sample_weight: np.ndarray | None = None,
+                 bin_edges: list[np.ndarray] | None = None,
                  ):
         self.features = training_features
         self.labels = training_labels
         self.shuffle = shuffle
         self.split = split
+        ## Rows of `features`/`labels` used for training and held out (index arrays, no copies)
+        self.train_index = np.arange(self.labels.size) if train_index is None else train_index
+        self.test_index = np.empty(0, dtype=np.int64) if test_index is None else test_index
+        self.sample_weight = sample_weight
+        ## Quantile bin edges of each feature, when the features are stored as bin indices
+        self.bin_edges = bin_edges
+
+    def transform(self, features: np.ndarray) -> np.ndarray:
+        '''Convert raw features (e.g. of a dataset to score) to the representation of the loaded ones'''
+
+        if self.bin_edges is not None:
+            return _digitize(features, self.bin_edges, self.features.dtype)
+        return np.asarray(features, dtype=self.features.dtype)
+
+    def folds(self, cv) -> list[tuple[np.ndarray, np.ndarray]]:
+        '''Split the training rows with the cross-validator `cv` (e.g. `RepeatedStratifiedKFold`).
+
+        The folds are returned as indices of the full `features`/`labels` arrays, so they can be
+        passed as `cv` to the searches without copying the selected rows.
+        '''
+
+        labels = self.labels[self.train_index]
+        return [
+            (self.train_index[train], self.train_index[test])
+            for train, test in cv.split(np.zeros((labels.size, 1)), labels)
+        ]
 
     @classmethod
-    def load_csv(cls, path: str, skip_first: int = 1, equalize_populations = False, split = 1, shuffle = True) -> 'DatasetLoader':
+    def load_csv(cls, path: str, skip_first: int = 1, equalize_populations = False, split = 1, shuffle = True, random_state: int | None = None,
+                 engine: str = 'numpy', n_workers: int | None = None,
+                 cache: DatasetCache | None = None, feature_dtype: str = 'float64') -> 'DatasetLoader':
+        '''Load all the comma-separated files matching the glob `path`. The first `skip_first`
+        columns are dropped, the last column is the label.
+
+        `engine` selects the parser: `numpy` reads the files one at a time with `np.loadtxt`,
+        `pandas` parses them in parallel (`n_workers` threads, default all cores) with the
+        pandas C parser, directly into a preallocated array.
+
+        If a `cache` is given the parsed matrix is stored there, and later calls on the same
+        (unchanged) files reopen it memory-mapped instead of parsing the text again. Every file
+        is also cached on its own, so that when the glob gains (or changes) some files only
+        those are parsed and the matrix is assembled from the cached ones, see `_load_sharded`.
+
+        The text is parsed straight to `float32` unless `feature_dtype` is `float64`, see
+        `_from_matrix` for the stored representation.
+        '''
 
         length_of_csv = 0
 
-        __files = glob.glob(path)
-        
+        __files = sorted(glob.glob(path))
+
         if not __files:
             create_logger(__name__).error('Empty list? Check import...')
             sys.exit(2)
-        
-        try:
-            with open(__files[0], 'r') as __f0:
-                length_of_csv = len(__f0.readlines()[0].split(','))
-        except FileNotFoundError:
-            create_logger(__name__).error('File path not found\n%s', __files[0])
+
+        if engine not in LOADER_ENGINES:
+            create_logger(__name__).error('Unknown loader engine %s, choose one of %s', engine, LOADER_ENGINES)
             sys.exit(2)
-        except Exception as e:
-            create_logger(__name__).error(e)
+
+        if feature_dtype not in FEATURE_DTYPES:
+            create_logger(__name__).error('Unknown feature dtype %s, choose one of %s', feature_dtype, FEATURE_DTYPES)
             sys.exit(2)
-        
-        __tmp = []
-        
-        print('Loading dataset...')
-        for __f in tqdm(__files):
-            try:
-                __tmp_loadtxt = np.loadtxt(__f, delimiter=',', usecols=range(skip_first, length_of_csv))
-                __tmp.append(__tmp_loadtxt)
-            except Exception as e:
-                create_logger(__name__).error('Having some problems with a file...\n%s\n%s', __f, e) 
+        __dtype = np.float64 if feature_dtype == 'float64' else np.float32
+
+        length_of_csv = _csv_width(__files)
+        if length_of_csv is None:
+            create_logger(__name__).error('None of the %d files matching %s could be parsed', len(__files), path)
+            sys.exit(2)
+
+        __usecols = list(range(skip_first, length_of_csv))
+        __tmp = None
+        if cache is not None:
+            __key = DatasetCache.key(__files, __usecols, dtype=np.dtype(__dtype).name)
+            __tmp = cache.get(__key)
+
+        if __tmp is None:
+            print('Loading dataset...')
+            with profiling.phase('parse', engine=engine, files=len(__files)):
+                if cache is not None:
+                    ## Assembled on disk from the per-file shards, no copy of the matrix in memory
+                    __tmp = _load_sharded(__files, __usecols, cache, __key, engine, n_workers, __dtype)
+                elif engine == 'pandas':
+                    __tmp = _load_parallel(__files, __usecols, n_workers, __dtype)
+                else:
+                    __tmp = []
+                    for __f in tqdm(__files):
+                        try:
+                            __tmp_loadtxt = _parse_file(__f, __usecols, __dtype)
+                            __tmp.append(__tmp_loadtxt)
+                        except Exception as e:
+                            create_logger(__name__).error('Having some problems with a file...\n%s\n%s', __f, e)
+
+                    __tmp = np.concatenate(__tmp)
+
+        return cls._from_matrix(__tmp, equalize_populations=equalize_populations, split=split, shuffle=shuffle, random_state=random_state,
+                                feature_dtype=feature_dtype)
+
+    @classmethod
+    def load_root(cls, path: str, tree: str, branches: list[str], equalize_populations = False, split = 1, shuffle = True, random_state: int | None = None,
+                  step_size: int | str = '100 MB', cache: DatasetCache | None = None, feature_dtype: str = 'float32') -> 'DatasetLoader':
+        '''Load the `branches` of the TTree `tree` from all the ROOT files matching the glob `path`.
+        The last branch is the label, as the last column of the csv files.
+
+        The files are read with `uproot.iterate` in chunks of `step_size` (entries or a memory
+        size string such as `100 MB`), written straight into a preallocated `float32` array.
+        A file that cannot be opened or read is logged and skipped, as with `load_csv`.
+        '''
+
+        import uproot
+
+        __files = sorted(glob.glob(path))
+
+        if not __files:
+            create_logger(__name__).error('Empty list? Check import...')
+            sys.exit(2)
+
+        if feature_dtype not in FEATURE_DTYPES:
+            create_logger(__name__).error('Unknown feature dtype %s, choose one of %s', feature_dtype, FEATURE_DTYPES)
+            sys.exit(2)
+
+        if len(branches) < 2:
+            create_logger(__name__).error('At least one feature branch and the label branch are needed, got %s', branches)
+            sys.exit(2)
+
+        __tmp = None
+        if cache is not None:
+            __key = DatasetCache.key(__files, [], tree=tree, branches=list(branches))
+            __tmp = cache.get(__key)
+
+        if __tmp is None:
+            __entries = {}
+            for __f in __files:
+                try:
+                    with uproot.open(__f) as __root_file:
+                        __entries[__f] = __root_file[tree].num_entries
+                except Exception as e:
+                    create_logger(__name__).error('Having some problems with a file...\n%s\n%s', __f, e)
+
+            if not __entries:
+                create_logger(__name__).error('None of the %d files holds a readable tree %s', len(__files), tree)
+                sys.exit(2)
+
+            __tmp = np.empty((sum(__entries.values()), len(branches)), dtype=np.float32)
+            __offset = 0
+
+            print('Loading dataset...')
+            with profiling.phase('parse', engine='uproot', files=len(__entries)):
+                for __f in tqdm(__entries):
+                    __start = __offset
+                    try:
+                        for __chunk in uproot.iterate({__f: tree}, branches, step_size=step_size, library='np'):
+                            __n = len(__chunk[branches[0]])
+                            for __j, __branch in enumerate(branches):
+                                __tmp[__offset:__offset + __n, __j] = __chunk[__branch]
+                            __offset += __n
+                    except Exception as e:
+                        ## Drop the rows already read from the file
+                        create_logger(__name__).error('Having some problems with a file...\n%s\n%s', __f, e)
+                        __offset = __start
+
+            if __offset == 0:
+                create_logger(__name__).error('No entries could be read from the %d files', len(__files))
+                sys.exit(2)
+            __tmp = __tmp[:__offset]
+
+            if cache is not None:
+                cache.put(__key, __tmp)
+
+        return cls._from_matrix(__tmp, equalize_populations=equalize_populations, split=split, shuffle=shuffle, random_state=random_state,
+                                feature_dtype=feature_dtype)
+
+    @classmethod
+    def from_configuration(cls, configuration) -> 'DatasetLoader':
+        '''Load the dataset described by a module configuration (`tuna.utils.helpers.ModuleConfiguration`).
+
+        The reader is chosen by `dataset_format`: `csv`, `root` or `auto` (from the extension
+        of `training_dataset_path`). If the configuration carries a `DatasetRegistry`
+        (`configuration.datasets`, set by `Configuration.run`), a dataset already loaded with
+        the same settings by another subroutine is returned instead of being loaded again.
+        '''
+
+        dataset_string = os.path.join(configuration.get('training_dataset_path', required=True))
+        dataset_cache_path = configuration.get('dataset_cache_path')
+        cache = DatasetCache(dataset_cache_path, configuration.get('dataset_cache_max_gb')) if dataset_cache_path else None
+
+        dataset_format = configuration.get('dataset_format')
+        if dataset_format == 'auto':
+            dataset_format = 'root' if dataset_string.endswith('.root') else 'csv'
+
+        common = dict(
+            equalize_populations=configuration.get('equalize_classes'),
+            split=configuration.get('training_split'),
+            shuffle=configuration.get('shuffle_dataset'),
+            random_state=configuration.get('random_state'),
+            feature_dtype=configuration.get('feature_dtype'),
+        )
+
+        if dataset_format == 'root':
+            specific = dict(
+                tree=configuration.get('root_tree', required=True),
+                branches=configuration.get('root_branches', required=True),
+                step_size=configuration.get('root_step_size'),
+            )
+            load = cls.load_root
+        elif dataset_format == 'csv':
+            specific = dict(
+                engine=configuration.get('loader_engine'),
+                n_workers=configuration.get('loader_workers'),
+            )
+            load = cls.load_csv
+        else:
+            create_logger(__name__).error('Unknown dataset_format %s, choose one of auto, csv, root', dataset_format)
+            sys.exit(2)
+
+        def __load() -> 'DatasetLoader':
+            return load(dataset_string, cache=cache, **specific, **common)
+
+        registry: DatasetRegistry | None = getattr(configuration, 'datasets', None)
+        if registry is None:
+            return __load()
+        ## The reader engine and workers do not change the result
+        settings = {'format': dataset_format, **common, **{key: value for key, value in specific.items() if key in ('tree', 'branches')}}
+        return registry.get(dataset_string, settings, __load)
+
+    @classmethod
+    def _from_matrix(cls, matrix: np.ndarray, equalize_populations = False, split = 1, shuffle = True, random_state: int | None = None,
+                     feature_dtype: str = 'float64') -> 'DatasetLoader':
+        '''Build the loader from the full matrix (features followed by the label column).
+
+        `equalize_populations` (`True`/`undersample` or `weight`) balances the classes either by
+        randomly dropping rows of the larger classes or through per-row `sample_weight`.
+        `split` is the (stratified) fraction of rows kept for training, the rest is held out.
+        Both only produce index arrays (`train_index`, `test_index`) over the loaded matrix,
+        and so does `shuffle`: the rows are never moved, the indices follow a random order.
+
+        The features are stored as `feature_dtype`, `uint8`/`uint16` being the indices of
+        quantile bins computed on the training rows (`bin_edges`), and the labels as the
+        smallest integer type holding them.
+        '''
+
+        rng = np.random.default_rng(random_state)
+        labels = matrix[:,-1]
+
+        ## Randomize the loaded order, as a permutation of the row indices
+        order = None
+        if shuffle:
+            with profiling.phase('shuffle', rows=labels.size):
+                order = rng.permutation(labels.size)
+
+        if equalize_populations is True:
+            equalize_populations = 'undersample'
+        if equalize_populations and equalize_populations not in EQUALIZATION_MODES:
+            create_logger(__name__).error('Unknown equalization %s, choose one of %s', equalize_populations, EQUALIZATION_MODES)
+            sys.exit(2)
+
+        with profiling.phase('equalize_split', mode=equalize_populations or None):
+            ## Everything is computed on the shuffled order, then mapped back to the matrix rows
+            rank, class_index, counts = _rank_within_class(labels if order is None else labels[order], rng)
+
+            ## Undersample every class down to the smallest one
+            if equalize_populations == 'undersample':
+                counts = np.full_like(counts, counts.min())
+            selected = rank < counts[class_index]
+
+            ## Stratified hold-out: the first `split` fraction (in random rank) of each class is kept for training
+            n_train = np.floor(counts * (1 if split is None else split)).astype(np.int64)
+            in_train = rank < n_train[class_index]
+
+            train_index = np.flatnonzero(selected & in_train)
+            test_index = np.flatnonzero(selected & ~in_train)
+
+            sample_weight = None
+            if equalize_populations == 'weight':
+                train_counts = np.bincount(class_index[train_index], minlength=counts.size)
+                class_weight = train_index.size / (counts.size * np.maximum(train_counts, 1))
+                sample_weight = class_weight[class_index]
 
-        __tmp = np.concatenate(__tmp)
+            train_populations = np.bincount(class_index[train_index])
+            if order is not None:
+                train_index, test_index = order[train_index], order[test_index]
+                if sample_weight is not None:
+                    sample_weight[order] = sample_weight.copy()
 
-        ## Randomize the loaded order
-        if shuffle: 
-            order = np.random.permutation(__tmp[:,-1].size)
-            __tmp = __tmp[order]
+        if equalize_populations or test_index.size:
+            create_logger(__name__).info(
+                'Selected %d training and %d hold-out rows out of %d (class populations %s)',
+                train_index.size, test_index.size, labels.size, train_populations.tolist()
+            )
 
-        training_features = __tmp[:,0:-1]
-        training_labels = __tmp[:,-1]
-        
-        ## TODO:
-        ##  - Missing equalization
-        
-        if equalize_populations:
-            pass
+        with profiling.phase('compact', dtype=feature_dtype):
+            features = matrix[:,0:-1]
+            bin_edges = None
+            if feature_dtype in ('uint8', 'uint16'):
+                bin_edges = _quantile_bins(features, np.sort(train_index), np.iinfo(feature_dtype).max + 1, rng)
+                features = _digitize(features, bin_edges, feature_dtype)
+            elif features.dtype != feature_dtype:
+                features = features.astype(feature_dtype)
+            labels = _compact_labels(labels)
 
+        create_logger(__name__).info(
+            'Features stored as %s (%.1f MB), labels as %s', features.dtype, features.nbytes / 1024**2, labels.dtype
+        )
 
-        return cls(training_features=training_features,
-                   training_labels=training_labels,
+        return cls(training_features=features,
+                   training_labels=labels,
                    shuffle=shuffle,
-                   split=split)
+                   split=split,
+                   train_index=train_index,
+                   test_index=test_index,
+                   sample_weight=sample_weight,
+                   bin_edges=bin_edges)
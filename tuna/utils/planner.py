@@ -0,0 +1,327 @@
+'''Cost estimate of a cross-validation subroutine before running it (`tuna --plan`)
+
+The number of candidates and fits follows from the parameter grid, `kfolds` and the search
+strategy. The dataset shape is read cheaply: the number of columns from the first rows of
+the csv files (the branches for ROOT files), the number of rows from a byte scan of a few
+files extrapolated by size (the TTree metadata for ROOT files). The time of one fit comes
+from a short calibration: `plan_calibration_fits` candidates of the grid are fitted on a
+`plan_calibration_rows` subsample and the times are scaled as `n log n` to the size of a
+full training fold. The memory estimate counts the parsed matrix, its copies while loading
+and converting to `feature_dtype`, the shared copy for the workers and, for each worker,
+the process and its fold copy (`tuna.utils.resources.worker_bytes`). The training rows are
+reduced as the loader does with `equalize_classes: undersample`.
+
+All the estimates are upper bounds for pruning and early stopping, and assume the node runs
+`n_jobs` workers (fewer if their memory does not fit) at the speed of the machine where the
+plan is made.
+'''
+
+import glob
+import math
+import os
+import time
+from typing import Any
+
+import numpy as np
+
+from tuna.utils.helpers import ModuleConfiguration, create_logger
+from tuna.utils.loaders import _count_rows, _csv_width
+from tuna.utils.resources import resolve_n_jobs, worker_bytes, worker_layout
+
+
+def dataset_summary(configuration: ModuleConfiguration, max_scanned_files: int = 8) -> dict[str, Any]:
+    '''Shape of the dataset of a module configuration, without loading it
+
+    Return
+    ------
+    `dict` with `files`, `format`, `n_rows`, `n_features`, `itemsize` (bytes of one parsed
+    value) and `exact` (`False` if `n_rows` is extrapolated from a subset of the files)
+    '''
+
+    dataset_string = configuration.get('training_dataset_path', required=True)
+    files = sorted(glob.glob(dataset_string))
+    if not files:
+        raise FileNotFoundError(f'no file matches {dataset_string}')
+
+    dataset_format = configuration.get('dataset_format')
+    if dataset_format == 'auto':
+        dataset_format = 'root' if dataset_string.endswith('.root') else 'csv'
+
+    if dataset_format == 'root':
+        import uproot
+
+        tree = configuration.get('root_tree', required=True)
+        branches = configuration.get('root_branches', required=True)
+        n_rows = 0
+        for file in files:
+            with uproot.open(file) as root_file:
+                n_rows += root_file[tree].num_entries
+        return {'files': files, 'format': 'root', 'n_rows': n_rows, 'n_features': len(branches) - 1, 'itemsize': 4, 'exact': True}
+
+    n_columns = _csv_width(files)
+    if n_columns is None:
+        raise ValueError(f'none of the files matching {dataset_string} could be parsed')
+
+    ## Spread the scanned files over the list, the row count is extrapolated by size
+    scanned = files if len(files) <= max_scanned_files else [files[int(i)] for i in np.linspace(0, len(files) - 1, max_scanned_files)]
+    scanned_rows = sum(_count_rows(file) for file in scanned)
+    scanned_bytes = sum(os.path.getsize(file) for file in scanned)
+    total_bytes = sum(os.path.getsize(file) for file in files)
+    n_rows = scanned_rows if len(scanned) == len(files) else int(round(scanned_rows * total_bytes / max(1, scanned_bytes)))
+
+    ## The first column is the index, the last one the label. The text is parsed to float32 unless float64 is kept
+    itemsize = 8 if configuration.get('feature_dtype') == 'float64' else 4
+    return {'files': files, 'format': 'csv', 'n_rows': n_rows, 'n_features': n_columns - 2, 'itemsize': itemsize,
+            'exact': len(scanned) == len(files)}
+
+
+def dataset_sample(configuration: ModuleConfiguration, summary: dict[str, Any], n_rows: int,
+                   max_files: int = 8) -> tuple[np.ndarray, np.ndarray]:
+    '''Read about `n_rows` rows, taken from the start of up to `max_files` files spread over the
+    dataset (files are often split by class), and return `(features, labels)`'''
+
+    files = summary['files']
+    files = files if len(files) <= max_files else [files[int(i)] for i in np.linspace(0, len(files) - 1, max_files)]
+    per_file = max(1, math.ceil(n_rows / len(files)))
+
+    if summary['format'] == 'root':
+        import uproot
+
+        tree = configuration.get('root_tree', required=True)
+        branches = configuration.get('root_branches', required=True)
+        parts = []
+        for file in files:
+            with uproot.open(file) as root_file:
+                arrays = root_file[tree].arrays(branches, entry_stop=per_file, library='np')
+            parts.append(np.column_stack([arrays[branch] for branch in branches]).astype(np.float32))
+    else:
+        usecols = list(range(1, summary['n_features'] + 2))
+        parts = [np.loadtxt(file, delimiter=',', usecols=usecols, ndmin=2, max_rows=per_file) for file in files]
+
+    matrix = np.concatenate(parts)
+    return matrix[:, :-1], matrix[:, -1]
+
+
+def halving_cost(n_candidates: int, factor: float, n_iterations: int, min_ratio: float) -> float:
+    '''Cost of a successive halving run, in full-budget fits per fold: iteration `i` keeps
+    `ceil(n_candidates / factor**i)` candidates at `min_ratio * factor**i` of the budget'''
+
+    return sum(
+        math.ceil(n_candidates / factor**i) * min(1., min_ratio * factor**i) for i in range(max(1, n_iterations))
+    )
+
+
+def count_fits(configuration: ModuleConfiguration, parameters_grid: dict[str, list], n_train: int, n_classes: int = 2) -> dict[str, Any]:
+    '''Number of candidates and of (full-budget equivalent) fits of the configured search
+
+    Return
+    ------
+    `dict` with `strategy`, `n_candidates`, `n_folds`, `n_fits` and `note`
+    '''
+
+    n_splits, n_repeats = configuration.get('kfolds')
+    n_folds = n_splits * n_repeats
+    grid_size = math.prod(len(values) for values in parameters_grid.values())
+    strategy = configuration.get('search_strategy')
+    staged_parameter = configuration.get('staged_parameter')
+
+    if strategy == 'grid':
+        n_fits = grid_size // len(parameters_grid[staged_parameter]) if staged_parameter else grid_size
+        note = f'staged scoring on {staged_parameter}' if staged_parameter else 'exhaustive'
+        if configuration.get('pruning_percentile') is not None:
+            note += ', upper bound (pruning)'
+        return {'strategy': strategy, 'n_candidates': grid_size, 'n_folds': n_folds, 'n_fits': n_fits * n_folds, 'note': note}
+
+    if strategy == 'bayesian':
+        n_trials = configuration.get('search_n_trials')
+        note = 'upper bound (time budget)' if configuration.get('search_time_budget') else f'{n_trials} trials'
+        return {'strategy': strategy, 'n_candidates': n_trials, 'n_folds': n_folds, 'n_fits': n_trials * n_folds, 'note': note}
+
+    factor = configuration.get('search_factor')
+    resource = configuration.get('search_resource')
+    grid = dict(parameters_grid)
+    max_resources = configuration.get('search_max_resources')
+    if resource == 'n_samples':
+        ## Samples of a training fold, as the searches count them
+        n_fold_train = int(n_train * (n_splits - 1) / n_splits)
+        max_resources = min(max_resources or n_fold_train, n_fold_train)
+        smallest = 2 * n_splits * n_classes
+    else:
+        grid_values = grid.pop(resource, None)
+        max_resources = max_resources or max(grid_values)
+        smallest = 1
+    min_resources = configuration.get('search_min_resources')
+    grid_size = math.prod(len(values) for values in grid.values())
+
+    if strategy == 'hyperband':
+        smallest = min_resources or smallest
+        s_max = max(0, int(math.floor(math.log(max_resources / smallest, factor) + 1e-9)))
+        n_candidates, n_fits = 0, 0.
+        for s in range(s_max + 1):
+            bracket = int(math.ceil((s_max + 1) / (s + 1) * factor**s))
+            n_candidates += bracket
+            n_fits += halving_cost(bracket, factor, s + 1, 1 / factor**s)
+        note = f'{s_max + 1} brackets, full-budget equivalent fits'
+    else:
+        n_candidates = grid_size if strategy == 'halving_grid' else (configuration.get('search_n_candidates') or grid_size)
+        n_required = 1 + int(math.floor(math.log(max(1, n_candidates), factor)))
+        if min_resources is None:
+            min_resources = max(smallest, max_resources // factor**(n_required - 1))
+        n_possible = 1 + int(math.floor(math.log(max(1., max_resources / min_resources), factor)))
+        n_fits = halving_cost(n_candidates, factor, min(n_required, n_possible), min_resources / max_resources)
+        note = f'{min(n_required, n_possible)} halving iterations, full-budget equivalent fits'
+
+    return {'strategy': strategy, 'n_candidates': n_candidates, 'n_folds': n_folds, 'n_fits': int(math.ceil(n_fits * n_folds)), 'note': note}
+
+
+def calibrate(estimator, parameters_grid: dict[str, list], X: np.ndarray, y: np.ndarray, n_candidates: int,
+              fixed: dict[str, Any] | None = None, random_state: int | None = None) -> list[tuple[dict[str, Any], float]]:
+    '''Fit `n_candidates` random candidates of the grid on `(X, y)`, return their `(parameters, fit time)`
+
+    `fixed` overrides some parameters of every candidate, e.g. the staged parameter or the
+    halving resource at their full budget.
+    '''
+
+    from sklearn.base import clone
+    from sklearn.model_selection import ParameterGrid
+
+    grid = ParameterGrid(parameters_grid)
+    rng = np.random.default_rng(random_state)
+    timings = []
+    for idx in rng.choice(len(grid), size=min(n_candidates, len(grid)), replace=False):
+        parameters = {**grid[int(idx)], **(fixed or {})}
+        model = clone(estimator).set_params(**parameters)
+        ## Keep the calibration quiet (XGBoost)
+        if 'verbosity' in model.get_params():
+            model.set_params(verbosity=0)
+        start = time.perf_counter()
+        try:
+            model.fit(X, y)
+        except Exception as e:
+            create_logger(__name__).warning('Calibration fit failed for %s\n%s', parameters, e)
+            continue
+        timings.append((parameters, time.perf_counter() - start))
+    return timings
+
+
+def _size(n_bytes: float) -> str:
+    for unit in ('B', 'kB', 'MB', 'GB'):
+        if n_bytes < 1024:
+            return f'{n_bytes:.1f} {unit}'
+        n_bytes /= 1024
+    return f'{n_bytes:.1f} TB'
+
+
+def _duration(seconds: float) -> str:
+    if not math.isfinite(seconds):
+        return 'unknown'
+    if seconds < 60:
+        return f'{seconds:.1f} s'
+    if seconds < 3600:
+        return f'{seconds / 60:.1f} min'
+    return f'{seconds / 3600:.1f} h'
+
+
+def plan_cross_validation(configuration: ModuleConfiguration, estimator, parameters_grid: dict[str, list],
+                          engine: str = 'joblib', threaded: bool = True) -> dict[str, Any]:
+    '''Estimate the candidates, fits, wall time and peak memory of a cross-validation module.
+
+    `engine` is `joblib` (one process per worker, each copying its training fold), `threads`
+    (the XGBoost native engine, sharing one quantized copy of the dataset) or `streaming`
+    (the dataset is never loaded, see `tuna.utils.streaming`). The joblib workers are laid
+    out as the search does (`tuna.utils.resources.worker_layout`, `threaded` as there), so
+    fewer of them run when their memory does not fit.
+
+    Return
+    ------
+    `dict` with all the figures, also printed as a short report
+    '''
+
+    summary = dataset_summary(configuration)
+    n_rows, n_features, itemsize = summary['n_rows'], summary['n_features'], summary['itemsize']
+    n_splits, _ = configuration.get('kfolds')
+
+    ## Calibration on a subsample, scaled as n log n to a full training fold
+    calibration_rows = min(configuration.get('plan_calibration_rows'), n_rows)
+    X, y = dataset_sample(configuration, summary, calibration_rows)
+
+    n_train = int(n_rows * configuration.get('training_split'))
+    if configuration.get('equalize_classes') in (True, 'undersample'):
+        ## As the loader, every class is undersampled to the smallest one (fractions from the sample)
+        _, counts = np.unique(y, return_counts=True)
+        n_train = int(n_train * counts.size * counts.min() / counts.sum())
+    n_fold_train = int(n_train * (n_splits - 1) / n_splits)
+
+    fits = count_fits(configuration, parameters_grid, n_train)
+
+    feature_itemsize = np.dtype(configuration.get('feature_dtype')).itemsize
+    shared_dataset = configuration.get('shared_dataset')
+    cpus = resolve_n_jobs(configuration.get('n_jobs'), configuration.cpu_budget)
+    if engine == 'joblib':
+        per_worker = worker_bytes(n_train, n_features, feature_itemsize, n_splits, shared_dataset)
+        n_workers, _ = worker_layout(cpus, per_worker, configuration.get('memory_limit_gb'), fits['n_fits'], threaded)
+    else:
+        n_workers = max(1, min(cpus, fits['n_fits']))
+
+    n_calibration = int(y.size * (n_splits - 1) / n_splits)
+    ## A random training fold of the sample (the rows are ordered by file)
+    rows = np.random.default_rng(configuration.get('random_state')).permutation(y.size)[:n_calibration]
+    X, y = X[rows], y[rows]
+    timings = []
+    if np.unique(y).size < 2:
+        create_logger(__name__).warning('The calibration sample holds a single class, no time estimate')
+    else:
+        fixed = {}
+        staged_parameter = configuration.get('staged_parameter')
+        resource = configuration.get('search_resource')
+        if fits['strategy'] == 'grid' and staged_parameter:
+            fixed[staged_parameter] = max(parameters_grid[staged_parameter])
+        if fits['strategy'] not in ('grid', 'bayesian') and resource != 'n_samples':
+            fixed[resource] = configuration.get('search_max_resources') or max(parameters_grid[resource])
+        timings = calibrate(
+            estimator, parameters_grid, X, y, configuration.get('plan_calibration_fits'),
+            fixed, configuration.get('random_state')
+        )
+
+    scale = n_fold_train * math.log(max(2, n_fold_train)) / (max(1, n_calibration) * math.log(max(2, n_calibration)))
+    fit_seconds = float(np.mean([seconds for _, seconds in timings])) * scale if timings else float('nan')
+    cpu_seconds = fit_seconds * fits['n_fits']
+    ## The fits run in waves of `n_workers`
+    wall_seconds = fit_seconds * math.ceil(fits['n_fits'] / n_workers)
+
+    ## Parsed matrix, then the stored features (a view of it unless converted) and the integer labels
+    matrix_bytes = n_rows * (n_features + 1) * itemsize
+    stored_bytes = n_rows * (n_features * feature_itemsize + 1)
+    train_bytes = n_train * (n_features * feature_itemsize + 1)
+    if engine == 'streaming':
+        ## A float32 chunk per fold matrix being built, and the labels and weights of the fold matrices in use
+        n_open = 2 * min(n_workers, fits['n_folds'])
+        search_bytes = n_open * (configuration.get('stream_chunk_rows') * (n_features + 1) * 4 + n_train * 8)
+        matrix_bytes = stored_bytes = 0
+    elif engine == 'threads':
+        ## One quantized copy (1 byte per value) plus the per-fold matrices
+        search_bytes = n_train * n_features * (1 + 2 * min(n_workers, fits['n_folds']))
+    else:
+        ## One shared copy of the training rows, or one per worker (counted by `worker_bytes`)
+        search_bytes = train_bytes * bool(shared_dataset) + n_workers * per_worker
+    ## A conversion to another dtype holds both copies for a while
+    converted = feature_itemsize != itemsize
+    loaded_bytes = stored_bytes if converted else matrix_bytes
+    peak_bytes = max(2 * matrix_bytes, matrix_bytes + stored_bytes * converted, loaded_bytes + search_bytes)
+
+    plan = {
+        **{key: value for key, value in summary.items() if key != 'files'}, 'n_files': len(summary['files']),
+        **fits, 'n_workers': n_workers, 'calibration_rows': y.size, 'calibration': timings,
+        'fit_seconds': fit_seconds, 'cpu_seconds': cpu_seconds, 'wall_seconds': wall_seconds, 'peak_memory_bytes': peak_bytes,
+    }
+
+    storage = 'streamed' if engine == 'streaming' else f'{_size(loaded_bytes)} loaded as {configuration.get("feature_dtype")}'
+    print(f'  dataset      {len(summary["files"])} files, {"" if summary["exact"] else "~"}{n_rows} rows x {n_features} features'
+          f' ({storage}), {n_train} training rows')
+    print(f'  search       {fits["strategy"]}: {fits["n_candidates"]} candidates x {fits["n_folds"]} folds = {fits["n_fits"]} fits ({fits["note"]})')
+    print(f'  calibration  {len(timings)} fits on {n_calibration} rows, {fit_seconds:.3g} s per fit on {n_fold_train} rows')
+    for parameters, seconds in timings:
+        create_logger(__name__).info('Calibration %.3f s for %s', seconds, parameters)
+    print(f'  time         ~{_duration(wall_seconds)} wall with {n_workers} workers ({_duration(cpu_seconds)} CPU)')
+    print(f'  memory       ~{_size(peak_bytes)} peak')
+    return plan
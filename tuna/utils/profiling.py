@@ -0,0 +1,142 @@
+'''Run instrumentation: wall time, CPU time and peak memory of every phase of a subroutine
+
+Each subroutine runs with its own `Profiler`, made current for the thread running it, so
+that any code (the loaders, the modules) can time a phase with
+
+    with profiling.phase('dataset_load'):
+        ...
+
+which does nothing when no profiler is active. Phases nest, every record holds its parent.
+The CPU time is the one of the whole tuna process (all its threads); the work done in the
+joblib worker processes is reported by the per-candidate fit and score times instead. The
+peak RSS is the high-water mark of the process at the end of the phase.
+
+The report is written as JSON next to the results (`{output_name}_profile.json`).
+'''
+
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+
+from tuna.utils.helpers import create_logger
+
+_local = threading.local()
+
+
+def peak_rss_mb() -> float | None:
+    '''High-water mark of the resident memory of the process, in MB (`None` if unavailable)'''
+
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    ## kB on Linux, bytes on macOS
+    return peak / 1024**2 if sys.platform == 'darwin' else peak / 1024
+
+
+class Profiler:
+    '''Phase timer of one subroutine
+
+    Parameters
+    ----------
+    `name`: `str`
+        Name of the profiled subroutine
+    '''
+
+    def __init__(self, name: str):
+        self.name = name
+        self.phases: list[dict[str, Any]] = []
+        self.candidates: list[dict[str, Any]] = []
+        self._stack: list[str] = []
+        self._start = time.perf_counter()
+        self._start_cpu = time.process_time()
+
+    def add(self, name: str, wall_seconds: float, cpu_seconds: float, **info) -> None:
+        '''Record a phase measured elsewhere (e.g. the configuration load, before the subroutines exist)'''
+
+        self.phases.append({
+            'phase': name, 'parent': self._stack[-1] if self._stack else None,
+            'wall_seconds': wall_seconds, 'cpu_seconds': cpu_seconds, 'peak_rss_mb': peak_rss_mb(), **info
+        })
+
+    @contextmanager
+    def phase(self, name: str, **info):
+        '''Time the enclosed block as the phase `name`, `info` is stored with the record'''
+
+        parent = self._stack[-1] if self._stack else None
+        record = {'phase': name, 'parent': parent, 'start_seconds': time.perf_counter() - self._start}
+        self.phases.append(record)
+        self._stack.append(name)
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield record
+        finally:
+            self._stack.pop()
+            record.update(
+                wall_seconds=time.perf_counter() - wall, cpu_seconds=time.process_time() - cpu, peak_rss_mb=peak_rss_mb(), **info
+            )
+
+    @contextmanager
+    def activate(self):
+        '''Make this profiler the current one of the calling thread (the clocks start here, a
+        queued subroutine does not count its waiting time)'''
+
+        self._start, self._start_cpu = time.perf_counter(), time.process_time()
+        previous = getattr(_local, 'profiler', None)
+        _local.profiler = self
+        try:
+            yield self
+        finally:
+            _local.profiler = previous
+
+    def add_candidates(self, cv_results: dict[str, Any]) -> None:
+        '''Store the fit and score times of every candidate of a search (`cv_results_`)'''
+
+        n_folds = sum(key.startswith('split') and key.endswith('_test_score') for key in cv_results)
+        fit_times = np.asarray(cv_results['mean_fit_time'], dtype=float)
+        score_times = np.asarray(cv_results['mean_score_time'], dtype=float)
+        for params, fit_time, score_time in zip(cv_results['params'], fit_times, score_times):
+            self.candidates.append({
+                'params': dict(params), 'n_folds': n_folds,
+                'mean_fit_seconds': float(fit_time), 'mean_score_seconds': float(score_time),
+            })
+
+    def report(self) -> dict[str, Any]:
+        return {
+            'subroutine': self.name,
+            'pid': os.getpid(),
+            'wall_seconds': time.perf_counter() - self._start,
+            'cpu_seconds': time.process_time() - self._start_cpu,
+            'peak_rss_mb': peak_rss_mb(),
+            'phases': self.phases,
+            'candidates': self.candidates,
+        }
+
+    def write(self, path: str | Path) -> Path:
+        '''Write the JSON report to `path`'''
+
+        path = Path(path)
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=1, default=repr)
+        create_logger(__name__).info('Profile report written to %s', path)
+        return path
+
+
+def current() -> Profiler | None:
+    '''The profiler active in the calling thread, if any'''
+    return getattr(_local, 'profiler', None)
+
+
+def phase(name: str, **info):
+    '''Time a phase on the current profiler (no-op context manager without one)'''
+
+    profiler = current()
+    return profiler.phase(name, **info) if profiler is not None else nullcontext()
@@ -0,0 +1,198 @@
+'''Cores, memory and thread layout of the searches (`n_jobs: "auto"`, `memory_limit_gb`)
+
+The cores available to the process are the ones of its CPU affinity, reduced to the CPU
+quota of its cgroup (v2 `cpu.max` or v1 `cpu.cfs_quota_us`, as set by batch systems and
+containers). The memory available is the `MemAvailable` of the node, reduced to what is left
+under the memory limit of the cgroup and to `memory_limit_gb` if set.
+
+`search_layout` turns these into the number of worker processes and of threads inside each
+worker: as many single threaded workers as the cores allow, fewer if their estimated memory
+(each holds a copy of its training fold, see `worker_bytes`) does not fit, the cores left
+going to the threads of each worker (unless the estimator is single threaded, as the
+scikit-learn trees). The threads of a worker never exceed the cores of a
+NUMA node, so that one model does not spread its threads (and memory traffic) across nodes.
+The joblib workers get the thread limit through `thread_limits`, i.e. `OMP_NUM_THREADS` and
+the other BLAS variables in their environment.
+'''
+
+import math
+import os
+import sys
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Iterator
+
+from tuna.utils.helpers import create_logger
+
+## Interpreter and scientific stack of a loky worker process
+WORKER_OVERHEAD_BYTES = 200 * 1024**2
+## Part of the available memory the workers may take
+MEMORY_FRACTION = 0.9
+
+
+def _read(path: Path) -> str | None:
+    try:
+        return path.read_text().strip()
+    except (OSError, ValueError):
+        return None
+
+
+def _cgroup_directories(controller: str) -> list[Path]:
+    '''cgroup directories of the process (v2 unified hierarchy and v1 `controller`), innermost first'''
+
+    directories = []
+    for line in (_read(Path('/proc/self/cgroup')) or '').splitlines():
+        _, controllers, relative = line.split(':', 2)
+        if controllers == '':
+            root = Path('/sys/fs/cgroup')
+        elif controller in controllers.split(','):
+            root = Path('/sys/fs/cgroup', controllers)
+            if not root.exists():
+                root = Path('/sys/fs/cgroup', controller)
+        else:
+            continue
+        ## Inside a container the own cgroup is usually mounted as the root
+        for candidate in (root / relative.lstrip('/'), root):
+            if candidate.exists() and candidate not in directories:
+                directories.append(candidate)
+    return directories
+
+
+def cgroup_cpu_limit() -> float | None:
+    '''CPU quota of the cgroup of the process, in cores (`None` without a quota)'''
+
+    limits = []
+    for directory in _cgroup_directories('cpu'):
+        quota = _read(directory / 'cpu.max')
+        if quota is not None:
+            value, _, period = quota.partition(' ')
+            if value != 'max' and period:
+                limits.append(int(value) / int(period))
+            continue
+        quota, period = _read(directory / 'cpu.cfs_quota_us'), _read(directory / 'cpu.cfs_period_us')
+        if quota is not None and period is not None and int(quota) > 0:
+            limits.append(int(quota) / int(period))
+    return min(limits) if limits else None
+
+
+def available_cpus() -> int:
+    '''Cores the process may use: its CPU affinity, capped at the cgroup quota'''
+
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else (os.cpu_count() or 1)
+    quota = cgroup_cpu_limit()
+    if quota is not None:
+        cpus = min(cpus, max(1, math.ceil(quota)))
+    return cpus
+
+
+def available_memory() -> int | None:
+    '''Bytes the process may still allocate: `MemAvailable` capped at what is left under the cgroup limit'''
+
+    available = []
+    for line in (_read(Path('/proc/meminfo')) or '').splitlines():
+        if line.startswith('MemAvailable:'):
+            available.append(int(line.split()[1]) * 1024)
+
+    for directory in _cgroup_directories('memory'):
+        limit, usage = _read(directory / 'memory.max'), _read(directory / 'memory.current')
+        if limit is None:
+            limit, usage = _read(directory / 'memory.limit_in_bytes'), _read(directory / 'memory.usage_in_bytes')
+        ## v1 reports "no limit" as a huge number
+        if limit is not None and usage is not None and limit != 'max' and int(limit) < 1 << 60:
+            available.append(max(0, int(limit) - int(usage)))
+    return min(available) if available else None
+
+
+def numa_node_cpus() -> list[int]:
+    '''Number of cores of each NUMA node usable by the process (one node if unknown)'''
+
+    affinity = os.sched_getaffinity(0) if hasattr(os, 'sched_getaffinity') else set(range(os.cpu_count() or 1))
+    nodes = []
+    for node in sorted(Path('/sys/devices/system/node').glob('node[0-9]*')):
+        cpus = set()
+        for interval in (_read(node / 'cpulist') or '').split(','):
+            if interval:
+                low, _, high = interval.partition('-')
+                cpus.update(range(int(low), int(high or low) + 1))
+        if cpus & affinity:
+            nodes.append(len(cpus & affinity))
+    return nodes or [len(affinity)]
+
+
+def resolve_n_jobs(n_jobs: Any, budget: int | None = None) -> int:
+    '''Cores granted by `n_jobs`: all the available ones for `auto`, `None` or a negative
+    value, otherwise `n_jobs` capped at the available ones. With `budget` (the cores the
+    scheduler granted to the subroutine, `ModuleConfiguration.cpu_budget`) the available
+    cores are capped at it'''
+
+    available = available_cpus() if budget is None else max(1, min(budget, available_cpus()))
+    if n_jobs is None or n_jobs == 'auto' or (isinstance(n_jobs, int) and n_jobs < 0):
+        return available
+    if not isinstance(n_jobs, int) or isinstance(n_jobs, bool):
+        create_logger(__name__).error('n_jobs must be an integer, null or "auto", got %r', n_jobs)
+        sys.exit(2)
+    return max(1, min(n_jobs, available))
+
+
+def worker_bytes(n_train: int, n_features: int, itemsize: int, n_splits: int, shared_dataset: bool = True) -> int:
+    '''Estimated memory of one search worker: its training fold (converted to `float32` by the
+    trees unless stored so), the whole training set unless shared, and the process itself'''
+
+    n_fold_train = int(n_train * (n_splits - 1) / n_splits)
+    fold = n_fold_train * n_features * (itemsize + (0 if itemsize == 4 else 4))
+    dataset = 0 if shared_dataset else n_train * (n_features * itemsize + 1)
+    return WORKER_OVERHEAD_BYTES + fold + dataset
+
+
+def worker_layout(cpus: int, per_worker_bytes: int, memory_limit_gb: float | None = None, n_tasks: int | None = None,
+                  threaded: bool = True) -> tuple[int, int]:
+    '''Split `cpus` cores between worker processes and threads per worker, so that the workers
+    fit in the available memory (and `memory_limit_gb`). A single threaded estimator
+    (`threaded=False`) gets one thread per worker, as more would only oversubscribe the cores
+
+    Return
+    ------
+    `(n_workers, n_threads)`
+    '''
+
+    n_workers = cpus if n_tasks is None else max(1, min(cpus, n_tasks))
+    memory = available_memory()
+    if memory_limit_gb is not None:
+        memory = min(memory or math.inf, memory_limit_gb * 1024**3)
+    if memory is not None and per_worker_bytes > 0:
+        fitting = max(1, int(memory * MEMORY_FRACTION // per_worker_bytes))
+        if fitting < n_workers:
+            create_logger(__name__).warning(
+                'Only %d of %d workers fit in %.1f GB (~%.2f GB each), %s',
+                fitting, n_workers, memory / 1024**3, per_worker_bytes / 1024**3,
+                'the other cores go to their threads' if threaded else 'the other cores stay idle'
+            )
+            n_workers = fitting
+    if not threaded:
+        return n_workers, 1
+    n_threads = max(1, min(cpus // n_workers, max(numa_node_cpus())))
+    return n_workers, n_threads
+
+
+def search_layout(configuration, n_train: int, n_features: int, itemsize: int, n_tasks: int | None = None,
+                  threaded: bool = True) -> tuple[int, int]:
+    '''`worker_layout` of a cross validation module (`n_jobs`, `kfolds`, `shared_dataset` and
+    `memory_limit_gb` keys, within its `cpu_budget`) on a training set of `n_train` rows'''
+
+    cpus = resolve_n_jobs(configuration.get('n_jobs'), configuration.cpu_budget)
+    n_splits, _ = configuration.get('kfolds')
+    per_worker = worker_bytes(n_train, n_features, itemsize, n_splits, configuration.get('shared_dataset'))
+    n_workers, n_threads = worker_layout(cpus, per_worker, configuration.get('memory_limit_gb'), n_tasks, threaded)
+    print(f'Resources: {cpus} cores -> {n_workers} workers x {n_threads} threads (~{per_worker / 1024**3:.2f} GB per worker)')
+    return n_workers, n_threads
+
+
+@contextmanager
+def thread_limits(n_threads: int | None) -> Iterator[None]:
+    '''Limit the threads (`OMP_NUM_THREADS`, `OPENBLAS_NUM_THREADS`, `MKL_NUM_THREADS`, ...) of
+    the joblib worker processes started inside the context (joblib default if `None`)'''
+
+    from joblib import parallel_config
+
+    with parallel_config(backend='loky', inner_max_num_threads=n_threads):
+        yield
@@ -0,0 +1,477 @@
+'''Writer and reader of the results of the cross validation modules (`results_format` key)
+
+ - `csv`: the `cv_results_` as a pandas csv (default), with the `params` column of dictionaries
+ - `parquet`: one zstd compressed Parquet file, written one row group of `results_batch_rows`
+   candidates at a time (needs `pyarrow`)
+ - `npz`: a `{output_name}_results` directory of compressed NumPy parts of `results_batch_rows`
+   candidates, plus a `schema.json`
+
+In the columnar formats there is no `params` column: every parameter is a typed column
+`param_{name}` (`bool`, `int`, `float`, or the JSON text of the value for anything else, e.g.
+`null` or a string), missing where the candidate does not have the parameter. The rows are
+converted a batch at a time, the full results are never held as one object table.
+
+`write_results` writes the `cv_results_` of a finished search. The searches dispatching one
+task per (candidate, fold) (`tuna.utils.search.FoldSearchCV`) instead write the columnar
+formats while they run, through a `ResultsWriter`: the rows of the completed candidates are
+staged on disk a batch at a time, and the file is assembled from the staged batches once
+the ranks are known, at the end. The rows of these files are in the order the candidates
+completed.
+
+`open_results` reads any of the three formats back, a batch and only the requested columns at
+a time, so that `top_k`, `marginals` and `best_parameters` work on files larger than memory.
+'''
+
+import ast
+import importlib.util
+import json
+import os
+import re
+import shutil
+import sys
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Any, Iterator
+
+import numpy as np
+
+from tuna.utils.helpers import create_logger
+
+RESULTS_FORMATS = ('csv', 'parquet', 'npz')
+
+
+def results_path(output_path: str | Path, output_name: str, results_format: str) -> Path:
+    '''File (or directory, for `npz`) the results of `output_name` are written to'''
+
+    if results_format == 'npz':
+        return Path(output_path, f'{output_name}_results')
+    return Path(output_path, f'{output_name}.{results_format}')
+
+
+def results_format_available(results_format: str) -> bool:
+    '''Check, before the search runs, that `results_format` can be written (`parquet` needs
+    `pyarrow`), without importing anything'''
+
+    if results_format == 'parquet' and importlib.util.find_spec('pyarrow') is None:
+        create_logger(__name__).error('The parquet results format needs pyarrow (pip install pyarrow), or use results_format npz')
+        return False
+    return True
+
+
+def _parameter_kind(values: list[Any]) -> str:
+    '''Narrowest column type holding all the (present) values of a parameter'''
+
+    if all(isinstance(value, (bool, np.bool_)) for value in values):
+        return 'bool'
+    if all(isinstance(value, (int, np.integer)) and not isinstance(value, (bool, np.bool_)) for value in values):
+        return 'int'
+    if all(isinstance(value, (int, float, np.integer, np.floating)) and not isinstance(value, (bool, np.bool_)) for value in values):
+        return 'float'
+    return 'json'
+
+
+def _json(value: Any) -> str:
+    return json.dumps(value.item() if isinstance(value, np.generic) else value, default=repr)
+
+
+def _parameter_kinds(candidates: list[dict[str, Any]]) -> dict[str, str]:
+    '''Column type of every parameter of the `candidates`'''
+
+    names = sorted({name for candidate in candidates for name in candidate})
+    return {
+        name: _parameter_kind([candidate[name] for candidate in candidates if name in candidate])
+        for name in names
+    }
+
+
+def _schema(cv_results: dict[str, Any], parameters: dict[str, str] | None = None) -> dict[str, Any]:
+    '''Column names and parameter types (from its candidates unless given) of a `cv_results_` dictionary'''
+
+    candidates = cv_results['params']
+    ## Every other column keeps the `cv_results_` order
+    metrics = [key for key in cv_results if key != 'params' and not key.startswith('param_')]
+    return {'rows': len(candidates), 'parameters': parameters or _parameter_kinds(candidates), 'metrics': metrics}
+
+
+def _batches(cv_results: dict[str, Any], schema: dict[str, Any], batch_rows: int) -> Iterator[dict[str, tuple[np.ndarray, np.ndarray | None]]]:
+    '''Typed columns of `batch_rows` candidates at a time, as `{column: (values, present or None)}`'''
+
+    candidates = cv_results['params']
+    fill = {'bool': False, 'int': 0, 'float': np.nan, 'json': ''}
+    dtypes = {'bool': bool, 'int': np.int64, 'float': np.float64, 'json': str}
+
+    for start in range(0, max(len(candidates), 1), batch_rows):
+        stop = min(start + batch_rows, len(candidates))
+        batch: dict[str, tuple[np.ndarray, np.ndarray | None]] = {}
+        for name, kind in schema['parameters'].items():
+            present = np.array([name in candidate for candidate in candidates[start:stop]], dtype=bool)
+            values = [candidate.get(name, fill[kind]) for candidate in candidates[start:stop]]
+            if kind == 'json':
+                values = [_json(value) if ok else '' for value, ok in zip(values, present)]
+            batch[f'param_{name}'] = (np.array(values, dtype=dtypes[kind]), None if present.all() else present)
+        for key in schema['metrics']:
+            values = np.asarray(cv_results[key])[start:stop]
+            if values.dtype == object:
+                values = np.array([_json(value) for value in values], dtype=str)
+            batch[key] = (values, None)
+        yield batch
+
+
+def write_results(cv_results: dict[str, Any], output_path: str | Path, output_name: str, results_format: str = 'csv',
+                  batch_rows: int = 10000) -> Path:
+    '''Write the `cv_results_` of a search in `results_format`, see `RESULTS_FORMATS`.
+
+    Return
+    ------
+    The path of the results, see `results_path`
+    '''
+
+    if results_format not in RESULTS_FORMATS:
+        create_logger(__name__).error('Unknown results format %s, choose one of %s', results_format, RESULTS_FORMATS)
+        sys.exit(2)
+
+    path = results_path(output_path, output_name, results_format)
+    if results_format == 'csv':
+        import pandas as pd
+
+        pd.DataFrame(cv_results).to_csv(path)
+        return path
+
+    schema = _schema(cv_results)
+    batches = _batches(cv_results, schema, max(1, int(batch_rows)))
+    if results_format == 'parquet':
+        _write_parquet(path, batches, schema)
+    else:
+        _write_npz(path, batches, schema)
+    return path
+
+
+class ResultsWriter:
+    '''Incremental writer of the columnar formats (`parquet` or `npz`) of `write_results`
+
+    `start` fixes the parameter types from all the candidates of the search, `write` stages
+    the rows of a batch of completed candidates (a `cv_results_` dictionary of those only, and
+    their indices among all the candidates) in a hidden directory next to the results, and
+    `close` assembles the results file from the staged batches, one at a time, with the final
+    `rank_test_score` of every candidate. `discard` drops the staged batches of a failed search.
+    '''
+
+    def __init__(self, output_path: str | Path, output_name: str, results_format: str, batch_rows: int = 10000):
+        if results_format not in ('parquet', 'npz'):
+            raise ValueError(f'Only the columnar formats are written incrementally, not {results_format}')
+        self.path = results_path(output_path, output_name, results_format)
+        self.results_format = results_format
+        self.batch_rows = max(1, int(batch_rows))
+        self.schema: dict[str, Any] | None = None
+        self._staging = self.path.with_name(f'.{self.path.name}.{os.getpid()}.staging')
+        self._parts = 0
+
+    def start(self, candidates: list[dict[str, Any]]) -> None:
+        '''Begin the results of a search over `candidates`'''
+
+        shutil.rmtree(self._staging, ignore_errors=True)
+        self._staging.mkdir(parents=True)
+        self.schema = {'rows': 0, 'parameters': _parameter_kinds(candidates), 'metrics': None}
+        self._parts = 0
+
+    def write(self, cv_results: dict[str, Any], indices: np.ndarray) -> None:
+        '''Stage the rows of the candidates `indices`, whose results are `cv_results`'''
+
+        schema = _schema(cv_results, self.schema['parameters'])
+        self.schema['metrics'] = self.schema['metrics'] or schema['metrics']
+        self.schema['rows'] += schema['rows']
+        indices = np.asarray(indices)
+        for start, batch in zip(range(0, max(indices.size, 1), self.batch_rows), _batches(cv_results, self.schema, self.batch_rows)):
+            arrays = {column: values for column, (values, _) in batch.items()}
+            arrays.update({f'{column}__present': present for column, (_, present) in batch.items() if present is not None})
+            np.savez(self._staging / f'part-{self._parts:05d}.npz', __index=indices[start:start + self.batch_rows], **arrays)
+            self._parts += 1
+
+    def _staged(self, rank_test_score: np.ndarray) -> Iterator[dict[str, tuple[np.ndarray, np.ndarray | None]]]:
+        columns = [*(f'param_{name}' for name in self.schema['parameters']), *self.schema['metrics']]
+        for part in range(self._parts):
+            with np.load(self._staging / f'part-{part:05d}.npz') as arrays:
+                batch = {
+                    column: (arrays[column], arrays[f'{column}__present'] if f'{column}__present' in arrays.files else None)
+                    for column in columns
+                }
+                if 'rank_test_score' in batch:
+                    batch['rank_test_score'] = (np.asarray(rank_test_score)[arrays['__index']], None)
+            yield batch
+
+    def close(self, rank_test_score: np.ndarray) -> Path:
+        '''Write the results file from the staged batches, `rank_test_score` of all the candidates'''
+
+        try:
+            if self.results_format == 'parquet':
+                _write_parquet(self.path, self._staged(rank_test_score), self.schema)
+            else:
+                _write_npz(self.path, self._staged(rank_test_score), self.schema)
+        finally:
+            self.discard()
+        return self.path
+
+    def discard(self) -> None:
+        shutil.rmtree(self._staging, ignore_errors=True)
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        create_logger(__name__).error('The parquet results format needs pyarrow (pip install pyarrow), or use results_format npz')
+        sys.exit(2)
+    return pyarrow, pyarrow.parquet
+
+
+def _write_parquet(path: Path, batches: Iterator[dict], schema: dict[str, Any]) -> None:
+    pa, pq = _require_pyarrow()
+
+    temporary = path.with_name(f'.{path.name}.{os.getpid()}')
+    writer = None
+    try:
+        for batch in batches:
+            table = pa.table({
+                column: pa.array(values, mask=None if present is None else ~present)
+                for column, (values, present) in batch.items()
+            })
+            if writer is None:
+                writer = pq.ParquetWriter(temporary, table.schema.with_metadata({'tuna': json.dumps(schema)}), compression='zstd')
+            writer.write_table(table.replace_schema_metadata(writer.schema.metadata))
+    finally:
+        if writer is not None:
+            writer.close()
+    os.replace(temporary, path)
+
+
+def _write_npz(path: Path, batches: Iterator[dict], schema: dict[str, Any]) -> None:
+    temporary = path.with_name(f'.{path.name}.{os.getpid()}')
+    shutil.rmtree(temporary, ignore_errors=True)
+    temporary.mkdir(parents=True)
+
+    parts = 0
+    for batch in batches:
+        arrays = {column: values for column, (values, _) in batch.items()}
+        arrays.update({f'{column}__present': present for column, (_, present) in batch.items() if present is not None})
+        np.savez_compressed(temporary / f'part-{parts:05d}.npz', **arrays)
+        parts += 1
+    with open(temporary / 'schema.json', 'w') as f:
+        json.dump({**schema, 'parts': parts}, f, indent=1)
+
+    ## Readers never see a partially written directory
+    if path.exists():
+        shutil.rmtree(path)
+    os.replace(temporary, path)
+
+
+def open_results(path: str | Path) -> 'Results':
+    '''Open the results written by `write_results` in any format'''
+
+    path = Path(os.path.expandvars(str(path))).expanduser()
+    if path.is_dir():
+        return NpzResults(path)
+    if path.suffix == '.parquet':
+        return ParquetResults(path)
+    return CsvResults(path)
+
+
+class Results(ABC):
+    '''Batched, column selective reader of the results of a search.
+
+    `batches(columns)` yields `pandas.DataFrame`s with only `columns`; the parameter columns
+    hold the parameter values (`NaN` or `pandas.NA` where the candidate does not have the parameter).
+    '''
+
+    def __init__(self, path: Path):
+        self.path = path
+
+    @property
+    @abstractmethod
+    def columns(self) -> list[str]:
+        ...
+
+    @abstractmethod
+    def batches(self, columns: list[str] | None = None) -> Iterator[Any]:
+        ...
+
+    @property
+    def parameters(self) -> list[str]:
+        '''Names of the parameters, without the `param_` prefix'''
+        return [column[len('param_'):] for column in self.columns if column.startswith('param_')]
+
+    def _column(self, name: str) -> str:
+        column = name if name in self.columns else f'param_{name}'
+        if column not in self.columns:
+            raise KeyError(f'No column {name} in {self.path}')
+        return column
+
+    def top_k(self, k: int = 10, by: str = 'mean_test_score', columns: list[str] | None = None, ascending: bool = False):
+        '''The `k` best candidates by `by` (highest first, lowest with `ascending`)
+
+        Parameters
+        ----------
+        `columns`: `list[str] | None`
+            Columns of the result, by default `by`, the parameters and `std_test_score`
+        '''
+
+        import pandas as pd
+
+        by = self._column(by)
+        if columns is None:
+            columns = [by, *(column for column in ('std_test_score', 'rank_test_score') if column in self.columns and column != by),
+                       *(f'param_{name}' for name in self.parameters)]
+        columns = list(dict.fromkeys([by, *(self._column(column) for column in columns)]))
+
+        best = None
+        for batch in self.batches(columns):
+            best = batch if best is None else pd.concat([best, batch])
+            best = best.sort_values(by, ascending=ascending, kind='stable', na_position='last').head(k)
+        return best.reset_index(drop=True) if best is not None else pd.DataFrame(columns=columns)
+
+    def marginals(self, parameter: str, by: str = 'mean_test_score'):
+        '''Statistics of `by` over the candidates sharing each value of `parameter`
+
+        Return
+        ------
+        `pandas.DataFrame` indexed by the parameter values, with the `count`, `mean`, `std`,
+        `min` and `max` of `by`
+        '''
+
+        import pandas as pd
+
+        column, by = self._column(parameter), self._column(by)
+        ## One row per parameter value and batch, reduced once at the end
+        partials = []
+        for batch in self.batches([column, by]):
+            keys = batch[column].map(lambda value: value if value is None or value is pd.NA or isinstance(value, (int, float, str, bool)) else repr(value))
+            values = batch[by].astype(float)
+            partials.append(pd.DataFrame({'value': values, 'value2': values ** 2}).groupby(keys, dropna=False).agg(
+                count=('value', 'count'), sum=('value', 'sum'), sum2=('value2', 'sum'), min=('value', 'min'), max=('value', 'max')
+            ))
+
+        if not partials:
+            return pd.DataFrame(columns=['count', 'mean', 'std', 'min', 'max'])
+        totals = pd.concat(partials).groupby(level=0, dropna=False).agg(
+            {'count': 'sum', 'sum': 'sum', 'sum2': 'sum', 'min': 'min', 'max': 'max'}
+        )
+        with np.errstate(all='ignore'):
+            mean = totals['sum'] / totals['count']
+            std = np.sqrt(np.maximum(totals['sum2'] / totals['count'] - mean ** 2, 0.))
+        marginals = pd.DataFrame({'count': totals['count'].astype(int), 'mean': mean, 'std': std, 'min': totals['min'], 'max': totals['max']})
+        marginals.index.name = column[len('param_'):]
+        return marginals.sort_index()
+
+    @abstractmethod
+    def best_parameters(self) -> dict[str, Any]:
+        '''Parameters of the best ranked candidate (`rank_test_score` 1, the pruned candidates are ranked last)'''
+
+
+class CsvResults(Results):
+    '''Results in the csv written by pandas, the parameters are read back from the `params` column'''
+
+    def __init__(self, path: Path, batch_rows: int = 10000):
+        import pandas as pd
+
+        super().__init__(path)
+        self.batch_rows = batch_rows
+        self._columns = [column for column in pd.read_csv(path, nrows=0).columns if not column.startswith('Unnamed')]
+
+    @property
+    def columns(self) -> list[str]:
+        return self._columns
+
+    def batches(self, columns: list[str] | None = None) -> Iterator[Any]:
+        import pandas as pd
+
+        yield from pd.read_csv(self.path, usecols=columns, chunksize=self.batch_rows)
+
+    def best_parameters(self) -> dict[str, Any]:
+        best = self.top_k(1, by='rank_test_score', columns=['params'], ascending=True)
+        if best.empty:
+            create_logger(__name__).error('No candidate in %s', self.path)
+            sys.exit(2)
+        ## numpy scalars are written as `np.float64(0.1)`, keep only the value
+        return ast.literal_eval(re.sub(r'np\.\w+\(([^()]*)\)', r'\1', best['params'].iloc[0]))
+
+
+class _ColumnarResults(Results):
+    '''Results with typed parameter columns, see `tuna.utils.results.write_results`'''
+
+    schema: dict[str, Any]
+
+    @property
+    def columns(self) -> list[str]:
+        return [*(f'param_{name}' for name in self.schema['parameters']), *self.schema['metrics']]
+
+    def _frame(self, arrays: dict[str, tuple[np.ndarray, np.ndarray | None]]):
+        '''DataFrame of typed columns, the JSON parameters decoded and the missing values masked'''
+
+        import pandas as pd
+
+        kinds = {f'param_{name}': kind for name, kind in self.schema['parameters'].items()}
+        frame = {}
+        for column, (values, present) in arrays.items():
+            kind = kinds.get(column)
+            if kind == 'json':
+                values = np.array([json.loads(value) if value else None for value in values] + [None], dtype=object)[:-1]
+            if present is not None and not present.all():
+                values = values.astype(object if kind in ('json', 'bool') else np.float64)
+                values[~present] = pd.NA if kind in ('json', 'bool') else np.nan
+            frame[column] = values
+        return pd.DataFrame(frame)
+
+    def best_parameters(self) -> dict[str, Any]:
+        import pandas as pd
+
+        best = self.top_k(1, by='rank_test_score', columns=[f'param_{name}' for name in self.schema['parameters']], ascending=True)
+        if best.empty:
+            create_logger(__name__).error('No candidate in %s', self.path)
+            sys.exit(2)
+
+        parameters = {}
+        for name, kind in self.schema['parameters'].items():
+            value = best[f'param_{name}'].iloc[0]
+            ## A missing value: the candidate does not have the parameter
+            if value is pd.NA or (kind in ('int', 'float') and np.isnan(value)):
+                continue
+            parameters[name] = {'bool': bool, 'int': int, 'float': float}.get(kind, lambda value: value)(value)
+        return parameters
+
+
+class NpzResults(_ColumnarResults):
+    '''Results in a directory of compressed NumPy parts'''
+
+    def __init__(self, path: Path):
+        super().__init__(path)
+        with open(path / 'schema.json') as f:
+            self.schema = json.load(f)
+
+    def batches(self, columns: list[str] | None = None) -> Iterator[Any]:
+        columns = self.columns if columns is None else columns
+        for part in range(self.schema['parts']):
+            ## `np.load` of an npz only decompresses the arrays which are accessed
+            with np.load(self.path / f'part-{part:05d}.npz') as arrays:
+                yield self._frame({
+                    column: (arrays[column], arrays[f'{column}__present'] if f'{column}__present' in arrays.files else None)
+                    for column in columns
+                })
+
+
+class ParquetResults(_ColumnarResults):
+    '''Results in a Parquet file, read a row group at a time'''
+
+    def __init__(self, path: Path):
+        super().__init__(path)
+        _, pq = _require_pyarrow()
+        self._file = pq.ParquetFile(path)
+        self.schema = json.loads(self._file.schema_arrow.metadata[b'tuna'])
+
+    def batches(self, columns: list[str] | None = None) -> Iterator[Any]:
+        columns = self.columns if columns is None else columns
+        for group in range(self._file.num_row_groups):
+            table = self._file.read_row_group(group, columns=columns)
+            yield self._frame({
+                column: (table[column].to_numpy(), None if table[column].null_count == 0 else table[column].is_valid().to_numpy())
+                for column in columns
+            })
@@ -0,0 +1,771 @@
+'''Hyperparameter search strategies shared by the cross-validation modules
+
+The strategy is selected by the `search_strategy` configuration key:
+
+ - `grid`: full cartesian `GridSearchCV` (default)
+ - `halving_grid`: successive halving over the full grid (`HalvingGridSearchCV`)
+ - `halving_random`: successive halving over `search_n_candidates` random grid points
+ - `hyperband`: Hyperband, i.e. several successive halving brackets trading the number of
+   candidates against the budget they start from
+ - `bayesian`: sequential model-based optimization (TPE, see `tuna.utils.tpe`) treating the
+   `[low, high]` entries as continuous/integer ranges, evaluated in batches of `n_jobs`
+   candidates until `search_n_trials` or `search_time_budget` (seconds) is reached
+
+With the `grid` strategy, `staged_parameter` (e.g. `n_estimators`) enables staged scoring:
+each (other parameters, fold) pair is fitted once at the largest value of that parameter
+and all the smaller values are scored from the same fit (see `tuna.utils.staged`), and
+`checkpoint_path` streams every (candidate, fold) result to an append-only store, so that a
+restarted run only computes the missing ones (see `tuna.utils.checkpoint`), and
+`fit_cache_path` memoizes the fold scores across configurations and runs (see
+`tuna.utils.cache.FitCache`). With `pruning_percentile` the folds are evaluated one at a
+time and, from `pruning_min_folds` on, the candidates far below the others stop being
+evaluated (marked in the `pruned` column). With `search_backend: queue` the (candidate, fold)
+tasks are shared with `tuna --worker` processes, on this or other hosts (see
+`tuna.utils.work_queue`).
+
+The budget used by the halving strategies (`search_resource`) is either `n_samples` or any
+integer parameter of the estimator, e.g. `n_estimators` (the boosting rounds). With every
+strategy the `n_samples` budgets (`search_min_resources`, `search_max_resources` and the
+`n_resources` of the results) are samples of a training fold.
+'''
+
+import math
+import sys
+import time
+import warnings
+from typing import Any
+
+import numpy as np
+
+from tuna.utils.helpers import ModuleConfiguration, create_logger
+
+SEARCH_STRATEGIES = ('grid', 'halving_grid', 'halving_random', 'hyperband', 'bayesian')
+
+
+def fit_and_score(estimator, X, y, train, test, parameters: dict[str, Any], scorer, fit_params: dict[str, Any] | None = None) -> tuple[float, float, float]:
+    '''Fit a clone of `estimator` with `parameters` on the `train` rows and score it on the `test` rows.
+
+    Return
+    ------
+    `(score, fit_time, score_time)`, the score is `nan` if the fit failed (as `error_score=np.nan`)
+    '''
+
+    from sklearn.base import clone
+
+    estimator = clone(estimator).set_params(**parameters)
+    fit_params = {key: value[train] for key, value in (fit_params or {}).items()}
+
+    start = time.perf_counter()
+    try:
+        estimator.fit(X[train], y[train], **fit_params)
+    except Exception as e:
+        create_logger(__name__).warning('Fit failed for %s\n%s', parameters, e)
+        return np.nan, time.perf_counter() - start, 0.
+    fit_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    score = scorer(estimator, X[test], y[test])
+    return score, fit_time, time.perf_counter() - start
+
+
+def assemble_cv_results(candidates: list[dict[str, Any]], scores: np.ndarray, fit_times: np.ndarray, score_times: np.ndarray,
+                        pruned: np.ndarray | None = None) -> dict[str, Any]:
+    '''Build a `cv_results_` dictionary (same layout as `GridSearchCV`) from per (candidate, fold) arrays
+
+    `scores`, `fit_times` and `score_times` have shape `(n_candidates, n_folds)`, `nan` marks
+    folds which were not evaluated. With `pruned` (boolean, one per candidate) a `pruned`
+    column is added and the pruned candidates are ranked after all the others.
+    '''
+
+    results: dict[str, Any] = {
+        'mean_fit_time': np.nanmean(fit_times, axis=1) if fit_times.size else np.zeros(len(candidates)),
+        'std_fit_time': np.nanstd(fit_times, axis=1) if fit_times.size else np.zeros(len(candidates)),
+        'mean_score_time': np.nanmean(score_times, axis=1) if score_times.size else np.zeros(len(candidates)),
+        'std_score_time': np.nanstd(score_times, axis=1) if score_times.size else np.zeros(len(candidates)),
+    }
+
+    names = sorted({name for candidate in candidates for name in candidate})
+    for name in names:
+        results[f'param_{name}'] = np.ma.MaskedArray(
+            np.array([candidate.get(name) for candidate in candidates], dtype=object),
+            mask=[name not in candidate for candidate in candidates]
+        )
+    results['params'] = list(candidates)
+
+    for fold in range(scores.shape[1]):
+        results[f'split{fold}_test_score'] = scores[:, fold]
+    ## A candidate without any evaluated fold gets a `nan` score, silently
+    with np.errstate(all='ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        results['mean_test_score'] = np.nanmean(scores, axis=1)
+        results['std_test_score'] = np.nanstd(scores, axis=1)
+
+    if pruned is not None:
+        results['pruned'] = np.asarray(pruned, dtype=bool)
+    results['rank_test_score'] = rank_scores(results['mean_test_score'], pruned)
+    return results
+
+
+def rank_scores(mean_test_score: np.ndarray, groups: np.ndarray | None = None) -> np.ndarray:
+    '''`rank_test_score` as scikit-learn computes it: tied scores share the smallest rank and
+    the `nan` scores are ranked last. With `groups` the candidates are ranked one group after
+    the other, in increasing order of the group (e.g. the pruned candidates after the others).
+    '''
+
+    from scipy.stats import rankdata
+
+    scores = np.asarray(mean_test_score, dtype=float)
+    if np.isnan(scores).all():
+        return np.ones(scores.size, dtype=np.int32)
+    scores = np.nan_to_num(scores, nan=np.nanmin(scores) - 1)
+
+    groups = np.zeros(scores.size, dtype=int) if groups is None else np.asarray(groups)
+    rank = np.empty(scores.size, dtype=np.int32)
+    offset = 0
+    for group in np.unique(groups):
+        members = groups == group
+        rank[members] = offset + rankdata(-scores[members], method='min')
+        offset += members.sum()
+    return rank
+
+
+def prune_candidates(scores: np.ndarray, pruned: np.ndarray, completed: int, percentile: float | None, min_folds: int = 1) -> np.ndarray:
+    '''Percentile pruning of the candidates after their first `completed` folds.
+
+    A candidate still running is pruned when its running mean score, plus one standard error,
+    is below the `percentile`-th percentile of the running means of all the candidates (50 is
+    the median pruner), the pruned ones counting with the mean of the folds they completed.
+    As the percentile is not taken over the survivors only, the cuts do not compound fold
+    after fold. A candidate within the standard errors of the leader is never pruned.
+    Candidates whose folds all failed are pruned as well. Nothing is pruned before
+    `min_folds` folds, nor after the last one.
+
+    Parameters
+    ----------
+    `scores`: `np.ndarray`
+        Scores of shape `(n_candidates, n_folds)`, only the first `completed` folds are read
+    `pruned`: `np.ndarray`
+        Boolean mask of the candidates already pruned
+
+    Return
+    ------
+    Boolean mask of the candidates pruned by this call
+    '''
+
+    newly = np.zeros(len(pruned), dtype=bool)
+    if percentile is None or completed < max(1, min_folds) or completed >= scores.shape[1]:
+        return newly
+
+    ## The pruned candidates have no score after the fold they were pruned at
+    running = scores[:, :completed]
+    with np.errstate(all='ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        means = np.nanmean(running, axis=1)
+        errors = np.nan_to_num(np.nanstd(running, axis=1) / np.sqrt(np.sum(np.isfinite(running), axis=1)))
+    if np.sum(np.isfinite(means)) < 2:
+        return newly
+
+    leader = np.nanargmax(means)
+    threshold = min(np.percentile(means[np.isfinite(means)], percentile), means[leader] - errors[leader])
+    active = np.flatnonzero(~pruned)
+    newly[active] = ~(means[active] + errors[active] >= threshold)
+    return newly
+
+
+def _evaluate_group(estimator, X, y, fold, group, candidates, staged_parameter, scorer, fit_params, task) -> tuple[tuple[int, int], list[tuple[float, float, float]]]:
+    '''Worker side of `FoldSearchCV`: evaluate one (candidate group, fold) task'''
+
+    train, test = fold
+    parameters, members = group
+
+    if staged_parameter is None:
+        return task, [fit_and_score(estimator, X, y, train, test, parameters, scorer, fit_params)]
+
+    from tuna.utils.staged import staged_fit_and_score
+
+    stages = [candidates[idx][staged_parameter] for idx in members]
+    return task, staged_fit_and_score(estimator, X, y, train, test, parameters, staged_parameter, stages, scorer, fit_params)
+
+
+class FoldSearchCV:
+    '''Exhaustive grid search dispatching one task per (candidate group, fold).
+
+    Without `staged_parameter` each group is a single candidate. With it, the candidates
+    differing only by `staged_parameter` form a group, fitted once per fold at the largest
+    value and scored at every value. The `cv_results_` are identical in layout (and row
+    order) to the ones of `GridSearchCV`.
+
+    With `checkpoint_path` the results are written to a `ResultStore` as soon as each task
+    finishes, and the results already in the store are not computed again. Likewise the
+    (candidate, fold) pairs found in `fit_cache` are not dispatched to the workers.
+
+    With `pruning_percentile` the folds are scheduled one at a time for all the candidates, and
+    after each fold (from `pruning_min_folds` on) the hopeless candidates are pruned (see
+    `prune_candidates`): their remaining folds are skipped and they are flagged in the `pruned`
+    column of the results.
+
+    With `queue_path` the tasks go through a `tuna.utils.work_queue.WorkQueue` served by other
+    processes too, possibly on other hosts. These run the same search with `worker=True`: they
+    only take tasks from the queue and have no `cv_results_` (`None`).
+
+    With `results_writer` (a `tuna.utils.results.ResultsWriter`) the rows of the candidates are
+    written as soon as all their folds are done (or they are pruned), a batch at a time, and
+    the results file is completed at the end of `fit`.
+    '''
+
+    def __init__(self, estimator, param_grid: dict[str, list], cv, scoring=None, n_jobs=None, verbose=0,
+                 staged_parameter: str | None = None, checkpoint_path: str | None = None, checkpoint_name: str = 'search',
+                 fit_cache=None, pruning_percentile: float | None = None, pruning_min_folds: int = 1,
+                 queue_path: str | None = None, queue_lease_seconds: float = 600., queue_poll_seconds: float = 5., worker: bool = False,
+                 results_writer=None):
+        self.estimator = estimator
+        self.param_grid = param_grid
+        self.cv = cv
+        self.scoring = scoring
+        self.n_jobs = n_jobs
+        self.verbose = verbose
+        self.staged_parameter = staged_parameter
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_name = checkpoint_name
+        self.fit_cache = fit_cache
+        self.pruning_percentile = pruning_percentile
+        self.pruning_min_folds = pruning_min_folds
+        self.queue_path = queue_path
+        self.queue_lease_seconds = queue_lease_seconds
+        self.queue_poll_seconds = queue_poll_seconds
+        self.worker = worker
+        self.results_writer = results_writer
+
+    def _fingerprint(self, dataset: str, folds) -> dict[str, Any]:
+        '''Everything the results depend on, identifying the checkpoint of this search'''
+
+        from tuna.utils.cache import array_fingerprint
+
+        return {
+            'estimator': type(self.estimator).__name__,
+            'estimator_parameters': sorted(self.estimator.get_params(deep=True).items()),
+            'param_grid': self.param_grid,
+            'scoring': self.scoring,
+            'dataset': dataset,
+            'folds': array_fingerprint(*(indices for fold in folds for indices in fold)),
+        }
+
+    def _fit_keys(self, dataset: str, candidates, folds) -> list[list[str]]:
+        '''`FitCache` keys of every (candidate, fold), from the full parameters of the estimator'''
+
+        from sklearn.base import clone
+
+        from tuna.utils.cache import array_fingerprint
+
+        name = f'{type(self.estimator).__module__}.{type(self.estimator).__name__}'
+        fold_hashes = [array_fingerprint(*fold) for fold in folds]
+        keys = []
+        for candidate in candidates:
+            parameters = clone(self.estimator).set_params(**candidate).get_params(deep=True)
+            keys.append([self.fit_cache.key(dataset, name, parameters, self.scoring, fold) for fold in fold_hashes])
+        return keys
+
+    def _groups(self, candidates: list[dict[str, Any]]) -> list[tuple[dict[str, Any], list[int]]]:
+        '''Group the candidate indices by their parameters other than `staged_parameter`'''
+
+        if self.staged_parameter is None:
+            return [(candidate, [idx]) for idx, candidate in enumerate(candidates)]
+
+        groups: dict[str, tuple[dict[str, Any], list[int]]] = {}
+        for idx, candidate in enumerate(candidates):
+            others = {key: value for key, value in candidate.items() if key != self.staged_parameter}
+            groups.setdefault(repr(sorted(others.items())), (others, []))[1].append(idx)
+        return list(groups.values())
+
+    def fit(self, X, y, **fit_params) -> 'FoldSearchCV':
+        from joblib import Parallel, delayed, effective_n_jobs
+        from sklearn.metrics import check_scoring
+        from sklearn.model_selection import ParameterGrid
+
+        scorer = check_scoring(self.estimator, self.scoring)
+        folds = list(self.cv.split(X, y)) if hasattr(self.cv, 'split') else list(self.cv)
+        candidates = list(ParameterGrid(self.param_grid))
+        groups = self._groups(candidates)
+
+        print(f'Fitting {len(folds)} folds for each of {len(candidates)} candidates, '
+              f'totalling {len(groups) * len(folds)} fits ({len(candidates) * len(folds)} scores)')
+
+        results = np.full((len(candidates), len(folds), 3), np.nan)
+        pruned = np.zeros(len(candidates), dtype=bool)
+        done = np.zeros((len(candidates), len(folds)), dtype=bool)
+        written = np.zeros(len(candidates), dtype=bool)
+        pending: list[int] = []
+
+        def __write(indices, flush: bool = False) -> None:
+            ## The rows of the finished candidates go to the writer a batch at a time
+            if self.results_writer is None:
+                return
+            for idx in indices:
+                if not written[idx]:
+                    written[idx] = True
+                    pending.append(idx)
+            if pending and (flush or len(pending) >= self.results_writer.batch_rows):
+                rows = np.array(pending)
+                pending.clear()
+                self.results_writer.write(assemble_cv_results(
+                    [candidates[idx] for idx in rows], results[rows, :, 0], results[rows, :, 1], results[rows, :, 2],
+                    pruned=pruned[rows] if self.pruning_percentile is not None else None
+                ), rows)
+
+        from tuna.utils.cache import array_fingerprint
+        from tuna.utils.checkpoint import ResultStore, candidate_key
+
+        def __evaluate(parallel, tasks: list[tuple[int, int]]):
+            return parallel(
+                delayed(_evaluate_group)(
+                    self.estimator, X, y, folds[fold], groups[group], candidates, self.staged_parameter, scorer, fit_params, (group, fold)
+                )
+                for group, fold in tasks
+            )
+
+        store, fit_keys, known, queue = None, None, {}, None
+        if self.checkpoint_path or self.fit_cache is not None or self.queue_path:
+            dataset = array_fingerprint(X, y, *fit_params.values())
+
+        if self.queue_path:
+            from tuna.utils.work_queue import WorkQueue
+
+            queue = WorkQueue(self.queue_path, self.checkpoint_name, self._fingerprint(dataset, folds),
+                              lease_seconds=self.queue_lease_seconds, poll_seconds=self.queue_poll_seconds)
+            batch_size = effective_n_jobs(self.n_jobs)
+
+        if self.worker:
+            if not queue.wait(self.queue_lease_seconds):
+                create_logger(__name__).error('No queue %s after %s s, is the coordinator running the same configuration?',
+                                              queue.path, self.queue_lease_seconds)
+                sys.exit(2)
+            print(f'[queue] working on {queue.path}')
+            with Parallel(n_jobs=self.n_jobs, verbose=self.verbose, return_as='generator_unordered') as parallel:
+                n_tasks = queue.work(lambda tasks: __evaluate(parallel, tasks), batch_size)
+            print(f'[queue] {n_tasks} tasks run by this worker')
+            self.cv_results_ = None
+            return self
+
+        if self.checkpoint_path:
+            store = ResultStore(self.checkpoint_path, self.checkpoint_name, self._fingerprint(dataset, folds))
+            keys = [candidate_key(candidate) for candidate in candidates]
+            known.update({
+                (idx, fold): store.get(keys[idx], fold)
+                for idx in range(len(candidates)) for fold in range(len(folds)) if (keys[idx], fold) in store
+            })
+
+        if self.fit_cache is not None:
+            fit_keys = self._fit_keys(dataset, candidates, folds)
+            cached = self.fit_cache.get_many([key for row in fit_keys for key in row])
+            for idx, row in enumerate(fit_keys):
+                for fold, key in enumerate(row):
+                    if key in cached and (idx, fold) not in known:
+                        known[(idx, fold)] = cached[key]
+                        if store is not None:
+                            store.add(keys[idx], fold, cached[key])
+
+        if self.results_writer is not None:
+            self.results_writer.start(candidates)
+
+        ## Without pruning all the folds go in a single round, keeping the workers busy until the end
+        rounds = [[fold] for fold in range(len(folds))] if self.pruning_percentile is not None else [list(range(len(folds)))]
+        n_known = n_fits = 0
+
+        try:
+            if queue is not None:
+                queue.create()
+            with Parallel(n_jobs=self.n_jobs, verbose=self.verbose, return_as='generator_unordered') as parallel:
+                for round_folds in rounds:
+                    tasks = []
+                    for fold in round_folds:
+                        for group, (_, members) in enumerate(groups):
+                            if pruned[members].all():
+                                continue
+                            if all((idx, fold) in known for idx in members):
+                                results[members, fold] = [known[(idx, fold)] for idx in members]
+                                done[members, fold] = True
+                                n_known += 1
+                            else:
+                                tasks.append((group, fold))
+                    n_fits += len(tasks)
+
+                    if queue is None or not tasks:
+                        output = __evaluate(parallel, tasks)
+                    else:
+                        output = queue.run(tasks, [len(groups[group][1]) for group, _ in tasks],
+                                           lambda batch: __evaluate(parallel, batch), batch_size)
+                    for (group, fold), group_output in output:
+                        for idx, result in zip(groups[group][1], group_output):
+                            ## A staged group may still contain pruned members: their results are kept for later runs only
+                            if not pruned[idx]:
+                                results[idx, fold] = result
+                                done[idx, fold] = True
+                            if store is not None:
+                                store.add(keys[idx], fold, result)
+                            if fit_keys is not None:
+                                self.fit_cache.put(fit_keys[idx][fold], result)
+                        ## Without pruning a candidate is final once its folds are done
+                        if self.pruning_percentile is None:
+                            __write([idx for idx in groups[group][1] if done[idx].all()])
+
+                    newly = prune_candidates(
+                        results[:, :, 0], pruned, round_folds[-1] + 1, self.pruning_percentile, self.pruning_min_folds
+                    )
+                    if newly.any():
+                        pruned |= newly
+                        print(f'[pruning] after {round_folds[-1] + 1} folds: {newly.sum()} candidates pruned, '
+                              f'{len(candidates) - pruned.sum()} left')
+                    __write(np.flatnonzero(pruned | done.all(axis=1)))
+            __write(range(len(candidates)), flush=True)
+        except BaseException:
+            if self.results_writer is not None:
+                self.results_writer.discard()
+            raise
+        finally:
+            if queue is not None:
+                queue.finish()
+            if store is not None:
+                store.close()
+            if self.fit_cache is not None:
+                self.fit_cache.close()
+
+        if n_known:
+            print(f'Found {n_known} completed fits (checkpoint/cache), {n_fits} computed')
+        if self.pruning_percentile is not None:
+            print(f'Pruned {pruned.sum()}/{len(candidates)} candidates, {n_known + n_fits}/{len(groups) * len(folds)} fits needed')
+
+        self.cv_results_ = assemble_cv_results(
+            candidates, results[:, :, 0], results[:, :, 1], results[:, :, 2],
+            pruned=pruned if self.pruning_percentile is not None else None
+        )
+        if self.results_writer is not None:
+            self.results_writer.close(self.cv_results_['rank_test_score'])
+        return self
+
+class TPESearchCV:
+    '''Bayesian (TPE) hyperparameter search with the scikit-learn search interface.
+
+    The candidates are proposed in batches of `batch_size` (by default the effective `n_jobs`),
+    all the (candidate, fold) fits of a batch run in parallel, then the sampler is updated
+    with the mean scores. The search stops after `n_trials` candidates or once `time_budget`
+    seconds have elapsed (checked between batches).
+    '''
+
+    def __init__(self, estimator, param_distributions: dict[str, list], cv, scoring=None, n_jobs=None, verbose=0,
+                 n_trials: int = 100, time_budget: float | None = None, batch_size: int | None = None,
+                 integer_parameters: tuple[str, ...] = (), random_state: int | None = None):
+        self.estimator = estimator
+        self.param_distributions = param_distributions
+        self.cv = cv
+        self.scoring = scoring
+        self.n_jobs = n_jobs
+        self.verbose = verbose
+        self.n_trials = n_trials
+        self.time_budget = time_budget
+        self.batch_size = batch_size
+        self.integer_parameters = integer_parameters
+        self.random_state = random_state
+
+    def fit(self, X, y, **fit_params) -> 'TPESearchCV':
+        from joblib import Parallel, delayed, effective_n_jobs
+        from sklearn.metrics import check_scoring
+
+        from tuna.utils.tpe import TPESampler, search_space
+
+        scorer = check_scoring(self.estimator, self.scoring)
+        folds = list(self.cv.split(X, y)) if hasattr(self.cv, 'split') else list(self.cv)
+        batch_size = self.batch_size or effective_n_jobs(self.n_jobs)
+
+        space = search_space(self.param_distributions, self.integer_parameters)
+        create_logger(__name__).info('Bayesian search space %s', space)
+        sampler = TPESampler(space, n_startup=max(10, batch_size), random_state=self.random_state)
+
+        candidates, scores, fit_times, score_times = [], [], [], []
+        start = time.monotonic()
+
+        with Parallel(n_jobs=self.n_jobs, verbose=self.verbose) as parallel:
+            while len(candidates) < self.n_trials:
+                if self.time_budget is not None and time.monotonic() - start > self.time_budget:
+                    create_logger(__name__).warning('Time budget of %s s reached after %d trials', self.time_budget, len(candidates))
+                    break
+
+                batch = sampler.ask(min(batch_size, self.n_trials - len(candidates)))
+                output = parallel(
+                    delayed(fit_and_score)(self.estimator, X, y, train, test, params, scorer, fit_params)
+                    for params in batch for train, test in folds
+                )
+                output = np.array(output, dtype=float).reshape(len(batch), len(folds), 3)
+
+                for params, result in zip(batch, output):
+                    sampler.tell(params, np.nanmean(result[:, 0]) if np.any(np.isfinite(result[:, 0])) else np.nan)
+                candidates += batch
+                scores.append(output[:, :, 0])
+                fit_times.append(output[:, :, 1])
+                score_times.append(output[:, :, 2])
+
+                best = np.nanmax([score for _, score in sampler.trials])
+                print(f'[bayesian] {len(candidates)}/{self.n_trials} trials, best mean score {best:.5f}')
+
+        self.cv_results_ = assemble_cv_results(
+            candidates, np.concatenate(scores), np.concatenate(fit_times), np.concatenate(score_times)
+        )
+        return self
+
+
+class HyperbandSearchCV:
+    '''Hyperband over a parameter grid, built on top of `HalvingRandomSearchCV` brackets.
+
+    Bracket `s` (out of `s_max + 1`) starts `ceil((s_max + 1) / (s + 1) * factor**s)` random
+    candidates at `max_resources / factor**s` and halves them down to `max_resources`.
+    The `cv_results_` of all the brackets are merged (with an extra `bracket` column),
+    ranked by the budget reached first and then by the mean test score.
+
+    With the `n_samples` resource the budgets are samples of a training fold, at most the size
+    of the smallest one (the folds only cover the training rows of `X`).
+    '''
+
+    def __init__(self, estimator, param_distributions: dict[str, list], cv, scoring=None, n_jobs=None, verbose=0,
+                 resource: str = 'n_samples', factor: int = 3, min_resources: int | None = None, max_resources: int | None = None,
+                 random_state: int | None = None):
+        self.estimator = estimator
+        self.param_distributions = param_distributions
+        self.cv = cv
+        self.scoring = scoring
+        self.n_jobs = n_jobs
+        self.verbose = verbose
+        self.resource = resource
+        self.factor = factor
+        self.min_resources = min_resources
+        self.max_resources = max_resources
+        self.random_state = random_state
+
+    def fit(self, X, y, **fit_params) -> 'HyperbandSearchCV':
+        from sklearn.experimental import enable_halving_search_cv  # noqa: F401
+        from sklearn.model_selection import HalvingRandomSearchCV
+
+        scale = 1.
+        if self.resource == 'n_samples':
+            n_fold_train, scale = _fold_samples_scale(self.cv, X.shape[0])
+            max_resources = min(self.max_resources or n_fold_train, n_fold_train)
+        else:
+            max_resources = self.max_resources or X.shape[0]
+        smallest = self.min_resources
+        if smallest is None:
+            ## Same as the `smallest` option of the halving searches for n_samples
+            smallest = 2 * len(list(self.cv)) * np.unique(y).size if self.resource == 'n_samples' else 1
+        s_max = max(0, int(math.floor(math.log(max_resources / smallest, self.factor) + 1e-9)))
+
+        brackets = []
+        for s in reversed(range(s_max + 1)):
+            n_candidates = int(math.ceil((s_max + 1) / (s + 1) * self.factor**s))
+            min_resources = max(smallest, int(max_resources / self.factor**s))
+            create_logger(__name__).info(
+                'Hyperband bracket %d: %d candidates from %d %s', s, n_candidates, min_resources, self.resource
+            )
+
+            bracket = HalvingRandomSearchCV(
+                estimator=self.estimator, param_distributions=self.param_distributions, n_candidates=n_candidates,
+                cv=self.cv, scoring=self.scoring, n_jobs=self.n_jobs, verbose=self.verbose, refit=False,
+                resource=self.resource, factor=self.factor,
+                min_resources=min(X.shape[0], round(min_resources * scale)), max_resources=min(X.shape[0], round(max_resources * scale)),
+                aggressive_elimination=True,
+                random_state=None if self.random_state is None else self.random_state + s
+            )
+            bracket.fit(X, y, **fit_params)
+            results = bracket.cv_results_
+            results['n_resources'] = np.round(np.asarray(results['n_resources']) / scale).astype(int)
+            brackets.append((s, results))
+
+        self.cv_results_ = self._merge(brackets)
+        return self
+
+    @staticmethod
+    def _merge(brackets: list[tuple[int, dict[str, Any]]]) -> dict[str, Any]:
+        keys = brackets[0][1].keys()
+        results = {
+            key: np.concatenate([np.asarray(result[key], dtype=object if key.startswith('param') else None) for _, result in brackets])
+            for key in keys if key != 'rank_test_score'
+        }
+        results['bracket'] = np.concatenate([np.full(len(result['params']), s) for s, result in brackets])
+        results['rank_test_score'] = _rank_by_budget(results['mean_test_score'], results['n_resources'])
+        return results
+
+
+def _fold_samples_scale(cv, n_rows: int) -> tuple[int, float]:
+    '''Samples of the smallest training fold of `cv`, and the `scale` converting them to the
+    `n_samples` units of the halving searches, which count fractions of the `n_rows` of X'''
+
+    n_fold_train = min(len(train) for train, _ in cv)
+    return n_fold_train, n_rows / n_fold_train
+
+
+class FoldSamplesHalvingSearchCV:
+    '''A halving search (`HalvingGridSearchCV` or `HalvingRandomSearchCV`) on the `n_samples`
+    resource, counting the budgets in samples of a training fold as `HyperbandSearchCV` does:
+    `min_resources` and `max_resources` (at most the smallest training fold) are converted to
+    the units of the search, and the `n_resources` of `cv_results_` back from them.
+    '''
+
+    def __init__(self, search):
+        self.search = search
+
+    def fit(self, X, y, **fit_params) -> 'FoldSamplesHalvingSearchCV':
+        n_fold_train, scale = _fold_samples_scale(self.search.cv, X.shape[0])
+        budgets = {}
+        for name in ('min_resources', 'max_resources'):
+            value = getattr(self.search, name)
+            ## 'auto', 'smallest' and 'exhaust' are resolved by the search itself
+            if isinstance(value, (int, np.integer)) and not isinstance(value, bool):
+                budgets[name] = min(X.shape[0], round(min(value, n_fold_train) * scale))
+        self.search.set_params(**budgets).fit(X, y, **fit_params)
+
+        self.cv_results_ = dict(self.search.cv_results_)
+        self.cv_results_['n_resources'] = np.round(np.asarray(self.cv_results_['n_resources']) / scale).astype(int)
+        return self
+
+
+def _rank_by_budget(mean_test_score: np.ndarray, n_resources: np.ndarray) -> np.ndarray:
+    '''Rank first by the budget reached, then by the score (see `rank_scores`)'''
+
+    return rank_scores(mean_test_score, -np.asarray(n_resources))
+
+
+def with_resource(cv_results: dict[str, Any], configuration: ModuleConfiguration) -> dict[str, Any]:
+    '''The `cv_results_` of the halving strategies ready to be refitted from
+
+    The candidates are ranked first by the budget they reached (scikit-learn ranks the early
+    iterations together with the last one), and a parameter budget (e.g. `n_estimators`),
+    which the halving searches remove from the candidates, is put back in `params` and in its
+    `param_` column.
+    '''
+
+    if configuration.get('search_strategy') not in ('halving_grid', 'halving_random', 'hyperband') or 'n_resources' not in cv_results:
+        return cv_results
+
+    n_resources = np.asarray(cv_results['n_resources'])
+    cv_results['rank_test_score'] = _rank_by_budget(cv_results['mean_test_score'], n_resources)
+    resource = configuration.get('search_resource')
+    if resource != 'n_samples':
+        cv_results['params'] = [{**params, resource: int(n)} for params, n in zip(cv_results['params'], n_resources)]
+        cv_results[f'param_{resource}'] = np.ma.MaskedArray(n_resources.astype(object), mask=np.zeros(n_resources.size, dtype=bool))
+    return cv_results
+
+
+def build_search(estimator, parameters_grid: dict[str, list], cv, scoring, n_jobs, configuration: ModuleConfiguration,
+                 integer_parameters: tuple[str, ...] = ()):
+    '''Build the search object requested by the module configuration (`search_strategy`)
+
+    `integer_parameters` lists the parameters whose `[low, high]` ranges are sampled as
+    integers by the `bayesian` strategy.
+
+    All the returned objects follow the scikit-learn interface (`fit(X, y, **fit_params)` and
+    `cv_results_`), so the modules do not depend on the chosen strategy.
+    '''
+
+    from sklearn.model_selection import GridSearchCV
+
+    strategy = configuration.get('search_strategy')
+    if strategy not in SEARCH_STRATEGIES:
+        create_logger(__name__).error('Unknown search_strategy %s, choose one of %s', strategy, SEARCH_STRATEGIES)
+        sys.exit(2)
+
+    staged_parameter = configuration.get('staged_parameter')
+    checkpoint_path = configuration.get('checkpoint_path')
+    if staged_parameter and staged_parameter not in parameters_grid:
+        create_logger(__name__).error('staged_parameter %s is not a parameter of the grid', staged_parameter)
+        sys.exit(2)
+    if checkpoint_path and configuration.get('random_state') is None:
+        create_logger(__name__).warning('No random_state set: the folds will change, a restarted run cannot reuse the checkpoint')
+
+    fit_cache = None
+    if configuration.get('fit_cache_path'):
+        from tuna.utils.cache import FitCache
+
+        fit_cache = FitCache(configuration.get('fit_cache_path'), configuration.get('fit_cache_max_entries'))
+
+    pruning_percentile = configuration.get('pruning_percentile')
+    if pruning_percentile is not None and not 0 <= pruning_percentile <= 100:
+        create_logger(__name__).error('pruning_percentile must be between 0 and 100, got %s', pruning_percentile)
+        sys.exit(2)
+    if pruning_percentile is not None and strategy != 'grid':
+        create_logger(__name__).warning('pruning_percentile is only used by the grid strategy, ignoring it')
+
+    queue_path = None
+    if configuration.get('search_backend') == 'queue':
+        queue_path = configuration.get('queue_path')
+        if strategy != 'grid' or not queue_path:
+            create_logger(__name__).error('The queue search_backend needs the grid search_strategy and a (shared) queue_path')
+            sys.exit(2)
+        if configuration.get('random_state') is None:
+            create_logger(__name__).error('The queue search_backend needs a random_state, all the processes must build the same folds')
+            sys.exit(2)
+
+    ## The columnar results are written while the grid search runs
+    results_writer = None
+    if strategy == 'grid' and configuration.get('results_format') in ('parquet', 'npz') and not configuration.worker:
+        from tuna.utils.results import ResultsWriter
+
+        results_writer = ResultsWriter(configuration.get('output_path', required=True), configuration.get('output_name'),
+                                       configuration.get('results_format'), configuration.get('results_batch_rows'))
+
+    if strategy == 'grid' and (staged_parameter or checkpoint_path or fit_cache or pruning_percentile is not None or queue_path
+                               or results_writer is not None):
+        return FoldSearchCV(
+            estimator=estimator, param_grid=parameters_grid, cv=cv, scoring=scoring, n_jobs=n_jobs, verbose=5,
+            staged_parameter=staged_parameter, checkpoint_path=checkpoint_path, checkpoint_name=configuration.get('output_name'),
+            fit_cache=fit_cache, pruning_percentile=pruning_percentile, pruning_min_folds=configuration.get('pruning_min_folds'),
+            queue_path=queue_path, queue_lease_seconds=configuration.get('queue_lease_seconds'),
+            queue_poll_seconds=configuration.get('queue_poll_seconds'), worker=configuration.worker, results_writer=results_writer
+        )
+
+    if strategy == 'grid':
+        return GridSearchCV(estimator=estimator, param_grid=parameters_grid, cv=cv, scoring=scoring, n_jobs=n_jobs, verbose=5, refit=False)
+
+    if strategy == 'bayesian':
+        return TPESearchCV(
+            estimator=estimator, param_distributions=parameters_grid, cv=cv, scoring=scoring, n_jobs=n_jobs, verbose=1,
+            n_trials=configuration.get('search_n_trials'), time_budget=configuration.get('search_time_budget'),
+            integer_parameters=integer_parameters, random_state=configuration.get('random_state')
+        )
+
+    from sklearn.experimental import enable_halving_search_cv  # noqa: F401
+    from sklearn.model_selection import HalvingGridSearchCV, HalvingRandomSearchCV
+
+    resource = configuration.get('search_resource')
+    factor = configuration.get('search_factor')
+    min_resources = configuration.get('search_min_resources')
+    max_resources = configuration.get('search_max_resources')
+    random_state = configuration.get('random_state')
+
+    ## A budget parameter is not searched: the halving sets it, up to the largest value in the grid
+    parameters_grid = dict(parameters_grid)
+    if resource != 'n_samples' and resource in parameters_grid:
+        grid_maximum = max(parameters_grid.pop(resource))
+        max_resources = max_resources or grid_maximum
+    if resource != 'n_samples' and not max_resources:
+        create_logger(__name__).error('search_max_resources is required when using %s as search_resource', resource)
+        sys.exit(2)
+
+    common = dict(
+        estimator=estimator, cv=cv, scoring=scoring, n_jobs=n_jobs, verbose=1, resource=resource, factor=factor
+    )
+
+    if strategy == 'hyperband':
+        return HyperbandSearchCV(
+            param_distributions=parameters_grid, min_resources=min_resources, max_resources=max_resources,
+            random_state=random_state, **common
+        )
+
+    common.update(refit=False, max_resources=max_resources or 'auto')
+
+    if strategy == 'halving_grid':
+        search = HalvingGridSearchCV(param_grid=parameters_grid, min_resources=min_resources or 'exhaust', **common)
+    else:
+        ## The number of candidates and the starting budget cannot be both derived from each other
+        n_candidates = configuration.get('search_n_candidates') or 'exhaust'
+        search = HalvingRandomSearchCV(
+            param_distributions=parameters_grid, n_candidates=n_candidates,
+            min_resources=min_resources or ('smallest' if n_candidates == 'exhaust' else 'exhaust'),
+            random_state=random_state, **common
+        )
+    return FoldSamplesHalvingSearchCV(search) if resource == 'n_samples' else search
@@ -0,0 +1,69 @@
+'''Shared read-only dataset for the parallel search workers
+
+The arrays are written once to memory-mapped `.npy` files (by default in `/dev/shm`) and
+reopened read-only. joblib sends memory-mapped arrays (and views of them) to the workers by
+reference, so every worker attaches to the same pages instead of receiving its own pickled
+copy of the dataset: the memory usage does not grow with `n_jobs`.
+'''
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from tuna.utils.helpers import create_logger
+
+
+class SharedDataset:
+    '''Context manager handing arrays and fold indices to the workers through memory-mapped files.
+
+    Parameters
+    ----------
+    `path`: `str` or `None`
+        Directory for the shared files, `/dev/shm` (or the temporary directory) if `None`
+    `enabled`: `bool`
+        If `False` the arrays are returned unchanged
+    '''
+
+    def __init__(self, path: str | None = None, enabled: bool = True):
+        self.enabled = enabled
+        self.path = path
+        self.directory = None
+
+    def __enter__(self) -> 'SharedDataset':
+        if self.enabled:
+            base = self.path or ('/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir())
+            self.directory = tempfile.mkdtemp(prefix=f'tuna_{os.getpid()}_', dir=os.path.expandvars(base))
+            create_logger(__name__).info('Sharing the dataset with the workers through %s', self.directory)
+        return self
+
+    def __exit__(self, *exc) -> None:
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None
+
+    def array(self, name: str, array: np.ndarray | None) -> np.ndarray | None:
+        '''Return a read-only memory-mapped version of `array` (unchanged if already file backed)'''
+
+        if not self.enabled or array is None:
+            return array
+        if isinstance(array, np.memmap) and array.filename is not None:
+            return array
+
+        filename = os.path.join(self.directory, f'{name}.npy')
+        np.save(filename, array)
+        return np.load(filename, mmap_mode='r')
+
+    def folds(self, folds: list[tuple[np.ndarray, np.ndarray]]) -> list[tuple[np.ndarray, np.ndarray]]:
+        '''Store all the (train, test) index arrays in one shared file and return views of it'''
+
+        if not self.enabled:
+            return folds
+
+        indices = self.array('folds', np.concatenate([np.concatenate(fold) for fold in folds]))
+        shared, offset = [], 0
+        for train, test in folds:
+            shared.append((indices[offset:offset + train.size], indices[offset + train.size:offset + train.size + test.size]))
+            offset += train.size + test.size
+        return shared
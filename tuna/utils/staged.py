@@ -0,0 +1,116 @@
+'''Staged scoring of boosted ensembles
+
+A boosted model with `n` estimators contains the models with fewer estimators as prefixes,
+so one fit at the largest `n_estimators` is enough to score all the smaller values: the
+predictions of every stage are read with `staged_predict`/`staged_decision_function`/
+`staged_predict_proba` (AdaBoost) or `iteration_range` (XGBoost).
+'''
+
+import time
+from typing import Any
+
+import numpy as np
+from sklearn.base import BaseEstimator, ClassifierMixin, clone
+from sklearn.utils.metaestimators import available_if
+
+from tuna.utils.helpers import create_logger
+
+
+class StagedPredictions:
+    '''Predictions of a fitted ensemble on one dataset `X`, for the requested `stages` only.
+
+    Each response method is computed lazily, with a single pass over the staged generator.
+    '''
+
+    def __init__(self, estimator, X, stages: list[int]):
+        self.estimator = estimator
+        self.X = X
+        self.stages = sorted(set(stages))
+        self.cache: dict[str, dict[int, np.ndarray]] = {}
+
+    def get(self, method: str, stage: int) -> np.ndarray:
+        if method not in self.cache:
+            self.cache[method] = self._compute(method)
+        return self.cache[method][stage]
+
+    def _compute(self, method: str) -> dict[int, np.ndarray]:
+
+        ## XGBoost: direct access to any prefix of the boosting rounds
+        if hasattr(self.estimator, 'get_booster'):
+            return {stage: getattr(self.estimator, method)(self.X, iteration_range=(0, stage)) for stage in self.stages}
+
+        staged = getattr(self.estimator, f'staged_{method}')(self.X)
+        wanted = set(self.stages)
+        predictions = {}
+        last = None
+        for stage, prediction in enumerate(staged, start=1):
+            last = prediction
+            if stage in wanted:
+                predictions[stage] = prediction
+                if len(predictions) == len(wanted):
+                    break
+
+        ## The boosting stopped early (perfect fit): the larger stages equal the last one
+        for stage in wanted - predictions.keys():
+            predictions[stage] = last
+        return predictions
+
+
+class StageView(ClassifierMixin, BaseEstimator):
+    '''Read-only view of a fitted ensemble truncated at `stage` estimators, usable by the
+    scikit-learn scorers. It only answers for the `X` the predictions were built on.'''
+
+    def __init__(self, predictions: StagedPredictions | None = None, stage: int = 1):
+        self.predictions = predictions
+        self.stage = stage
+
+    @property
+    def classes_(self) -> np.ndarray:
+        return self.predictions.estimator.classes_
+
+    def _respond(self, method: str, X) -> np.ndarray:
+        if X is not self.predictions.X:
+            raise ValueError('StageView can only respond on the dataset it was built for')
+        return self.predictions.get(method, self.stage)
+
+    def predict(self, X):
+        return self._respond('predict', X)
+
+    def predict_proba(self, X):
+        return self._respond('predict_proba', X)
+
+    @available_if(lambda self: hasattr(self.predictions.estimator, 'staged_decision_function'))
+    def decision_function(self, X):
+        return self._respond('decision_function', X)
+
+
+def staged_fit_and_score(estimator, X, y, train, test, parameters: dict[str, Any], staged_parameter: str, stages: list[int],
+                         scorer, fit_params: dict[str, Any] | None = None) -> list[tuple[float, float, float]]:
+    '''Fit once with `staged_parameter` set to the largest of `stages` and score every stage.
+
+    Return
+    ------
+    One `(score, fit_time, score_time)` per stage, in the order of `stages`. The fit time is
+    shared proportionally to the stage, as an estimate of the time of a separate fit.
+    '''
+
+    largest = max(stages)
+    estimator = clone(estimator).set_params(**{**parameters, staged_parameter: largest})
+    fit_params = {key: value[train] for key, value in (fit_params or {}).items()}
+
+    start = time.perf_counter()
+    try:
+        estimator.fit(X[train], y[train], **fit_params)
+    except Exception as e:
+        create_logger(__name__).warning('Fit failed for %s\n%s', parameters, e)
+        return [(np.nan, (time.perf_counter() - start) * stage / largest, 0.) for stage in stages]
+    fit_time = time.perf_counter() - start
+
+    X_test, y_test = X[test], y[test]
+    predictions = StagedPredictions(estimator, X_test, stages)
+    output = []
+    for stage in stages:
+        start = time.perf_counter()
+        score = scorer(StageView(predictions, stage), X_test, y_test)
+        output.append((score, fit_time * stage / largest, time.perf_counter() - start))
+    return output
@@ -0,0 +1,290 @@
+'''Out-of-core cross-validation for samples larger than the memory (`streaming: true` in `XGBKFoldCV`)
+
+The dataset is never loaded at once: `tuna.utils.loaders.iter_chunks` reads the files in chunks of
+`stream_chunk_rows` rows, and every pass over the data (XGBoost makes a few for each matrix)
+reads them again. Where an event goes is decided by a hash of its identity (the file path,
+relative to the directory common to all the files, and the row in the file) and of `random_state`, hence it is the same at every pass without
+keeping anything per event: the hold-out (`training_split`), the undersampling of the larger
+classes and, for each repetition, the fold of every training event. The folds are not
+stratified, on large samples the hash keeps the class fractions of the folds close anyway.
+
+The fold matrices are built through the XGBoost external-memory `DataIter` API, their
+quantized pages cached on disk in `stream_cache_path` (a temporary directory by default),
+and trained as in `NativeXGBSearchCV`. The memory holds a chunk per matrix being built,
+plus the labels (and weights) of the fold matrices in use.
+'''
+
+import glob
+import os
+import sys
+import tempfile
+import time
+import zlib
+from typing import Any, Callable, Iterator
+
+import numpy as np
+import xgboost as xgb
+from sklearn.model_selection import ParameterGrid
+
+from tuna.utils.helpers import create_logger
+from tuna.utils.loaders import EQUALIZATION_MODES, _csv_width, iter_chunks
+from tuna.utils.xgb_native import NativeXGBSearchCV, thread_layout
+
+_MASK = (1 << 64) - 1
+
+
+def _mix(x: np.ndarray) -> np.ndarray:
+    '''splitmix64 finalizer, a fast bijective scrambling of `uint64` values'''
+
+    x = x ^ (x >> np.uint64(30))
+    x = x * np.uint64(0xBF58476D1CE4E5B9)
+    x = x ^ (x >> np.uint64(27))
+    x = x * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def _salt(random_state: int | None, purpose: int) -> np.uint64:
+    return np.uint64((((random_state or 0) + 1) * 0x9E3779B97F4A7C15 + purpose * 0xD1B54A32D192ED03) & _MASK)
+
+
+def event_hash(file_key: int, rows: np.ndarray, salt: np.uint64) -> np.ndarray:
+    '''Hash of the events at `rows` of the file identified by `file_key`, for the given salt'''
+
+    identity = (np.uint64(file_key) << np.uint64(32)) | rows.astype(np.uint64)
+    return _mix(_mix(identity) ^ salt)
+
+
+def uniform(hashes: np.ndarray) -> np.ndarray:
+    '''Map hashes to floats uniform in [0, 1)'''
+
+    return (hashes >> np.uint64(11)).astype(np.float64) * 2.0**-53
+
+
+class StreamingDataset:
+    '''A dataset read chunk by chunk at every pass, with a hash-based split of the events
+
+    Parameters
+    ----------
+    `files`: `list[str]`
+        The comma-separated or ROOT files
+    `chunk_rows`: `int`
+        Rows read at a time
+    `usecols`, `tree`, `branches`
+        The columns of the csv files, or the TTree and branches of the ROOT files
+    `split`: `float`
+        Fraction of the events used for the cross-validation, the others are held out
+    `equalize_populations`: `bool` or `str`
+        `undersample` (or `True`) or `weight`, as in `DatasetLoader`
+    `random_state`: `int` or `None`
+        Seed of the hashes (`None` is the same as 0, the split is always reproducible)
+    '''
+
+    def __init__(self, files: list[str], chunk_rows: int, usecols: list[int] | None = None, tree: str | None = None,
+                 branches: list[str] | None = None, split: float = 1, equalize_populations = False,
+                 random_state: int | None = None):
+        self.files = files
+        self.chunk_rows = chunk_rows
+        self.usecols = usecols
+        self.tree = tree
+        self.branches = branches
+        self.split = 1 if split is None else split
+        self.equalize_populations = 'undersample' if equalize_populations is True else equalize_populations
+        self.random_state = random_state
+        ## The path relative to the common directory of the files: distinct for `run1/out.csv` and
+        ## `run2/out.csv`, yet stable across machines and relocations of the whole dataset
+        root = os.path.commonpath([os.path.dirname(os.path.abspath(file)) for file in files]) if files else ''
+        self.file_keys = [zlib.crc32(os.path.relpath(os.path.abspath(file), root).encode()) for file in files]
+
+        self.classes: np.ndarray | None = None
+        self.keep_fraction: np.ndarray | None = None
+        self.class_weight: np.ndarray | None = None
+
+    @classmethod
+    def from_configuration(cls, configuration) -> 'StreamingDataset':
+        '''The streaming dataset described by a module configuration (as `DatasetLoader.from_configuration`)'''
+
+        dataset_string = configuration.get('training_dataset_path', required=True)
+        files = sorted(glob.glob(dataset_string))
+        if not files:
+            create_logger(__name__).error('Empty list? Check import...')
+            sys.exit(2)
+
+        equalize_populations = configuration.get('equalize_classes')
+        if equalize_populations not in (False, True, *EQUALIZATION_MODES):
+            create_logger(__name__).error('Unknown equalization %s, choose one of %s', equalize_populations, EQUALIZATION_MODES)
+            sys.exit(2)
+
+        dataset_format = configuration.get('dataset_format')
+        if dataset_format == 'auto':
+            dataset_format = 'root' if dataset_string.endswith('.root') else 'csv'
+
+        specific: dict[str, Any] = {}
+        if dataset_format == 'root':
+            specific.update(tree=configuration.get('root_tree', required=True), branches=configuration.get('root_branches', required=True))
+        else:
+            n_columns = _csv_width(files)
+            if n_columns is None:
+                create_logger(__name__).error('None of the %d files matching %s could be parsed', len(files), dataset_string)
+                sys.exit(2)
+            ## The first column is the index
+            specific.update(usecols=list(range(1, n_columns)))
+
+        return cls(files, configuration.get('stream_chunk_rows'), split=configuration.get('training_split'),
+                   equalize_populations=equalize_populations, random_state=configuration.get('random_state'), **specific)
+
+    def chunks(self, labels_only: bool = False) -> Iterator[tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        '''One pass over the dataset, yield `(features, labels, event_hashes)` chunks (no
+        features, i.e. zero columns, with `labels_only`)'''
+
+        usecols = self.usecols[-1:] if labels_only and self.usecols else self.usecols
+        branches = self.branches[-1:] if labels_only and self.branches else self.branches
+        for file_index, first_row, matrix in iter_chunks(self.files, self.chunk_rows, usecols, self.tree, branches):
+            rows = np.arange(first_row, first_row + matrix.shape[0])
+            yield matrix[:, :-1], matrix[:, -1], event_hash(self.file_keys[file_index], rows, _salt(self.random_state, 0))
+
+    def _selected(self, labels: np.ndarray, hashes: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        '''Events kept by the undersampling, and those among them in the training part'''
+
+        selected = np.ones(labels.size, dtype=bool)
+        if self.keep_fraction is not None:
+            class_index = np.searchsorted(self.classes, labels)
+            selected = uniform(_mix(hashes ^ _salt(self.random_state, 1))) < self.keep_fraction[class_index]
+        return selected, uniform(hashes) < self.split
+
+    def scan(self) -> 'StreamingDataset':
+        '''Count the classes (first pass over the data), needed for the equalization and the scorers'''
+
+        counts: dict[float, np.ndarray] = {}
+        for _, labels, hashes in self.chunks(labels_only=True):
+            _, in_train = self._selected(labels, hashes)
+            for label in np.unique(labels):
+                is_label = labels == label
+                counts.setdefault(float(label), np.zeros(2, dtype=np.int64))
+                counts[float(label)] += (np.count_nonzero(is_label), np.count_nonzero(is_label & in_train))
+
+        self.classes = np.array(sorted(counts), dtype=np.float32)
+        total, train = np.array([counts[label] for label in sorted(counts)]).T
+
+        if self.equalize_populations == 'undersample':
+            self.keep_fraction = total.min() / total
+            train = np.round(train * self.keep_fraction).astype(np.int64)
+        elif self.equalize_populations == 'weight':
+            self.class_weight = train.sum() / (train.size * np.maximum(train, 1))
+
+        create_logger(__name__).info(
+            'Streaming %d files in chunks of %d rows: %d events, ~%d for training (class populations %s)',
+            len(self.files), self.chunk_rows, total.sum(), train.sum(), train.tolist()
+        )
+        return self
+
+    def batches(self, n_splits: int, repeat: int, fold: int, part: str, validation_fraction: float = 0.) -> Iterator[dict[str, np.ndarray]]:
+        '''One pass over the training events of the `fold` (of the repetition `repeat`),
+        `part` being `train` (the other folds) or `test` (the fold itself). A hashed
+        `validation_fraction` of the other folds is kept aside as the `validation` part.
+
+        Yield
+        -----
+        The `data`, `label` (and `weight`) of the next chunk, as the `DataIter` input
+        '''
+
+        salt = _salt(self.random_state, 2 + repeat)
+        ## Far from the salts of the folds
+        validation_salt = _salt(self.random_state, (1 << 16) + repeat)
+        for features, labels, hashes in self.chunks():
+            selected, in_train = self._selected(labels, hashes)
+            in_fold = (_mix(hashes ^ salt) % np.uint64(n_splits)) == fold
+            if part == 'test':
+                rows = selected & in_train & in_fold
+            else:
+                in_validation = uniform(_mix(hashes ^ validation_salt)) < validation_fraction
+                rows = selected & in_train & ~in_fold & (in_validation if part == 'validation' else ~in_validation)
+            if not rows.any():
+                continue
+            batch = {'data': features[rows], 'label': labels[rows]}
+            if self.class_weight is not None:
+                batch['weight'] = self.class_weight[np.searchsorted(self.classes, batch['label'])]
+            yield batch
+
+
+class ChunkIter(xgb.DataIter):
+    '''XGBoost external-memory iterator over the batches returned by `batches()` (one call per pass)'''
+
+    def __init__(self, batches: Callable[[], Iterator[dict[str, np.ndarray]]], cache_prefix: str):
+        self._batches = batches
+        self._iterator: Iterator[dict[str, np.ndarray]] | None = None
+        super().__init__(cache_prefix=cache_prefix)
+
+    def next(self, input_data: Callable) -> bool:
+        if self._iterator is None:
+            self._iterator = self._batches()
+        batch = next(self._iterator, None)
+        if batch is None:
+            return False
+        input_data(**batch)
+        return True
+
+    def reset(self) -> None:
+        self._iterator = None
+
+
+def external_matrix(iterator: ChunkIter, max_bin: int, nthread: int, ref: xgb.DMatrix | None = None) -> xgb.DMatrix:
+    '''External-memory quantized matrix (`ExtMemQuantileDMatrix`, XGBoost >= 3.0, else a paged `DMatrix`)'''
+
+    if hasattr(xgb, 'ExtMemQuantileDMatrix'):
+        return xgb.ExtMemQuantileDMatrix(iterator, max_bin=max_bin, nthread=nthread, ref=ref)
+    return xgb.DMatrix(iterator, nthread=nthread)
+
+
+class StreamingXGBSearchCV(NativeXGBSearchCV):
+    '''Exhaustive grid search of `NativeXGBSearchCV` on a `StreamingDataset`.
+
+    The folds are `n_repeats` repetitions of `n_splits` hash-based folds, each fold matrix is
+    built from one or more passes over the files the first time it is needed.
+    '''
+
+    def __init__(self, param_grid: dict[str, list], n_splits: int = 5, n_repeats: int = 1, cache_path: str | None = None,
+                 **kwargs):
+        super().__init__(param_grid, cv=None, **kwargs)
+        self.n_splits = n_splits
+        self.n_repeats = n_repeats
+        self.cache_path = cache_path
+
+    def fit(self, dataset: StreamingDataset) -> 'StreamingXGBSearchCV':
+        candidates = list(ParameterGrid(self.param_grid))
+        folds = [(repeat, fold) for repeat in range(self.n_repeats) for fold in range(self.n_splits)]
+
+        n_concurrent, nthread = thread_layout(self.n_jobs, len(candidates) * len(folds), self.nthread)
+        print(f'Fitting {len(folds)} folds for each of {len(candidates)} candidates, totalling {len(candidates) * len(folds)} '
+              f'fits ({n_concurrent} concurrent models x {nthread} threads, streaming {dataset.chunk_rows} rows at a time)')
+
+        start = time.perf_counter()
+        if dataset.classes is None:
+            dataset.scan()
+        create_logger(__name__).info('Dataset scanned in %.1f s', time.perf_counter() - start)
+
+        if self.cache_path is not None:
+            os.makedirs(os.path.expandvars(self.cache_path), exist_ok=True)
+        with tempfile.TemporaryDirectory(prefix='tuna_stream_', dir=self.cache_path and os.path.expandvars(self.cache_path)) as cache:
+
+            validation_fraction = self.validation_fraction if self.early_stopping_rounds else 0.
+
+            def __fold_data(idx: int):
+                repeat, fold = folds[idx]
+                fold_start = time.perf_counter()
+
+                def __matrix(part: str, ref=None):
+                    return external_matrix(ChunkIter(
+                        lambda: dataset.batches(self.n_splits, repeat, fold, part, validation_fraction),
+                        os.path.join(cache, f'r{repeat}f{fold}_{part}')
+                    ), self.max_bin, nthread, ref=ref)
+
+                dtrain = __matrix('train')
+                dvalid = __matrix('validation', ref=dtrain) if self.early_stopping_rounds else None
+                dtest = __matrix('test', ref=dtrain)
+                create_logger(__name__).info(
+                    'Fold %d of repetition %d: %d training and %d test events, built in %.1f s',
+                    fold, repeat, dtrain.num_row(), dtest.num_row(), time.perf_counter() - fold_start
+                )
+                return dtrain, dvalid, dtest, dtest.get_label()
+
+            return self._search(candidates, len(folds), __fold_data, dataset.classes, n_concurrent, nthread, start)
@@ -0,0 +1,154 @@
+'''Tree-structured Parzen Estimator (TPE) sampler for the `bayesian` search strategy
+
+The search space is built from the module configuration: a parameter given as a two-element
+numeric list `[low, high]` is a continuous (or integer) range, anything else is a list of
+categorical choices. Ranges spanning at least two orders of magnitude with `low > 0` are
+sampled in log scale.
+
+The sampler is the classic independent TPE: the trials are split into the best `gamma`
+fraction and the rest, each dimension gets a Parzen (gaussian mixture) density for both
+groups and the next points are the ones maximizing `l(x) / g(x)` among draws from `l(x)`.
+'''
+
+import math
+from typing import Any
+
+import numpy as np
+
+
+class Dimension:
+    '''One axis of the search space'''
+
+    def __init__(self, name: str, values: list, integer: bool = False):
+        self.name = name
+        self.choices = None
+        self.log = False
+        self.integer = integer
+
+        if len(values) == 2 and all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in values):
+            self.low, self.high = float(min(values)), float(max(values))
+            self.log = self.low > 0 and self.high / self.low >= 100
+        else:
+            self.choices = list(values)
+
+    @property
+    def categorical(self) -> bool:
+        return self.choices is not None
+
+    def to_unit(self, value) -> float:
+        '''Map a value of a numeric dimension to [0, 1]'''
+        if self.log:
+            return (math.log(value) - math.log(self.low)) / (math.log(self.high) - math.log(self.low))
+        return 0.5 if self.high == self.low else (value - self.low) / (self.high - self.low)
+
+    def from_unit(self, u: float):
+        '''Map a point of [0, 1] back to a value of a numeric dimension'''
+        u = min(max(u, 0.), 1.)
+        if self.log:
+            value = math.exp(math.log(self.low) + u * (math.log(self.high) - math.log(self.low)))
+        else:
+            value = self.low + u * (self.high - self.low)
+        return int(round(value)) if self.integer else value
+
+    def __repr__(self) -> str:
+        if self.categorical:
+            return f'Dimension({self.name}, choices={self.choices})'
+        return f'Dimension({self.name}, [{self.low}, {self.high}], {"int" if self.integer else "float"}{", log" if self.log else ""})'
+
+
+def search_space(parameters: dict[str, list], integer_parameters: tuple[str, ...] | set[str] = ()) -> list[Dimension]:
+    '''Build the search space from the parameter lists of the configuration'''
+    return [Dimension(name, values, name in integer_parameters) for name, values in parameters.items()]
+
+
+class TPESampler:
+    '''Independent TPE sampler (scores are maximized)
+
+    Parameters
+    ----------
+    `space`: `list[Dimension]`
+        Search space, see `search_space`
+    `n_startup`: `int`
+        Number of random trials before the densities are used
+    `gamma`: `float`
+        Fraction of the trials considered as good
+    `n_ei_candidates`: `int`
+        Number of draws from `l(x)` among which the best ratio is chosen
+    '''
+
+    def __init__(self, space: list[Dimension], n_startup: int = 10, gamma: float = 0.25, n_ei_candidates: int = 24,
+                 random_state: int | None = None):
+        self.space = space
+        self.n_startup = n_startup
+        self.gamma = gamma
+        self.n_ei_candidates = n_ei_candidates
+        self.rng = np.random.default_rng(random_state)
+        self.trials: list[tuple[dict[str, Any], float]] = []
+
+    def tell(self, params: dict[str, Any], score: float) -> None:
+        '''Record the (mean cross-validated) score of a trial, `nan` for failed trials'''
+        self.trials.append((params, -np.inf if score is None or np.isnan(score) else score))
+
+    def ask(self, n: int = 1) -> list[dict[str, Any]]:
+        '''Propose the next `n` points (evaluated as one parallel batch)'''
+
+        if len(self.trials) < self.n_startup:
+            return [self._random() for _ in range(n)]
+
+        scores = np.array([score for _, score in self.trials])
+        n_good = max(1, int(math.ceil(self.gamma * len(self.trials))))
+        order = np.argsort(-scores, kind='stable')
+        good = [self.trials[i][0] for i in order[:n_good]]
+        bad = [self.trials[i][0] for i in order[n_good:]] or good
+
+        return [
+            {dim.name: self._sample(dim, [p[dim.name] for p in good], [p[dim.name] for p in bad]) for dim in self.space}
+            for _ in range(n)
+        ]
+
+    def _random(self) -> dict[str, Any]:
+        return {
+            dim.name: dim.choices[self.rng.integers(len(dim.choices))] if dim.categorical else dim.from_unit(self.rng.random())
+            for dim in self.space
+        }
+
+    def _sample(self, dim: Dimension, good: list, bad: list):
+        if dim.categorical:
+            l_weights = self._categorical_weights(dim, good)
+            g_weights = self._categorical_weights(dim, bad)
+            draws = self.rng.choice(len(dim.choices), size=self.n_ei_candidates, p=l_weights)
+            best = draws[np.argmax(np.log(l_weights[draws]) - np.log(g_weights[draws]))]
+            return dim.choices[best]
+
+        good_u = np.array([dim.to_unit(v) for v in good])
+        bad_u = np.array([dim.to_unit(v) for v in bad])
+        l_mu, l_sigma = self._parzen(good_u)
+        g_mu, g_sigma = self._parzen(bad_u)
+
+        components = self.rng.integers(l_mu.size, size=self.n_ei_candidates)
+        draws = np.clip(self.rng.normal(l_mu[components], l_sigma[components]), 0., 1.)
+        ratio = self._log_density(draws, l_mu, l_sigma) - self._log_density(draws, g_mu, g_sigma)
+        return dim.from_unit(draws[np.argmax(ratio)])
+
+    @staticmethod
+    def _categorical_weights(dim: Dimension, observed: list) -> np.ndarray:
+        ## One prior count per choice
+        weights = np.ones(len(dim.choices))
+        for value in observed:
+            weights[dim.choices.index(value)] += 1
+        return weights / weights.sum()
+
+    @staticmethod
+    def _parzen(u: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        '''Gaussian mixture centered on the observations plus a wide prior component'''
+        mu = np.append(u, 0.5)
+        bandwidth = max(u.std() * u.size ** (-1 / 5) if u.size > 1 else 0.5, 0.02)
+        sigma = np.append(np.full(u.size, bandwidth), 1.)
+        return mu, sigma
+
+    @staticmethod
+    def _log_density(x: np.ndarray, mu: np.ndarray, sigma: np.ndarray) -> np.ndarray:
+        z = (x[:, None] - mu[None, :]) / sigma[None, :]
+        log_pdf = -0.5 * z**2 - np.log(sigma[None, :]) - 0.5 * math.log(2 * math.pi)
+        peak = log_pdf.max(axis=1, keepdims=True)
+        return (peak + np.log(np.exp(log_pdf - peak).mean(axis=1, keepdims=True)))[:, 0]
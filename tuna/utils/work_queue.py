@@ -0,0 +1,271 @@
+'''Work queue of the (candidate group, fold) tasks of a grid search, shared by several hosts
+
+With `search_backend: queue` the `grid` search of a subroutine runs its tasks through a SQLite
+database in `queue_path`, a directory on a filesystem shared by all the hosts (with working
+POSIX locks, as NFS with lockd). The run without `--worker` is the coordinator: it fills the
+queue, works on it like any other worker and, once every task is done, assembles and writes
+the results. Any number of `tuna -c CONFIGURATION --worker` processes, on any host, load the
+same dataset (parsed once if `dataset_cache_path` is shared too), take tasks from the queue
+and write their scores back.
+
+A task is leased for `queue_lease_seconds`, the lease being renewed while the worker is alive;
+the tasks of a worker which disappears are leased again once their lease expires, up to
+`MAX_ATTEMPTS` times. The queue file is named after the fingerprint of the search (estimator,
+grid, scoring, dataset and folds), so every process of the same configuration finds the same
+queue and the tasks already done are reused if the coordinator is restarted.
+'''
+
+import hashlib
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Iterable, Iterator
+
+import numpy as np
+
+from tuna.utils.helpers import create_logger
+
+SEARCH_BACKENDS = ('joblib', 'queue')
+MAX_ATTEMPTS = 3
+
+Task = tuple[int, int]
+
+
+class WorkQueue:
+    '''SQLite queue of `(group, fold)` tasks and of their `(score, fit_time, score_time)` results
+
+    Parameters
+    ----------
+    `path`: `str`
+        Shared directory of the queue files
+    `name`: `str`
+        Prefix of the file name (usually the `output_name`)
+    `fingerprint`: `dict`
+        Description of the search, its hash identifies the queue
+    `lease_seconds`: `float`
+        Time after which a task not reported by its worker is given to another one
+    `poll_seconds`: `float`
+        Interval between two looks at the queue when there is nothing to lease
+    '''
+
+    def __init__(self, path: str, name: str, fingerprint: dict[str, Any], lease_seconds: float = 600., poll_seconds: float = 5.):
+        digest = hashlib.sha256(json.dumps(fingerprint, sort_keys=True, default=repr).encode()).hexdigest()[:16]
+        directory = Path(os.path.expandvars(path)).expanduser()
+        directory.mkdir(parents=True, exist_ok=True)
+
+        self.path = directory / f'{name}_{digest}.sqlite'
+        self.lease_seconds = lease_seconds
+        self.poll_seconds = poll_seconds
+        self.owner = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        ## Autocommit, the transactions are explicit. No WAL, it needs shared memory on a single host
+        connection = sqlite3.connect(self.path, timeout=120, isolation_level=None)
+        try:
+            connection.execute('PRAGMA journal_mode=DELETE')
+            yield connection
+        finally:
+            connection.close()
+
+    def create(self) -> None:
+        '''Create the queue (coordinator side), keeping only the tasks done by a previous run'''
+
+        with self._connect() as connection:
+            connection.executescript('''
+                BEGIN IMMEDIATE;
+                CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value REAL);
+                CREATE TABLE IF NOT EXISTS tasks (
+                    grp INTEGER, fold INTEGER, state TEXT, owner TEXT, lease_until REAL, attempts INTEGER,
+                    PRIMARY KEY (grp, fold)
+                );
+                CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state, lease_until);
+                CREATE TABLE IF NOT EXISTS results (
+                    grp INTEGER, fold INTEGER, position INTEGER, score REAL, fit_time REAL, score_time REAL,
+                    PRIMARY KEY (grp, fold, position)
+                );
+                DELETE FROM tasks WHERE state != 'done';
+                INSERT OR REPLACE INTO meta VALUES ('finished', 0);
+                COMMIT;
+            ''')
+        self._beat()
+
+    def wait(self, timeout: float) -> bool:
+        '''Wait (worker side) up to `timeout` seconds for the coordinator to create the queue'''
+
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.path.exists():
+                try:
+                    with self._connect() as connection:
+                        if connection.execute("SELECT 1 FROM meta WHERE key = 'finished'").fetchone():
+                            return True
+                except sqlite3.DatabaseError:
+                    pass
+            time.sleep(self.poll_seconds)
+        return False
+
+    def _beat(self) -> None:
+        '''Record that the coordinator is alive'''
+
+        with self._connect() as connection:
+            connection.execute("INSERT OR REPLACE INTO meta VALUES ('coordinator', ?)", (time.time(),))
+
+    def submit(self, tasks: Iterable[Task]) -> None:
+        '''Add the tasks not queued yet'''
+
+        with self._connect() as connection:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.executemany(
+                "INSERT OR IGNORE INTO tasks VALUES (?, ?, 'pending', NULL, 0, 0)", [(int(group), int(fold)) for group, fold in tasks]
+            )
+            connection.execute('COMMIT')
+
+    def lease(self, n: int) -> list[Task]:
+        '''Take up to `n` tasks, pending or whose lease expired'''
+
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute('BEGIN IMMEDIATE')
+            abandoned = connection.execute(
+                "UPDATE tasks SET state = 'failed' WHERE state = 'leased' AND lease_until < ? AND attempts >= ?", (now, MAX_ATTEMPTS)
+            ).rowcount
+            tasks = connection.execute(
+                "SELECT grp, fold FROM tasks WHERE state = 'pending' OR (state = 'leased' AND lease_until < ?) ORDER BY fold, grp LIMIT ?",
+                (now, n)
+            ).fetchall()
+            connection.executemany(
+                "UPDATE tasks SET state = 'leased', owner = ?, lease_until = ?, attempts = attempts + 1 WHERE grp = ? AND fold = ?",
+                [(self.owner, now + self.lease_seconds, group, fold) for group, fold in tasks]
+            )
+            connection.execute('COMMIT')
+        if abandoned:
+            create_logger(__name__).warning('%d tasks failed %d times (workers lost?), they are scored nan', abandoned, MAX_ATTEMPTS)
+        return tasks
+
+    def complete(self, task: Task, output: list[tuple[float, float, float]]) -> None:
+        '''Store the results of the members of a task and mark it done'''
+
+        group, fold = task
+        with self._connect() as connection:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.executemany(
+                'INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)',
+                [(int(group), int(fold), position, *(float(value) for value in result)) for position, result in enumerate(output)]
+            )
+            connection.execute("UPDATE tasks SET state = 'done', owner = NULL WHERE grp = ? AND fold = ?", (int(group), int(fold)))
+            connection.execute('COMMIT')
+
+    @contextmanager
+    def heartbeat(self, coordinator: bool = False) -> Iterator[None]:
+        '''Renew the leases of this process (and tell the workers the coordinator is alive) while the tasks run'''
+
+        stop = threading.Event()
+
+        def __renew() -> None:
+            while not stop.wait(self.lease_seconds / 3):
+                with self._connect() as connection:
+                    connection.execute(
+                        "UPDATE tasks SET lease_until = ? WHERE owner = ? AND state = 'leased'", (time.time() + self.lease_seconds, self.owner)
+                    )
+                if coordinator:
+                    self._beat()
+
+        thread = threading.Thread(target=__renew, name='queue-heartbeat', daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    def counts(self, folds: list[int]) -> dict[str, int]:
+        '''Number of tasks of `folds` in every state'''
+
+        with self._connect() as connection:
+            return dict(connection.execute(
+                f'SELECT state, COUNT(*) FROM tasks WHERE fold IN ({",".join("?" * len(folds))}) GROUP BY state', [int(fold) for fold in folds]
+            ).fetchall())
+
+    def results(self, tasks: list[Task], sizes: list[int]) -> Iterator[tuple[Task, list[tuple[float, float, float]]]]:
+        '''The results of `tasks` (with `sizes` members each), `nan` for the failed ones'''
+
+        with self._connect() as connection:
+            for (group, fold), size in zip(tasks, sizes):
+                output = [(np.nan, np.nan, np.nan)] * size
+                for position, score, fit_time, score_time in connection.execute(
+                    'SELECT position, score, fit_time, score_time FROM results WHERE grp = ? AND fold = ?', (int(group), int(fold))
+                ):
+                    ## SQLite stores nan (failed fits) as NULL
+                    output[position] = (np.nan if score is None else score, fit_time, score_time)
+                yield (group, fold), output
+
+    def serve(self, evaluate: Callable[[list[Task]], Iterable[tuple[Task, list]]], batch_size: int, until: Callable[[], bool],
+              coordinator: bool = False) -> int:
+        '''Lease `batch_size` tasks at a time and run them with `evaluate` until `until()`
+
+        Return
+        ------
+        The number of tasks run by this process
+        '''
+
+        done = 0
+        with self.heartbeat(coordinator):
+            while True:
+                if coordinator:
+                    self._beat()
+                tasks = self.lease(batch_size)
+                if tasks:
+                    for task, output in evaluate(tasks):
+                        self.complete(task, output)
+                        done += 1
+                    continue
+                if until():
+                    return done
+                time.sleep(self.poll_seconds)
+
+    def run(self, tasks: list[Task], sizes: list[int], evaluate: Callable, batch_size: int) -> Iterator[tuple[Task, list]]:
+        '''Coordinator side: queue `tasks`, work on them with the workers and return their results'''
+
+        self.submit(tasks)
+        folds = sorted({fold for _, fold in tasks})
+        last = [None]
+
+        def __complete() -> bool:
+            counts = self.counts(folds)
+            remaining = counts.get('pending', 0) + counts.get('leased', 0)
+            if remaining != last[0]:
+                print(f'[queue] {remaining} tasks left, {counts.get("leased", 0)} running')
+                last[0] = remaining
+            return remaining == 0
+
+        done = self.serve(evaluate, batch_size, __complete, coordinator=True)
+        print(f'[queue] {done}/{len(tasks)} tasks run by the coordinator')
+        return self.results(tasks, sizes)
+
+    def work(self, evaluate: Callable, batch_size: int) -> int:
+        '''Worker side: run tasks until the coordinator is done (or gone for `queue_lease_seconds`)'''
+
+        def __stop() -> bool:
+            with self._connect() as connection:
+                meta = dict(connection.execute('SELECT key, value FROM meta').fetchall())
+            if meta.get('finished'):
+                return True
+            if time.time() - meta.get('coordinator', 0) > self.lease_seconds:
+                create_logger(__name__).warning('No sign of the coordinator for %s s, stopping', self.lease_seconds)
+                return True
+            return False
+
+        return self.serve(evaluate, batch_size, __stop)
+
+    def finish(self) -> None:
+        '''Tell the workers the search is over'''
+
+        with self._connect() as connection:
+            connection.execute("INSERT OR REPLACE INTO meta VALUES ('finished', 1)")
@@ -0,0 +1,216 @@
+'''XGBoost-native cross-validation engine (`xgb_engine: native` in `XGBKFoldCV`)
+
+Instead of one `XGBClassifier` per (candidate, fold), which converts and bins the NumPy
+features every time, every fold is quantized once into a `QuantileDMatrix` the first time
+it is needed, and reused by all the candidates. The histogram cuts of a fold come from its
+training rows only; its held-out rows are binned with the same cuts (`ref=`). Every
+(candidate, fold) is trained with `xgb.train` (`tree_method='hist'`) and scored on the
+held-out fold with the scikit-learn `scoring`.
+
+With `early_stopping_rounds` the rounds are chosen on a validation part of the training
+rows of the fold (`validation_fraction`), not on the held-out fold, so that the scores are
+not biased in favour of the early stopped candidates.
+
+The models run in threads (XGBoost releases the GIL), `n_concurrent` at a time with
+`nthread` threads each, chosen so that their product fits the available cores.
+'''
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any
+
+import numpy as np
+import xgboost as xgb
+from sklearn.base import BaseEstimator, ClassifierMixin
+from sklearn.metrics import get_scorer
+from sklearn.model_selection import ParameterGrid
+
+from tuna.utils.helpers import create_logger
+from tuna.utils.resources import numa_node_cpus, resolve_n_jobs
+from tuna.utils.search import assemble_cv_results, prune_candidates
+
+
+class PredictionView(ClassifierMixin, BaseEstimator):
+    '''Binary classifier answering with precomputed probabilities, for the scikit-learn scorers'''
+
+    def __init__(self, probabilities: np.ndarray | None = None, classes: np.ndarray | None = None):
+        self.probabilities = probabilities
+        self.classes = classes
+
+    @property
+    def classes_(self) -> np.ndarray:
+        return self.classes
+
+    def predict_proba(self, X) -> np.ndarray:
+        return np.column_stack((1 - self.probabilities, self.probabilities))
+
+    def predict(self, X) -> np.ndarray:
+        return self.classes[(self.probabilities > 0.5).astype(int)]
+
+
+def thread_layout(n_jobs: int | str | None, n_tasks: int, nthread: int | None = None) -> tuple[int, int]:
+    '''Split the cores between concurrent models and threads per model.
+
+    `n_jobs` is the total CPU budget (capped at the cores available to the process, `auto`,
+    `-1` or `None` for all). Unless forced with `nthread`, each model gets 4 threads (the hist
+    method scales well up to there), or more when there are fewer tasks than the budget allows,
+    but never more than the cores of a NUMA node.
+
+    Return
+    ------
+    `(n_concurrent, nthread)`
+    '''
+
+    budget = resolve_n_jobs(n_jobs)
+    if nthread is None:
+        nthread = min(budget, max(4, budget // max(1, n_tasks)), max(numa_node_cpus()))
+    n_concurrent = max(1, min(n_tasks, budget // nthread))
+    return n_concurrent, nthread
+
+
+class NativeXGBSearchCV:
+    '''Exhaustive grid search on top of `xgb.train` with shared quantized fold matrices.
+
+    The grid uses the `XGBClassifier` parameter names, `n_estimators` being the maximum
+    number of boosting rounds. The `cv_results_` follow the `GridSearchCV` layout, with the
+    extra `mean_best_iteration` column when early stopping is enabled (`validation_fraction`
+    of the training rows of each fold being kept aside to choose the rounds).
+
+    With `pruning_percentile` the folds are trained one after the other and the hopeless
+    candidates are pruned between them, as in `FoldSearchCV`.
+    '''
+
+    def __init__(self, param_grid: dict[str, list], cv, scoring=None, n_jobs=None, early_stopping_rounds: int | None = None,
+                 nthread: int | None = None, max_bin: int = 256, random_state: int | None = None, verbose: int = 1,
+                 pruning_percentile: float | None = None, pruning_min_folds: int = 1, validation_fraction: float = 0.1):
+        self.param_grid = param_grid
+        self.cv = cv
+        self.scoring = scoring
+        self.n_jobs = n_jobs
+        self.early_stopping_rounds = early_stopping_rounds
+        self.nthread = nthread
+        self.max_bin = max_bin
+        self.random_state = random_state
+        self.verbose = verbose
+        self.pruning_percentile = pruning_percentile
+        self.pruning_min_folds = pruning_min_folds
+        self.validation_fraction = validation_fraction
+
+    def fit(self, X, y, sample_weight: np.ndarray | None = None) -> 'NativeXGBSearchCV':
+        folds = list(self.cv.split(X, y)) if hasattr(self.cv, 'split') else list(self.cv)
+        candidates = list(ParameterGrid(self.param_grid))
+
+        n_concurrent, nthread = thread_layout(self.n_jobs, len(candidates) * len(folds), self.nthread)
+        print(f'Fitting {len(folds)} folds for each of {len(candidates)} candidates, totalling {len(candidates) * len(folds)} '
+              f'fits ({n_concurrent} concurrent models x {nthread} threads)')
+
+        start = time.perf_counter()
+
+        def __matrix(rows: np.ndarray, ref=None):
+            weight = None if sample_weight is None else sample_weight[rows]
+            return xgb.QuantileDMatrix(X[rows], label=y[rows], weight=weight, ref=ref, max_bin=self.max_bin, nthread=nthread)
+
+        def __fold_data(fold: int):
+            train, test = folds[fold]
+            dvalid = None
+            if self.early_stopping_rounds:
+                rng = np.random.default_rng(None if self.random_state is None else self.random_state + fold)
+                train = rng.permutation(train)
+                n_valid = max(1, int(round(train.size * self.validation_fraction)))
+                valid, train = np.sort(train[:n_valid]), np.sort(train[n_valid:])
+            ## The cuts come from the training rows, the other matrices reuse them
+            dtrain = __matrix(train)
+            if self.early_stopping_rounds:
+                dvalid = __matrix(valid, ref=dtrain)
+            ## The fold labels, the view does not look at the features
+            return dtrain, dvalid, __matrix(test, ref=dtrain), y[test]
+
+        return self._search(candidates, len(folds), __fold_data, np.unique(y), n_concurrent, nthread, start)
+
+    def _search(self, candidates: list[dict[str, Any]], n_folds: int, fold_data, classes: np.ndarray,
+                n_concurrent: int, nthread: int, start: float):
+        '''Train and score every (candidate, fold) and fill `cv_results_`.
+
+        `fold_data(fold)` returns the `(dtrain, dvalid, dtest, test_labels)` of a fold (`dvalid`,
+        for early stopping, `None` without it), it is called the first time the fold is needed
+        and the matrices are freed once all the candidates are done with it.
+        '''
+
+        scorer = get_scorer(self.scoring or 'accuracy')
+        fold_matrices: dict[int, tuple] = {}
+        fold_locks = [threading.Lock() for _ in range(n_folds)]
+
+        def __fold_matrices(fold: int):
+            with fold_locks[fold]:
+                if fold not in fold_matrices:
+                    fold_matrices[fold] = fold_data(fold)
+                return fold_matrices[fold]
+
+        def __evaluate(idx: int, fold: int) -> tuple[float, float, float, float]:
+            dtrain, dvalid, dtest, labels = __fold_matrices(fold)
+            parameters = self._booster_parameters(candidates[idx], nthread)
+            num_boost_round = parameters.pop('n_estimators', 100)
+
+            fit_start = time.perf_counter()
+            booster = xgb.train(
+                parameters, dtrain, num_boost_round=num_boost_round, evals=[] if dvalid is None else [(dvalid, 'validation')],
+                early_stopping_rounds=self.early_stopping_rounds, verbose_eval=False
+            )
+            fit_time = time.perf_counter() - fit_start
+
+            score_start = time.perf_counter()
+            best_iteration = booster.best_iteration if self.early_stopping_rounds else num_boost_round - 1
+            probabilities = booster.predict(dtest, iteration_range=(0, best_iteration + 1))
+            score = scorer(PredictionView(probabilities, classes), probabilities[:, None], labels)
+            return score, fit_time, time.perf_counter() - score_start, best_iteration + 1
+
+        results = np.full((len(candidates), n_folds, 4), np.nan)
+        pruned = np.zeros(len(candidates), dtype=bool)
+        n_tasks, done = len(candidates) * n_folds, 0
+        ## Fold-major order: each fold matrix is built once, shared by the candidates and freed when done
+        rounds = [[fold] for fold in range(n_folds)] if self.pruning_percentile is not None else [list(range(n_folds))]
+        with ThreadPoolExecutor(max_workers=n_concurrent) as executor:
+            for round_folds in rounds:
+                tasks = [(idx, fold) for fold in round_folds for idx in np.flatnonzero(~pruned)]
+                remaining = {fold: int((~pruned).sum()) for fold in round_folds}
+                futures = {executor.submit(__evaluate, idx, fold): (idx, fold) for idx, fold in tasks}
+                for future in as_completed(futures):
+                    idx, fold = futures[future]
+                    try:
+                        results[idx, fold] = future.result()
+                    except Exception as e:
+                        create_logger(__name__).warning('Fit failed for %s\n%s', candidates[idx], e)
+                    remaining[fold] -= 1
+                    if not remaining[fold]:
+                        with fold_locks[fold]:
+                            fold_matrices.pop(fold, None)
+                    done += 1
+                    if self.verbose and (done % max(1, n_tasks // 20) == 0 or done == n_tasks):
+                        print(f'[native xgb] {done}/{n_tasks} fits, elapsed {time.perf_counter() - start:.1f} s')
+
+                newly = prune_candidates(
+                    results[:, :, 0], pruned, round_folds[-1] + 1, self.pruning_percentile, self.pruning_min_folds
+                )
+                if newly.any():
+                    pruned |= newly
+                    n_tasks -= int(newly.sum()) * (n_folds - round_folds[-1] - 1)
+                    print(f'[pruning] after {round_folds[-1] + 1} folds: {newly.sum()} candidates pruned, '
+                          f'{len(candidates) - pruned.sum()} left')
+
+        self.cv_results_ = assemble_cv_results(
+            candidates, results[:, :, 0], results[:, :, 1], results[:, :, 2],
+            pruned=pruned if self.pruning_percentile is not None else None
+        )
+        if self.early_stopping_rounds:
+            self.cv_results_['mean_best_iteration'] = np.nanmean(results[:, :, 3], axis=1)
+        return self
+
+    def _booster_parameters(self, candidate: dict[str, Any], nthread: int) -> dict[str, Any]:
+        parameters = {
+            'objective': 'binary:logistic', 'tree_method': 'hist', 'max_bin': self.max_bin,
+            'eval_metric': 'logloss', 'nthread': nthread, 'verbosity': 0, **candidate
+        }
+        if self.random_state is not None:
+            parameters['seed'] = self.random_state
+        return parameters